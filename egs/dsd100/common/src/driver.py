@@ -5,6 +5,9 @@ import torch
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.async_writer import AsyncCheckpointWriter
+from utils.prefetch import wrap_prefetch_loader
+from utils.profiler import wrap_profiled_loader
 from utils.utils_audio import write_wav
 
 class Trainer:
@@ -31,6 +34,8 @@ class Trainer:
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = AsyncCheckpointWriter()
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
@@ -38,6 +43,12 @@ class Trainer:
         
         self.use_cuda = args.use_cuda
         
+        # Stage next batches on background thread if `--prefetch` is given, and report data wait time every epoch.
+        self.train_loader = wrap_prefetch_loader(self.train_loader, args, use_cuda=self.use_cuda)
+        
+        # Measure time of data loading, forward, backward, etc. every epoch if `--profile` is given.
+        self.train_loader = wrap_profiled_loader(self.train_loader, self.model, self.optimizer, args, use_cuda=self.use_cuda)
+        
         if args.continue_from:
             package = torch.load(args.continue_from, map_location=lambda storage, loc: storage)
             
@@ -80,11 +91,12 @@ class Trainer:
             self.train_loss[epoch] = train_loss
             self.valid_loss[epoch] = valid_loss
             
+            model_paths = []
+            
             if valid_loss < self.best_loss:
                 self.best_loss = valid_loss
                 self.no_improvement = 0
-                model_path = os.path.join(self.model_dir, "best.pth")
-                self.save_model(epoch, model_path)
+                model_paths.append(os.path.join(self.model_dir, "best.pth"))
             else:
                 self.no_improvement += 1
                 if self.no_improvement >= 5:
@@ -97,11 +109,14 @@ class Trainer:
                         print("Learning rate: {} -> {}".format(prev_lr, lr))
                         param_group['lr'] = lr
             
-            model_path = os.path.join(self.model_dir, "last.pth")
-            self.save_model(epoch, model_path)
+            # best.pth is identical to last.pth in this epoch, so it is serialized only once.
+            model_paths.append(os.path.join(self.model_dir, "last.pth"))
+            self.save_model(epoch, model_paths)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1].clone(), valid_loss=self.valid_loss[:epoch + 1].clone(), save_path=save_path)
+        
+        self.checkpoint_writer.close()
     
     def run_one_epoch(self, epoch):
         """
@@ -204,4 +219,4 @@ class Trainer:
         
         package['epoch'] = epoch + 1
         
-        torch.save(package, model_path)
\ No newline at end of file
+        self.checkpoint_writer.save(package, model_path)
\ No newline at end of file
@@ -1,10 +1,16 @@
 import os
+import math
 import random
+import functools
 
 import torch
 import torchaudio
+from torch.utils.data.dataloader import default_collate
 
-from utils.utils_audio import build_window
+from utils.utils_audio import build_window, BatchSTFT
+from utils.manifest import SegmentIndex
+from utils.audio_cache import DecodedAudioCache
+from utils.resampled_corpus import build_resampled_corpus, load_resampled_corpus
 
 __sources__ = ['bass', 'drums', 'other', 'vocals']
 
@@ -50,7 +56,7 @@ class WaveDataset(MUSDB18Dataset):
         """
         super().__init__(musdb18_root, sample_rate=sample_rate, sources=sources, target=target)
 
-        self.json_data = None
+        self.segments = None
 
     def __getitem__(self, idx):
         """
@@ -61,14 +67,10 @@ class WaveDataset(MUSDB18Dataset):
             target <torch.Tensor>: (len(target), n_mics, T) if `target` is list, otherwise (n_mics, T)
             name <str>: Artist and title of track
         """
-        data = self.json_data[idx]
-
-        trackID = data['trackID']
+        trackID, start, samples = self.segments[idx]
         track = self.tracks[trackID]
         name = track['name']
         paths = track['path']
-        start = data['start']
-        samples = data['samples']
 
         if set(self.sources) == set(__sources__):
             mixture, _ = torchaudio.load(paths['mixture'], frame_offset=start, num_frames=samples)
@@ -93,7 +95,7 @@ class WaveDataset(MUSDB18Dataset):
         return mixture, target, name
 
     def __len__(self):
-        return len(self.json_data)
+        return len(self.segments)
 
 class WaveTrainDataset(WaveDataset):
     def __init__(self, musdb18_root, sample_rate=SAMPLE_RATE_MUSDB18, samples=4*SAMPLE_RATE_MUSDB18, overlap=None, sources=__sources__, target=None, include_valid=False):
@@ -124,7 +126,7 @@ class WaveTrainDataset(WaveDataset):
             overlap = samples // 2
 
         self.tracks = []
-        self.json_data = []
+        lengths = []
 
         for trackID, name in enumerate(names):
             mixture_path = os.path.join(musdb18_root, 'train', name, "mixture.wav")
@@ -144,16 +146,9 @@ class WaveTrainDataset(WaveDataset):
                 track['path'][source] = os.path.join(musdb18_root, 'train', name, "{}.wav".format(source))
             
             self.tracks.append(track)
+            lengths.append(track_samples)
 
-            for start in range(0, track_samples, samples - overlap):
-                if start + samples >= track_samples:
-                    break
-                data = {
-                    'trackID': trackID,
-                    'start': start,
-                    'samples': samples,
-                }
-                self.json_data.append(data)
+        self.segments = SegmentIndex.from_lengths(names, lengths, samples=samples, overlap=overlap, strict=True)
         
     def __getitem__(self, idx):
         """
@@ -180,7 +175,7 @@ class WaveEvalDataset(WaveDataset):
         self.max_samples = max_samples
 
         self.tracks = []
-        self.json_data = []
+        lengths = []
 
         for trackID, name in enumerate(names):
             mixture_path = os.path.join(musdb18_root, 'train', name, "mixture.wav")
@@ -196,26 +191,13 @@ class WaveEvalDataset(WaveDataset):
                 }
             }
 
-            if max_samples is None:
-                samples = track_samples
-            else:
-                if track_samples < max_samples:
-                    samples = track_samples
-                else:
-                    samples = max_samples
-
             for source in sources:
                 track['path'][source] = os.path.join(musdb18_root, 'train', name, "{}.wav".format(source))
             
             self.tracks.append(track)
+            lengths.append(track_samples)
 
-            data = {
-                'trackID': trackID,
-                'start': 0,
-                'samples': samples
-            }
-
-            self.json_data.append(data)
+        self.segments = SegmentIndex.from_lengths(names, lengths, max_samples=max_samples)
         
     def __getitem__(self, idx):
         """
@@ -240,7 +222,7 @@ class WaveTestDataset(WaveDataset):
                 names.append(name)
         
         self.tracks = []
-        self.json_data = []
+        lengths = []
 
         for trackID, name in enumerate(names):
             mixture_path = os.path.join(musdb18_root, 'test', name, "mixture.wav")
@@ -260,14 +242,9 @@ class WaveTestDataset(WaveDataset):
                 track['path'][source] = os.path.join(musdb18_root, 'test', name, "{}.wav".format(source))
             
             self.tracks.append(track)
+            lengths.append(track_samples)
 
-            data = {
-                'trackID': trackID,
-                'start': 0,
-                'samples': track_samples
-            }
-
-            self.json_data.append(data)
+        self.segments = SegmentIndex.from_lengths(names, lengths)
 
 class SpectrogramDataset(WaveDataset):
     def __init__(self, musdb18_root, fft_size, hop_size=None, window_fn='hann', normalize=False, sample_rate=SAMPLE_RATE_MUSDB18, sources=__sources__, target=None):
@@ -286,6 +263,11 @@ class SpectrogramDataset(WaveDataset):
         
         self.normalize = normalize
 
+        # Set by SpectrogramTrainDataLoader. If True, `__getitem__` returns waveforms and STFT is applied to collated batch.
+        self.stft_in_loader = False
+        # If True, mixture equals sum of target, so its STFT is obtained as sum of STFT of target.
+        self.mixture_is_sum = False
+
     def _is_active(self, input, threshold=1e-5):
         n_dims = input.dim()
 
@@ -314,6 +296,9 @@ class SpectrogramDataset(WaveDataset):
         n_dims = mixture.dim()
         T = mixture.size(-1)
 
+        if self.stft_in_loader:
+            return mixture, target, T, name
+
         if n_dims > 2:
             mixture_channels = mixture.size()[:-1]
             target_channels = target.size()[:-1]
@@ -356,7 +341,7 @@ class SpectrogramTrainDataset(SpectrogramDataset):
             overlap = samples // 2
 
         self.tracks = []
-        self.json_data = []
+        lengths = []
 
         for trackID, name in enumerate(names):
             mixture_path = os.path.join(musdb18_root, 'train', name, "mixture.wav")
@@ -376,16 +361,12 @@ class SpectrogramTrainDataset(SpectrogramDataset):
                 track['path'][source] = os.path.join(musdb18_root, 'train', name, "{}.wav".format(source))
             
             self.tracks.append(track)
+            lengths.append(track_samples)
 
-            for start in range(0, track_samples, samples - overlap):
-                if start + samples >= track_samples:
-                    break
-                data = {
-                    'trackID': trackID,
-                    'start': start,
-                    'samples': samples,
-                }
-                self.json_data.append(data)
+        self.segments = SegmentIndex.from_lengths(names, lengths, samples=samples, overlap=overlap, strict=True)
+
+        # Mixture is read from `mixture.wav` when all sources are used.
+        self.mixture_is_sum = set(self.sources) != set(__sources__) and type(self.target) is list and sorted(self.target) == sorted(self.sources)
         
     def __getitem__(self, idx):
         """
@@ -409,7 +390,7 @@ class SpectrogramEvalDataset(SpectrogramDataset):
         self.max_samples = max_samples
 
         self.tracks = []
-        self.json_data = []
+        lengths = []
 
         for trackID, name in enumerate(names):
             mixture_path = os.path.join(musdb18_root, 'train', name, "mixture.wav")
@@ -425,26 +406,13 @@ class SpectrogramEvalDataset(SpectrogramDataset):
                 }
             }
 
-            if max_samples is None:
-                samples = track_samples
-            else:
-                if track_samples < max_samples:
-                    samples = track_samples
-                else:
-                    samples = max_samples
-
             for source in sources:
                 track['path'][source] = os.path.join(musdb18_root, 'train', name, "{}.wav".format(source))
             
             self.tracks.append(track)
+            lengths.append(track_samples)
 
-            data = {
-                'trackID': trackID,
-                'start': 0,
-                'samples': samples
-            }
-
-            self.json_data.append(data)
+        self.segments = SegmentIndex.from_lengths(names, lengths, max_samples=max_samples)
         
     def __getitem__(self, idx):
         """
@@ -473,7 +441,7 @@ class SpectrogramTestDataset(SpectrogramDataset):
         self.max_samples = max_samples
 
         self.tracks = []
-        self.json_data = []
+        lengths = []
 
         for trackID, name in enumerate(names):
             mixture_path = os.path.join(musdb18_root, 'test', name, "mixture.wav")
@@ -489,26 +457,13 @@ class SpectrogramTestDataset(SpectrogramDataset):
                 }
             }
 
-            if max_samples is None:
-                samples = track_samples
-            else:
-                if track_samples < max_samples:
-                    samples = track_samples
-                else:
-                    samples = max_samples
-
             for source in sources:
                 track['path'][source] = os.path.join(musdb18_root, 'test', name, "{}.wav".format(source))
             
             self.tracks.append(track)
+            lengths.append(track_samples)
 
-            data = {
-                'trackID': trackID,
-                'start': 0,
-                'samples': samples
-            }
-
-            self.json_data.append(data)
+        self.segments = SegmentIndex.from_lengths(names, lengths, max_samples=max_samples)
         
     def __getitem__(self, idx):
         """
@@ -526,13 +481,16 @@ class SpectrogramTestDataset(SpectrogramDataset):
     Augmentation dataset
 """
 class AugmentationWaveTrainDataset(WaveDataset):
-    def __init__(self, musdb18_root, sample_rate=SAMPLE_RATE_MUSDB18, duration=4, overlap=None, samples_per_epoch=None, sources=__sources__, target=None, include_valid=False, augmentation=None):
+    def __init__(self, musdb18_root, sample_rate=SAMPLE_RATE_MUSDB18, duration=4, overlap=None, samples_per_epoch=None, sources=__sources__, target=None, include_valid=False, augmentation=None, cache_bytes=None, resampled_root=None):
         """
         Args:
             musdb18_root <int>: Path to MUSDB or MUSDB-HQ
             sample_rate: Sampling frequency. Default: 44100
             sources <list<str>>: Sources included in mixture
             target <str> or <list<str>>: Target source(s)
+            cache_bytes <int>: Budget of decoded track cache per worker in bytes. If None, every crop is read from disk.
+            resampled_root <str>: Root directory of resampled corpora built by `build_resampled_musdb18`. Default: `<musdb18_root>/.resampled`
+                If resampled corpus at `sample_rate` is found, it is used instead of resampling every crop.
         """
         super().__init__(
             musdb18_root,
@@ -561,6 +519,18 @@ class AugmentationWaveTrainDataset(WaveDataset):
         self.sample_rate = sample_rate
         self.samples = int(duration * sample_rate)
         self.augmentation = augmentation
+        self.return_sources = False
+
+        if cache_bytes:
+            self.cache = DecodedAudioCache(cache_bytes)
+        else:
+            self.cache = None
+
+        if sample_rate != SAMPLE_RATE_MUSDB18:
+            rel_paths = [os.path.join('train', name, "{}.wav".format(source)) for name in names for source in ['mixture'] + sources]
+            self.resampled_corpus = load_resampled_corpus(musdb18_root, sample_rate, rel_paths=rel_paths, cache_root=resampled_root)
+        else:
+            self.resampled_corpus = None
 
         self.tracks = []
 
@@ -568,78 +538,89 @@ class AugmentationWaveTrainDataset(WaveDataset):
             total_duration = 0
 
             for trackID, name in enumerate(names):
-                mixture_path = os.path.join(musdb18_root, 'train', name, "mixture.wav")
-                audio_info = torchaudio.info(mixture_path)
-                track_sample_rate = audio_info.sample_rate
-                track_samples = audio_info.num_frames
-
-                track = {
-                    'name': name,
-                    'samples_original': track_samples,
-                    'path': {
-                        'mixture': mixture_path
-                    }
-                }
-                
-                for source in sources:
-                    track['path'][source] = os.path.join(musdb18_root, 'train', name, "{}.wav".format(source))
-                
+                track, track_sample_rate = self._build_track(musdb18_root, name)
                 self.tracks.append(track)
 
-                track_duration = track_samples / track_sample_rate
+                track_duration = track['samples_original'] / track_sample_rate
                 total_duration += track_duration
 
             if samples_per_epoch is None:
                 samples_per_epoch = int(total_duration / duration)
 
             self.samples_per_epoch = samples_per_epoch
-            self.json_data = None
+            self.segments = None
         else:
-            samples_original = int(self.samples * SAMPLE_RATE_MUSDB18 / sample_rate)
+            if self.resampled_corpus is None:
+                samples_original = int(self.samples * SAMPLE_RATE_MUSDB18 / sample_rate)
+            else:
+                samples_original = self.samples
 
             if overlap is None:
                 overlap = samples_original // 2
             self.samples_per_epoch = None
+            lengths = []
 
             for trackID, name in enumerate(names):
-                mixture_path = os.path.join(musdb18_root, 'train', name, "mixture.wav")
-                audio_info = torchaudio.info(mixture_path)
-                track_sample_rate = audio_info.sample_rate
-                track_samples = audio_info.num_frames
-
-                track = {
-                    'name': name,
-                    'samples_original': track_samples,
-                    'path': {
-                        'mixture': mixture_path
-                    }
-                }
-
-                for source in sources:
-                    track['path'][source] = os.path.join(musdb18_root, 'train', name, "{}.wav".format(source))
+                track, _ = self._build_track(musdb18_root, name)
                 self.tracks.append(track)
+                lengths.append(track['samples_original'])
 
-                for start in range(0, track_samples, self.samples - overlap):
-                    if start + self.samples >= track_samples:
-                        break
-                    data = {
-                        'trackID': trackID,
-                        'start': start,
-                        'samples_original': samples_original,
-                    }
-                    self.json_data.append(data)
+            self.segments = SegmentIndex.from_lengths(names, lengths, samples=samples_original, overlap=overlap, strict=True)
 
-        if sample_rate != SAMPLE_RATE_MUSDB18:
+        if sample_rate != SAMPLE_RATE_MUSDB18 and self.resampled_corpus is None:
             self.pre_resampler = torchaudio.transforms.Resample(SAMPLE_RATE_MUSDB18, sample_rate)
         else:
             self.pre_resampler = None
 
+    def _build_track(self, musdb18_root, name):
+        """
+        Args:
+            musdb18_root <str>: Path to MUSDB or MUSDB-HQ
+            name <str>: Artist and title of track
+        Returns:
+            track <dict>: Paths and number of samples of track. If resampled corpus is available, resampled files are used.
+            track_sample_rate <int>: Sampling rate of files
+        """
+        track = {
+            'name': name,
+            'path': {}
+        }
+
+        if self.resampled_corpus is None:
+            mixture_path = os.path.join(musdb18_root, 'train', name, "mixture.wav")
+            audio_info = torchaudio.info(mixture_path)
+            track_sample_rate = audio_info.sample_rate
+            track['samples_original'] = audio_info.num_frames
+
+            for source in ['mixture'] + self.sources:
+                track['path'][source] = os.path.join(musdb18_root, 'train', name, "{}.wav".format(source))
+        else:
+            track_sample_rate = self.resampled_corpus.sample_rate
+            mixture_path = os.path.join('train', name, "mixture.wav")
+            track['samples_original'] = self.resampled_corpus.num_frames[mixture_path]
+
+            for source in ['mixture'] + self.sources:
+                track['path'][source] = self.resampled_corpus.path(os.path.join('train', name, "{}.wav".format(source)))
+
+        return track, track_sample_rate
+
     def __getitem__(self, idx):
         """
         Returns:
             mixture <torch.Tensor>: Tensor with shape (1, n_mics, T)  if `target` is list, otherwise (n_mics, T) 
             target <torch.Tensor>: Tensor with shape (len(target), n_mics, T) if `target` is list, otherwise (n_mics, T)
+            If `return_sources=True`, only sources <torch.Tensor> with shape (len(sources), n_mics, T) are returned.
         """
+        if self.return_sources:
+            sources = self._getitem_sources()
+
+            if self.pre_resampler is not None:
+                sources_channels = sources.size()[:-1]
+                sources = self.pre_resampler(sources.reshape(-1, sources.size(-1)))
+                sources = sources.reshape(*sources_channels, sources.size(-1))
+
+            return sources
+
         if self.augmentation:
             mixture, target = self._getitem_augmentation()
         else:
@@ -664,22 +645,8 @@ class AugmentationWaveTrainDataset(WaveDataset):
             target <torch.Tensor>: (len(target), n_mics, T) if `target` is list, otherwise (n_mics, T)
             name <str>: Artist and title of track
         """
-        n_tracks = len(self.tracks)
-        track_indices = random.choices(range(n_tracks), k=len(self.sources))
-
-        sources = []
-
-        for _source, trackID in zip(self.sources, track_indices):
-            track = self.tracks[trackID]
-            source_path = track['path'][_source]
-            track_samples = track['samples_original']
-
-            start = random.randint(0, track_samples - self.samples - 1)
-            source, _ = torchaudio.load(source_path, frame_offset=start, num_frames=self.samples)
-
-            # Apply augmentation
-            source = self.augmentation(source)
-            sources.append(source.unsqueeze(dim=0))
+        sources = self._getitem_sources(augmentation=self.augmentation)
+        sources = list(sources.unsqueeze(dim=1))
         
         if type(self.target) is list:
             target = []
@@ -701,14 +668,75 @@ class AugmentationWaveTrainDataset(WaveDataset):
 
         return mixture, target
 
+    def _getitem_sources(self, augmentation=None):
+        """
+        Load randomly selected segment of every source from randomly selected track.
+        Args:
+            augmentation <callable>: Augmentation applied to each source
+        Returns:
+            sources <torch.Tensor>: (len(sources), n_mics, T)
+        """
+        n_tracks = len(self.tracks)
+        track_indices = random.choices(range(n_tracks), k=len(self.sources))
+
+        if self.resampled_corpus is None:
+            samples = self.samples
+        else:
+            # Same length as `self.samples` frames at SAMPLE_RATE_MUSDB18 resampled by `pre_resampler`, so that resampled corpus does not change crops.
+            samples = math.ceil(self.samples * self.sample_rate / SAMPLE_RATE_MUSDB18)
+
+        sources = []
+
+        for _source, trackID in zip(self.sources, track_indices):
+            track = self.tracks[trackID]
+            source_path = track['path'][_source]
+            track_samples = track['samples_original']
+
+            start = random.randint(0, track_samples - samples - 1)
+            if self.cache is None:
+                source, _ = torchaudio.load(source_path, frame_offset=start, num_frames=samples)
+            else:
+                source, _ = self.cache.load(source_path, frame_offset=start, num_frames=samples)
+
+            if augmentation is not None:
+                source = augmentation(source)
+            
+            sources.append(source)
+        
+        sources = torch.stack(sources, dim=0)
+
+        return sources
+
     def __len__(self):
         return self.samples_per_epoch
 
+def build_resampled_musdb18(musdb18_root, sample_rate, sources=__sources__, resampled_root=None, num_workers=0):
+    """
+    Resample mixtures and stems of training tracks once, so that `AugmentationWaveTrainDataset` picks them up instead of resampling every crop.
+    Args:
+        musdb18_root <str>: Path to MUSDB or MUSDB-HQ
+        sample_rate <int>: Target sampling rate
+        sources <list<str>>: Sources to be resampled
+        resampled_root <str>: Root directory of resampled corpora. Default: `<musdb18_root>/.resampled`
+        num_workers <int>: Number of processes to resample files.
+    Returns:
+        corpus <ResampledCorpus>: Resampled corpus
+    """
+    train_txt_path = os.path.join(musdb18_root, 'train.txt')
+
+    with open(train_txt_path, 'r') as f:
+        names = [line.strip() for line in f]
+
+    rel_paths = [os.path.join('train', name, "{}.wav".format(source)) for name in names for source in ['mixture'] + sources]
+
+    return build_resampled_corpus(musdb18_root, rel_paths, sample_rate, cache_root=resampled_root, num_workers=num_workers)
+
 class AugmentationSpectrogramTrainDataset(SpectrogramDataset):
     """
     Training dataset that returns randomly selected mixture spectrograms.
+    If `cache_bytes` is given, decoded tracks are kept in LRU cache of each worker.
     """
-    def __init__(self, musdb18_root, fft_size, hop_size=None, window_fn='hann', normalize=False, sample_rate=SAMPLE_RATE_MUSDB18, patch_samples=6*SAMPLE_RATE_MUSDB18, overlap=None, samples_per_epoch=None, sources=__sources__, target=None, include_valid=False, augmentation=None):
+    def __init__(self, musdb18_root, fft_size, hop_size=None, window_fn='hann', normalize=False, sample_rate=SAMPLE_RATE_MUSDB18, patch_samples=6*SAMPLE_RATE_MUSDB18, overlap=None, samples_per_epoch=None, sources=__sources__, target=None, include_valid=False, augmentation=None, cache_bytes=None):
         super().__init__(musdb18_root, fft_size=fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize, sample_rate=sample_rate, sources=sources, target=target)
         
         valid_txt_path = os.path.join(musdb18_root, 'validation.txt')
@@ -731,6 +759,12 @@ class AugmentationSpectrogramTrainDataset(SpectrogramDataset):
         self.patch_samples = patch_samples
 
         self.augmentation = augmentation
+        self.return_sources = False
+
+        if cache_bytes:
+            self.cache = DecodedAudioCache(cache_bytes)
+        else:
+            self.cache = None
 
         self.tracks = []
 
@@ -764,12 +798,14 @@ class AugmentationSpectrogramTrainDataset(SpectrogramDataset):
                 samples_per_epoch = int(total_duration / duration)
 
             self.samples_per_epoch = samples_per_epoch
-            self.json_data = None
+            self.segments = None
+            self.mixture_is_sum = type(self.target) is list and sorted(self.target) == sorted(self.sources)
         else:
             if overlap is None:
                 overlap = patch_samples // 2
             
             self.samples_per_epoch = None
+            lengths = []
 
             for trackID, name in enumerate(names):
                 mixture_path = os.path.join(musdb18_root, 'train', name, "mixture.wav")
@@ -789,28 +825,28 @@ class AugmentationSpectrogramTrainDataset(SpectrogramDataset):
                     track['path'][source] = os.path.join(musdb18_root, 'train', name, "{}.wav".format(source))
                 
                 self.tracks.append(track)
+                lengths.append(track_samples)
 
-                for start in range(0, track_samples, patch_samples - overlap):
-                    if start + patch_samples >= track_samples:
-                        break
-                    data = {
-                        'trackID': trackID,
-                        'start': start,
-                        'samples': patch_samples,
-                    }
-                    self.json_data.append(data)
+            self.segments = SegmentIndex.from_lengths(names, lengths, samples=patch_samples, overlap=overlap, strict=True)
 
     def __getitem__(self, idx):
         """
         Returns:
             mixture <torch.Tensor>: Complex tensor with shape (1, n_mics, n_bins, n_frames)  if `target` is list, otherwise (n_mics, n_bins, n_frames) 
             target <torch.Tensor>: Complex tensor with shape (len(target), n_mics, n_bins, n_frames) if `target` is list, otherwise (n_mics, n_bins, n_frames)
+            If `return_sources=True`, only sources <torch.Tensor> with shape (len(sources), n_mics, T) are returned in time domain.
         """
+        if self.return_sources:
+            return self._getitem_sources()
+
         if self.augmentation:
             mixture, target = self._getitem_augmentation()
         else:
             mixture, target = self._getitem(idx)
         
+        if self.stft_in_loader:
+            return mixture, target
+
         n_dims = mixture.dim()
 
         if n_dims > 2:
@@ -832,9 +868,7 @@ class AugmentationSpectrogramTrainDataset(SpectrogramDataset):
         if self.augmentation:
             return self.samples_per_epoch
         else:
-            source = self.sources[0]
-            
-            return len(self.json_data[source])
+            return len(self.segments)
     
     def _getitem(self, idx):
         """
@@ -857,22 +891,8 @@ class AugmentationSpectrogramTrainDataset(SpectrogramDataset):
             target <torch.Tensor>: (len(target), n_mics, T) if `target` is list, otherwise (n_mics, T)
             name <str>: Artist and title of track
         """
-        n_tracks = len(self.tracks)
-        track_indices = random.choices(range(n_tracks), k=len(self.sources))
-
-        sources = []
-
-        for _source, trackID in zip(self.sources, track_indices):
-            track = self.tracks[trackID]
-            source_path = track['path'][_source]
-            track_samples = track['samples']
-
-            start = random.randint(0, track_samples - self.patch_samples - 1)
-            source, _ = torchaudio.load(source_path, frame_offset=start, num_frames=self.patch_samples)
-
-            # Apply augmentation
-            source = self.augmentation(source)
-            sources.append(source.unsqueeze(dim=0))
+        sources = self._getitem_sources(augmentation=self.augmentation)
+        sources = list(sources.unsqueeze(dim=1))
         
         if type(self.target) is list:
             target = []
@@ -894,13 +914,174 @@ class AugmentationSpectrogramTrainDataset(SpectrogramDataset):
 
         return mixture, target
 
+    def _getitem_sources(self, augmentation=None):
+        """
+        Load randomly selected segment of every source from randomly selected track.
+        Args:
+            augmentation <callable>: Augmentation applied to each source
+        Returns:
+            sources <torch.Tensor>: (len(sources), n_mics, T)
+        """
+        n_tracks = len(self.tracks)
+        track_indices = random.choices(range(n_tracks), k=len(self.sources))
+
+        sources = []
+
+        for _source, trackID in zip(self.sources, track_indices):
+            track = self.tracks[trackID]
+            source_path = track['path'][_source]
+            track_samples = track['samples']
+
+            start = random.randint(0, track_samples - self.patch_samples - 1)
+            if self.cache is None:
+                source, _ = torchaudio.load(source_path, frame_offset=start, num_frames=self.patch_samples)
+            else:
+                source, _ = self.cache.load(source_path, frame_offset=start, num_frames=self.patch_samples)
+
+            if augmentation is not None:
+                source = augmentation(source)
+            
+            sources.append(source)
+        
+        sources = torch.stack(sources, dim=0)
+
+        return sources
+
 """
     Data loader
 """
 class TrainDataLoader(torch.utils.data.DataLoader):
-    def __init__(self, *args, **kwargs):
+    """
+    If dataset has decoded track cache, workers are kept alive across epochs to reuse their caches, and cache statistics are reported at the end of every epoch.
+    """
+    def __init__(self, *args, batch_augmentation=None, **kwargs):
+        """
+        Args:
+            batch_augmentation <callable>: Augmentation applied to collated sources (batch_size, len(sources), n_mics, T) at once, e.g. built by `choose_batch_augmentation`.
+                Dataset is expected to randomly mix tracks (i.e. `augmentation` is given), and mixtures are made in `collate_fn` after augmentation.
+        """
+        dataset = args[0] if len(args) > 0 else kwargs['dataset']
+
+        if getattr(dataset, 'cache', None) is not None and kwargs.get('num_workers', 0) > 0:
+            kwargs.setdefault('persistent_workers', True)
+
         super().__init__(*args, **kwargs)
 
+        self.batch_augmentation = batch_augmentation
+
+        if batch_augmentation is not None:
+            assert getattr(self.dataset, 'augmentation', None), "batch_augmentation requires dataset which randomly mixes tracks."
+
+            if isinstance(self.dataset, SpectrogramDataset):
+                assert isinstance(self, SpectrogramTrainDataLoader), "Use SpectrogramTrainDataLoader for {}.".format(type(self.dataset).__name__)
+
+            self.dataset.return_sources = True
+            self.collate_fn = functools.partial(augmentation_train_collate_fn, augmentation=batch_augmentation, sources=self.dataset.sources, target=self.dataset.target)
+
+    def __iter__(self):
+        yield from super().__iter__()
+
+        cache = getattr(self.dataset, 'cache', None)
+
+        if cache is not None:
+            print(cache, flush=True)
+
+class SpectrogramTrainDataLoader(TrainDataLoader):
+    """
+    Data loader for training spectrogram datasets, which applies STFT to collated batch at once instead of every example.
+    Shapes of outputs are same as those of `TrainDataLoader`.
+    """
+    def __init__(self, *args, device=None, **kwargs):
+        """
+        Args:
+            device <torch.device>: If given, waveforms are moved to `device` and STFT is applied there in main process. Otherwise, STFT is applied in `collate_fn`.
+        """
+        super().__init__(*args, **kwargs)
+
+        assert isinstance(self.dataset, SpectrogramDataset), "dataset is expected SpectrogramDataset, but given {}.".format(type(self.dataset).__name__)
+
+        self.dataset.stft_in_loader = True
+        self.stft = BatchSTFT(self.dataset.fft_size, hop_size=self.dataset.hop_size, window=self.dataset.window, normalize=self.dataset.normalize)
+        self.device = device
+
+        if device is None:
+            self.collate_fn = functools.partial(spectrogram_train_collate_fn, stft=self.stft, mixture_is_sum=self.dataset.mixture_is_sum, collate_fn=self.collate_fn)
+
+    def __iter__(self):
+        if self.device is None:
+            yield from super().__iter__()
+        else:
+            for mixture, target in super().__iter__():
+                mixture, target = mixture.to(self.device, non_blocking=True), target.to(self.device, non_blocking=True)
+
+                yield batch_stft(self.stft, mixture, target, mixture_is_sum=self.dataset.mixture_is_sum)
+
+def augmentation_train_collate_fn(batch, augmentation=None, sources=__sources__, target=None):
+    """
+    Args:
+        batch <list<torch.Tensor>>: Sources with shape (len(sources), n_mics, T)
+        augmentation <callable>: Batch augmentation
+    Returns:
+        mixture <torch.Tensor>: (batch_size', 1, n_mics, T) if `target` is list, otherwise (batch_size', n_mics, T)
+        target <torch.Tensor>: (batch_size', len(target), n_mics, T) if `target` is list, otherwise (batch_size', n_mics, T)
+        where batch_size' is larger than batch_size if `augmentation` remixes sources more than once.
+    """
+    batched_sources = default_collate(batch)
+
+    if augmentation is not None:
+        batched_sources = augmentation(batched_sources)
+
+    return mix_sources(batched_sources, sources=sources, target=target)
+
+def mix_sources(input, sources=__sources__, target=None):
+    """
+    Args:
+        input <torch.Tensor>: (batch_size, len(sources), n_mics, T)
+        sources <list<str>>: Source names along dim=1 of `input`
+        target <str> or <list<str>>: Target source(s). If None, `sources` is used.
+    Returns:
+        mixture <torch.Tensor>: (batch_size, 1, n_mics, T) if `target` is list, otherwise (batch_size, n_mics, T)
+        target <torch.Tensor>: (batch_size, len(target), n_mics, T) if `target` is list, otherwise (batch_size, n_mics, T)
+    """
+    if target is None:
+        target = sources
+    
+    mixture = input.sum(dim=1, keepdim=True)
+
+    if type(target) is list:
+        source_indices = [sources.index(_target) for _target in target]
+        target = input[:, source_indices]
+    else:
+        mixture = mixture.squeeze(dim=1)
+        target = input[:, sources.index(target)]
+    
+    return mixture, target
+
+def spectrogram_train_collate_fn(batch, stft=None, mixture_is_sum=False, collate_fn=default_collate):
+    mixture, target = collate_fn(batch)
+
+    return batch_stft(stft, mixture, target, mixture_is_sum=mixture_is_sum)
+
+def batch_stft(stft, mixture, target, mixture_is_sum=False):
+    """
+    Args:
+        stft <BatchSTFT>: STFT
+        mixture <torch.Tensor>: (batch_size, 1, n_mics, T) if `target` is list, otherwise (batch_size, n_mics, T)
+        target <torch.Tensor>: (batch_size, len(target), n_mics, T) if `target` is list, otherwise (batch_size, n_mics, T)
+        mixture_is_sum <bool>: If True, STFT of mixture is computed as sum of STFT of target.
+    Returns:
+        mixture <torch.Tensor>: Complex tensor with shape (batch_size, 1, n_mics, n_bins, n_frames) if `target` is list, otherwise (batch_size, n_mics, n_bins, n_frames)
+        target <torch.Tensor>: Complex tensor with shape (batch_size, len(target), n_mics, n_bins, n_frames) if `target` is list, otherwise (batch_size, n_mics, n_bins, n_frames)
+    """
+    target = stft(target)
+
+    if mixture_is_sum:
+        mixture = target.sum(dim=1, keepdim=True)
+    else:
+        mixture = stft(mixture)
+
+    return mixture, target
+
 class EvalDataLoader(torch.utils.data.DataLoader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
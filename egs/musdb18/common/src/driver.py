@@ -1,5 +1,8 @@
 import os
 import time
+import json
+import multiprocessing
+import concurrent.futures
 
 import musdb
 import museval
@@ -8,10 +11,16 @@ import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.async_writer import AsyncCheckpointWriter, AsyncAudioWriter
+from utils.mixed_precision import get_amp_dtype, autocast, build_grad_scaler
+from utils.distributed import is_main_process, all_reduce_mean
+from utils.prefetch import wrap_prefetch_loader
+from utils.profiler import wrap_profiled_loader
 from algorithm.frequency_mask import multichannel_wiener_filter
 
 BITS_PER_SAMPLE_MUSDB18 = 16
 EPS = 1e-12
+DEFAULT_N_EVAL_WORKERS = 4
 
 class TrainerBase:
     def __init__(self, model, loader, criterion, optimizer, args):
@@ -37,6 +46,9 @@ class TrainerBase:
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = AsyncCheckpointWriter()
+        self.audio_writer = AsyncAudioWriter(self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
@@ -44,6 +56,20 @@ class TrainerBase:
         
         self.use_cuda = args.use_cuda
         
+        if hasattr(args, 'amp'):
+            self.amp_dtype = get_amp_dtype(args.amp)
+        else:
+            self.amp_dtype = None
+        
+        self.device_type = 'cuda' if self.use_cuda else 'cpu'
+        self.scaler = build_grad_scaler(self.amp_dtype, device_type=self.device_type)
+        
+        # Stage next batches on background thread if `--prefetch` is given, and report data wait time every epoch.
+        self.train_loader = wrap_prefetch_loader(self.train_loader, args, use_cuda=self.use_cuda)
+        
+        # Measure time of data loading, forward, backward, etc. every epoch if `--profile` is given.
+        self.train_loader = wrap_profiled_loader(self.train_loader, self.model, self.optimizer, args, use_cuda=self.use_cuda)
+        
         if args.continue_from:
             config = torch.load(args.continue_from, map_location=lambda storage, loc: storage)
             
@@ -56,7 +82,7 @@ class TrainerBase:
             self.prev_loss = self.valid_loss[self.start_epoch-1]
             self.no_improvement = config['no_improvement']
             
-            if isinstance(self.model, nn.DataParallel):
+            if isinstance(self.model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
                 self.model.module.load_state_dict(config['state_dict'])
             else:
                 self.model.load_state_dict(config['state_dict'])
@@ -94,11 +120,12 @@ class TrainerBase:
             self.train_loss[epoch] = train_loss
             self.valid_loss[epoch] = valid_loss
             
+            model_paths = []
+            
             if valid_loss < self.best_loss:
                 self.best_loss = valid_loss
                 self.no_improvement = 0
-                model_path = os.path.join(self.model_dir, "best.pth")
-                self.save_model(epoch, model_path)
+                model_paths.append(os.path.join(self.model_dir, "best.pth"))
             else:
                 if valid_loss >= self.prev_loss:
                     self.no_improvement += 1
@@ -116,19 +143,32 @@ class TrainerBase:
             
             self.prev_loss = valid_loss
             
-            model_path = os.path.join(self.model_dir, "last.pth")
-            self.save_model(epoch, model_path)
+            # best.pth is identical to last.pth in this epoch, so it is serialized only once.
+            model_paths.append(os.path.join(self.model_dir, "last.pth"))
+            self.save_model(epoch, model_paths)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+            if is_main_process():
+                self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1].clone(), valid_loss=self.valid_loss[:epoch + 1].clone(), save_path=save_path)
+        
+        self.checkpoint_writer.close()
     
     def run_one_epoch(self, epoch):
         """
         Training
         """
+        sampler = getattr(self.train_loader, 'sampler', None)
+        
+        if hasattr(sampler, 'set_epoch'):
+            # DistributedSampler shuffles differently every epoch.
+            sampler.set_epoch(epoch)
+        
         train_loss = self.run_one_epoch_train(epoch)
         valid_loss = self.run_one_epoch_eval(epoch)
 
+        # Every process makes same decision on learning rate and early stopping.
+        train_loss, valid_loss = all_reduce_mean(train_loss), all_reduce_mean(valid_loss)
+
         return train_loss, valid_loss
     
     def run_one_epoch_train(self, epoch):
@@ -145,16 +185,20 @@ class TrainerBase:
                 mixture = mixture.cuda()
                 sources = sources.cuda()
             
-            estimated_sources = self.model(mixture)
-            loss = self.criterion(estimated_sources, sources)
+            with autocast(self.device_type, dtype=self.amp_dtype):
+                estimated_sources = self.model(mixture)
+                loss = self.criterion(estimated_sources, sources)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.scaler.scale(loss).backward()
             
             if self.max_norm:
+                # Clip gradients in their true scale.
+                self.scaler.unscale_(self.optimizer)
                 nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
-            self.optimizer.step()
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
             
             train_loss += loss.item()
             
@@ -179,12 +223,14 @@ class TrainerBase:
                 if self.use_cuda:
                     mixture = mixture.cuda()
                     sources = sources.cuda()
-                estimated_sources = self.model(mixture)
+                with autocast(self.device_type, dtype=self.amp_dtype):
+                    estimated_sources = self.model(mixture)
+                estimated_sources = estimated_sources.float()
                 loss = self.criterion(estimated_sources, sources, batch_mean=False)
                 loss = loss.sum(dim=0)
                 valid_loss += loss.item()
                 
-                if idx < 5:
+                if idx < 5 and is_main_process():
                     mixture = mixture[0].squeeze(dim=0).detach().cpu()
                     estimated_sources = estimated_sources[0].detach().cpu()
                     
@@ -192,11 +238,7 @@ class TrainerBase:
                     os.makedirs(save_dir, exist_ok=True)
                     save_path = os.path.join(save_dir, "mixture.wav")
 
-                    if self.save_normalized:
-                        norm = torch.abs(mixture).max()
-                        mixture = mixture / norm
-                    
-                    torchaudio.save(save_path, mixture, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                    self.audio_writer.save(save_path, mixture, normalize=self.save_normalized)
                     
                     save_dir = os.path.join(self.sample_dir, titles[0], "epoch{}".format(epoch + 1))
                     os.makedirs(save_dir, exist_ok=True)
@@ -205,18 +247,19 @@ class TrainerBase:
                         target = self.valid_loader.dataset.target[source_idx]
                         save_path = os.path.join(save_dir, "{}.wav".format(target))
 
-                        if self.save_normalized:
-                            norm = torch.abs(estimated_source).max()
-                            estimated_source = estimated_source / norm
-                        
-                        torchaudio.save(save_path, estimated_source, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                        self.audio_writer.save(save_path, estimated_source, normalize=self.save_normalized)
+        
+        self.audio_writer.wait()
         
         valid_loss /= n_valid
         
         return valid_loss
     
     def save_model(self, epoch, model_path='./tmp.pth'):
-        if isinstance(self.model, nn.DataParallel):
+        if not is_main_process():
+            return
+        
+        if isinstance(self.model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
             config = self.model.module.get_config()
             config['state_dict'] = self.model.module.state_dict()
         else:
@@ -233,7 +276,7 @@ class TrainerBase:
         
         config['epoch'] = epoch + 1
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class TesterBase:
     def __init__(self, model, loader, criterion, args):
@@ -255,11 +298,20 @@ class TesterBase:
             self.out_dir = os.path.abspath(args.out_dir)
             os.makedirs(self.out_dir, exist_ok=True)
         
+        self.audio_writer = AsyncAudioWriter(self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+        
         self.use_cuda = args.use_cuda
         
+        if hasattr(args, 'amp'):
+            self.amp_dtype = get_amp_dtype(args.amp)
+        else:
+            self.amp_dtype = None
+        
+        self.device_type = 'cuda' if self.use_cuda else 'cpu'
+        
         config = torch.load(args.model_path, map_location=lambda storage, loc: storage)
         
-        if isinstance(self.model, nn.DataParallel):
+        if isinstance(self.model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
             self.model.module.load_state_dict(config['state_dict'])
         else:
             self.model.load_state_dict(config['state_dict'])
@@ -290,6 +342,11 @@ class EvaluaterBase:
             self.json_dir = os.path.abspath(args.json_dir)
             os.makedirs(self.json_dir, exist_ok=True)
         
+        if hasattr(args, 'n_eval_workers'):
+            self.n_eval_workers = args.n_eval_workers
+        else:
+            self.n_eval_workers = DEFAULT_N_EVAL_WORKERS
+        
         self.use_norbert = args.use_norbert
         
         if self.use_norbert:
@@ -299,42 +356,143 @@ class EvaluaterBase:
                 raise ImportError("Cannot import norbert.")
     
     def run(self):
-        mus = musdb.DB(root=self.musdb18_root, subsets='test', is_wav=True)
+        evaluate_tracks(self.musdb18_root, self.estimates_dir, self.sources, json_dir=self.json_dir, num_workers=self.n_eval_workers)
+
+    def apply_multichannel_wiener_filter(self, mixture, estimated_sources_amplitude, channels_first=True, eps=EPS):
+        if self.use_norbert:
+            estimated_sources = apply_multichannel_wiener_filter_norbert(mixture, estimated_sources_amplitude, channels_first=channels_first, eps=eps)
+        else:
+            estimated_sources = apply_multichannel_wiener_filter_torch(mixture, estimated_sources_amplitude, channels_first=channels_first, eps=eps)
+
+        return estimated_sources
+
+def evaluate_tracks(musdb18_root, estimates_dir, targets, json_dir=None, num_workers=DEFAULT_N_EVAL_WORKERS, accompaniment=True):
+    """
+    Evaluates estimated sources of MUSDB18 test tracks by museval, where tracks are evaluated in parallel by worker processes.
+    Scores of each track are saved as <json_dir>/test/<name>.json (same as museval) as soon as the track is evaluated.
+    Tracks whose json file already exists are skipped, so interrupted evaluation is resumed.
+    Args:
+        musdb18_root <str>: Path to MUSDB18
+        estimates_dir <str>: Directory which includes <name>/<target>.wav
+        targets <list<str>>: Evaluated targets, e.g. ['bass', 'drums', 'other', 'vocals']
+        json_dir <str>: Directory to save scores. If None, scores are not saved and all tracks are evaluated.
+        num_workers <int>: Number of worker processes. If 0, tracks are evaluated in main process.
+        accompaniment <bool>: If True, sum of targets except for vocals is evaluated as accompaniment.
+    Returns:
+        results <museval.EvalStore>: Scores aggregated by median over frames and median over tracks
+    """
+    mus = musdb.DB(root=musdb18_root, subsets='test', is_wav=True)
+    
+    results = museval.EvalStore(frames_agg='median', tracks_agg='median')
+    names = []
+
+    for track in mus.tracks:
+        name = track.name
+
+        if json_dir is not None:
+            scores = _load_track_scores(os.path.join(json_dir, track.subset, "{}.json".format(name)), name)
+
+            if scores is not None:
+                results.add_track(scores)
+                print("{} has been already evaluated.".format(name), flush=True)
+                continue
         
-        results = museval.EvalStore(frames_agg='median', tracks_agg='median')
+        names.append(name)
+    
+    kwargs = {
+        'musdb18_root': musdb18_root,
+        'estimates_dir': estimates_dir,
+        'targets': targets,
+        'json_dir': json_dir,
+        'accompaniment': accompaniment
+    }
 
-        for track in mus.tracks:
-            name = track.name
-            
-            estimates = {}
-            estimated_accompaniment = 0
+    if num_workers > 0 and len(names) > 0:
+        # Worker processes do not touch CUDA, but forking a process which uses CUDA is unsafe.
+        context = multiprocessing.get_context('spawn')
 
-            for target in self.sources:
-                estimated_path = os.path.join(self.estimates_dir, name, "{}.wav".format(target))
-                estimated, _ = torchaudio.load(estimated_path)
-                estimated = estimated.numpy().transpose(1, 0)
-                estimates[target] = estimated
-                if target != 'vocals':
-                    estimated_accompaniment += estimated
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as executor:
+            futures = [executor.submit(_evaluate_track, name, **kwargs) for name in names]
 
-            estimates['accompaniment'] = estimated_accompaniment
+            for future in concurrent.futures.as_completed(futures):
+                name, scores = future.result()
+                results.add_track(scores)
 
-            # Evaluate using museval
-            scores = museval.eval_mus_track(track, estimates, output_dir=self.json_dir)
+                print(name)
+                print(scores, flush=True)
+    else:
+        for name in names:
+            name, scores = _evaluate_track(name, **kwargs)
             results.add_track(scores)
 
             print(name)
             print(scores, flush=True)
 
-        print(results)
+    print(results)
 
-    def apply_multichannel_wiener_filter(self, mixture, estimated_sources_amplitude, channels_first=True, eps=EPS):
-        if self.use_norbert:
-            estimated_sources = apply_multichannel_wiener_filter_norbert(mixture, estimated_sources_amplitude, channels_first=channels_first, eps=eps)
-        else:
-            estimated_sources = apply_multichannel_wiener_filter_torch(mixture, estimated_sources_amplitude, channels_first=channels_first, eps=eps)
+    return results
 
-        return estimated_sources
+_musdb_tracks = {}
+
+def _evaluate_track(name, musdb18_root, estimates_dir, targets, json_dir=None, accompaniment=True):
+    """
+    Returns:
+        name <str>: Name of track
+        scores <museval.TrackStore>: Scores of track
+    """
+    # Tracks are listed once in each worker process.
+    if musdb18_root not in _musdb_tracks:
+        mus = musdb.DB(root=musdb18_root, subsets='test', is_wav=True)
+        _musdb_tracks[musdb18_root] = {track.name: track for track in mus.tracks}
+    
+    track = _musdb_tracks[musdb18_root][name]
+
+    estimates = {}
+    estimated_accompaniment = 0
+
+    for target in targets:
+        estimated_path = os.path.join(estimates_dir, name, "{}.wav".format(target))
+        estimated, _ = torchaudio.load(estimated_path)
+        estimated = estimated.numpy().transpose(1, 0)
+        estimates[target] = estimated
+        if target != 'vocals':
+            estimated_accompaniment += estimated
+
+    if accompaniment:
+        estimates['accompaniment'] = estimated_accompaniment
+
+    # Evaluate using museval
+    scores = museval.eval_mus_track(track, estimates)
+
+    if json_dir is not None:
+        json_path = os.path.join(json_dir, track.subset, "{}.json".format(name))
+        os.makedirs(os.path.dirname(json_path), exist_ok=True)
+
+        # Renamed after writing, so a partially written file is never regarded as finished.
+        tmp_path = json_path + ".tmp"
+
+        with open(tmp_path, 'w') as f:
+            f.write(scores.json)
+        
+        os.replace(tmp_path, json_path)
+
+    return name, scores
+
+def _load_track_scores(json_path, name):
+    """
+    Returns:
+        scores <pandas.DataFrame>: Scores of track in the format of museval.EvalStore. None if json file does not exist or is broken.
+    """
+    if not os.path.exists(json_path):
+        return None
+
+    try:
+        with open(json_path) as f:
+            scores = museval.json2df(json.load(f), name)
+    except (ValueError, KeyError, TypeError):
+        return None
+
+    return scores
 
 def apply_multichannel_wiener_filter_norbert(mixture, estimated_sources_amplitude, iteration=1, channels_first=True, eps=EPS):
     """
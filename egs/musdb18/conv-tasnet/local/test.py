@@ -25,7 +25,9 @@ parser.add_argument('--estimates_dir', type=str, default=None, help='Estimated s
 parser.add_argument('--json_dir', type=str, default=None, help='Json directory')
 parser.add_argument('--estimate_all', type=int, default=1, help='Estimates all songs. GPU is required if use_cuda=1.')
 parser.add_argument('--evaluate_all', type=int, default=1, help='Evaluates all estimations. GPU is NOT required.')
+parser.add_argument('--n_eval_workers', type=int, default=4, help='Number of worker processes to evaluate tracks. 0: Evaluate in main process. Default: 4')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--amp', type=str, default='none', choices=['none', 'fp16', 'bf16'], help='Mixed precision with autocast. SDR, STFT and Wiener filter are computed in float32. Default: none')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
 def main(args):
@@ -5,11 +5,11 @@ import argparse
 
 import yaml
 import torch
-import torch.nn as nn
 
 from utils.utils import set_seed
-from utils.augmentation import SequentialAugmentation, choose_augmentation
-from dataset import AugmentationWaveTrainDataset, TrainDataLoader, EvalDataLoader
+from utils.distributed import init_distributed, get_rank, distribute_model
+from utils.augmentation import SequentialAugmentation, choose_augmentation, choose_batch_augmentation
+from dataset import SAMPLE_RATE_MUSDB18, AugmentationWaveTrainDataset, build_resampled_musdb18, TrainDataLoader, EvalDataLoader
 from adhoc_dataset import WaveEvalDataset
 from adhoc_driver import AdhocTrainer
 from models.conv_tasnet import ConvTasNet
@@ -23,6 +23,8 @@ parser.add_argument('--sample_rate', '-sr', type=int, default=44100, help='Sampl
 parser.add_argument('--duration', type=float, default=2, help='Duration')
 parser.add_argument('--valid_duration', type=float, default=4, help='Duration for valid dataset for avoiding memory error.')
 parser.add_argument('--augmentation_path', type=str, default=None, help='Path to augmentation.yaml')
+parser.add_argument('--batch_augmentation', type=int, default=0, help='0: Apply augmentation to every source in dataset, 1: Apply augmentation to whole batch at once')
+parser.add_argument('--n_remixes', type=int, default=0, help='Number of in-batch remixes of sources. 0: Not remix sources.')
 parser.add_argument('--enc_basis', type=str, default='trainable', choices=['trainable','Fourier','trainableFourier','trainableFourierTrainablePhase'], help='Encoder type')
 parser.add_argument('--dec_basis', type=str, default='trainable', choices=['trainable','Fourier','trainableFourier','trainableFourierTrainablePhase', 'pinv'], help='Decoder type')
 parser.add_argument('--enc_nonlinear', type=str, default=None, help='Non-linear function of encoder')
@@ -58,12 +60,22 @@ parser.add_argument('--loss_dir', type=str, default='./tmp/loss', help='Loss dir
 parser.add_argument('--sample_dir', type=str, default='./tmp/sample', help='Sample directory')
 parser.add_argument('--continue_from', type=str, default=None, help='Resume training')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--amp', type=str, default='none', choices=['none', 'fp16', 'bf16'], help='Mixed precision with autocast. SDR, STFT and Wiener filter are computed in float32. Default: none')
+parser.add_argument('--prefetch', type=int, default=0, help='Number of training batches staged in advance on background thread. If 0, prefetching is disabled. Default: 0')
+parser.add_argument('--profile', type=str, default='none', choices=['none', 'timer', 'trace'], help='timer: Report time of data loading, forward, backward, etc. and throughput every epoch, trace: In addition, export torch.profiler traces as Chrome trace files. Default: none')
+parser.add_argument('--profile_dir', type=str, default='./tmp/profile', help='Directory of torch.profiler traces')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--num_workers', type=int, default=0, help='# of workers given to data loader for training.')
+parser.add_argument('--cache_size', type=float, default=0, help='Size of decoded track cache per worker [GB]. 0: Not use cache.')
+parser.add_argument('--resample_corpus', type=int, default=0, help='1: Resample training tracks once before training if sample_rate is not 44100, 0: Resample every crop. Resampled corpus built before is used in both cases.')
+parser.add_argument('--resampled_root', type=str, default=None, help='Root directory of resampled corpora. Default: <musdb18_root>/.resampled')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
 def main(args):
-    set_seed(args.seed)
+    # Launched by `torchrun --nproc_per_node <N> local/train.py ...` for multi-process training.
+    distributed = init_distributed(use_cuda=args.use_cuda)
+    # Every process draws different random crops and mixtures.
+    set_seed(args.seed + get_rank())
     
     args.sources = args.sources.replace('[','').replace(']','').split(',')
     args.n_sources = len(args.sources)
@@ -75,22 +87,44 @@ def main(args):
         config_augmentation = yaml.safe_load(f)
     
     augmentation = SequentialAugmentation()
+
+    if args.batch_augmentation or args.n_remixes > 0:
+        batch_augmentation = SequentialAugmentation()
+
+        if args.n_remixes > 0:
+            batch_augmentation.append(choose_batch_augmentation('remix', n_remixes=args.n_remixes))
+    else:
+        batch_augmentation = None
+    
     for name in config_augmentation['augmentation']:
-        augmentation.append(choose_augmentation(name, **config_augmentation[name]))
+        if args.batch_augmentation:
+            batch_augmentation.append(choose_batch_augmentation(name, **config_augmentation[name]))
+        else:
+            augmentation.append(choose_augmentation(name, **config_augmentation[name]))
+    
+    if args.resample_corpus and args.sample_rate != SAMPLE_RATE_MUSDB18:
+        build_resampled_musdb18(args.musdb18_root, args.sample_rate, sources=args.sources, resampled_root=args.resampled_root, num_workers=args.num_workers)
     
     train_dataset = AugmentationWaveTrainDataset(
         args.musdb18_root,
         sample_rate=args.sample_rate, duration=args.duration, samples_per_epoch=args.samples_per_epoch,
         sources=args.sources, target=args.sources,
         include_valid=True,
-        augmentation=augmentation
+        augmentation=augmentation,
+        cache_bytes=int(args.cache_size * (1 << 30)),
+        resampled_root=args.resampled_root
     )
     valid_dataset = WaveEvalDataset(args.musdb18_root, sample_rate=args.sample_rate, max_duration=args.valid_duration, sources=args.sources)
     print("Training dataset includes {} samples.".format(len(train_dataset)))
     print("Valid dataset includes {} samples.".format(len(valid_dataset)))
     
     loader = {}
-    loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers)
+    if distributed:
+        # batch_size is per process.
+        train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset, shuffle=True)
+        loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, sampler=train_sampler, num_workers=args.num_workers, batch_augmentation=batch_augmentation)
+    else:
+        loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers, batch_augmentation=batch_augmentation)
     loader['valid'] = EvalDataLoader(valid_dataset, batch_size=1, shuffle=False)
     
     if not args.stride:
@@ -114,12 +148,13 @@ def main(args):
     if args.use_cuda:
         if torch.cuda.is_available():
             model.cuda()
-            model = nn.DataParallel(model)
+            model = distribute_model(model, use_cuda=True)
             print("Use CUDA")
         else:
             raise ValueError("Cannot use CUDA.")
     else:
         print("Does NOT use CUDA")
+        model = distribute_model(model)
         
     # Optimizer
     if args.optimizer == 'sgd':
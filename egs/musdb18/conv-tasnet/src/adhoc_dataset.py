@@ -5,6 +5,7 @@ import torch
 import torchaudio
 import torch.nn.functional as F
 
+from utils.manifest import SegmentIndex
 from dataset import WaveDataset
 
 __sources__ = ['bass', 'drums', 'other', 'vocals']
@@ -277,6 +278,9 @@ class WaveEvalDataset(WaveDataset):
 
         return mixture, target, name
 
+    def __len__(self):
+        return len(self.json_data)
+
 class WaveTestDataset(WaveDataset):
     def __init__(self, musdb18_root, sample_rate=SAMPLE_RATE_MUSDB18, duration=4, sources=__sources__, target=None):
         super().__init__(
@@ -296,7 +300,7 @@ class WaveTestDataset(WaveDataset):
         self.samples = int(duration * sample_rate)
 
         self.tracks = []
-        self.json_data = []
+        lengths = []
 
         for trackID, name in enumerate(names):
             mixture_path = os.path.join(musdb18_root, 'test', name, "mixture.wav")
@@ -315,14 +319,9 @@ class WaveTestDataset(WaveDataset):
                 track['path'][source] = os.path.join(musdb18_root, 'test', name, "{}.wav".format(source))
             
             self.tracks.append(track)
+            lengths.append(track_samples)
 
-            data = {
-                'trackID': trackID,
-                'start': 0,
-                'samples': track_samples
-            }
-
-            self.json_data.append(data)
+        self.segments = SegmentIndex.from_lengths(names, lengths)
 
         if sample_rate != SAMPLE_RATE_MUSDB18:
             self.pre_resampler = torchaudio.transforms.Resample(SAMPLE_RATE_MUSDB18, sample_rate)
@@ -1,13 +1,15 @@
 import os
 
-import musdb
-import museval
 import torch
-import torchaudio
 import torch.nn as nn
 import torch.nn.functional as F
 
-from driver import TrainerBase, TesterBase
+from utils.distributed import is_main_process
+from utils.mixed_precision import get_amp_dtype, autocast, build_grad_scaler
+from utils.async_writer import AsyncCheckpointWriter, AsyncAudioWriter
+from utils.prefetch import wrap_prefetch_loader
+from utils.profiler import wrap_profiled_loader
+from driver import DEFAULT_N_EVAL_WORKERS, TrainerBase, TesterBase, evaluate_tracks
 
 BITS_PER_SAMPLE_MUSDB18 = 16
 EPS = 1e-12
@@ -32,16 +34,20 @@ class AdhocTrainer(TrainerBase):
             mean, std = mixture.mean(dim=-1, keepdim=True), mixture.std(dim=-1, keepdim=True)
             standardized_mixture = (mixture - mean) / (std + EPS)
             standardized_sources = (sources - mean) / (std + EPS)
-            standardized_estimated_sources = self.model(standardized_mixture)
-            loss = self.criterion(standardized_estimated_sources, standardized_sources)
+            with autocast(self.device_type, dtype=self.amp_dtype):
+                standardized_estimated_sources = self.model(standardized_mixture)
+                loss = self.criterion(standardized_estimated_sources, standardized_sources)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.scaler.scale(loss).backward()
             
             if self.max_norm:
+                # Clip gradients in their true scale.
+                self.scaler.unscale_(self.optimizer)
                 nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
-            self.optimizer.step()
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
             
             train_loss += loss.item()
             
@@ -69,12 +75,14 @@ class AdhocTrainer(TrainerBase):
                 mean, std = mixture.mean(dim=-1, keepdim=True), mixture.std(dim=-1, keepdim=True)
                 standardized_mixture = (mixture - mean) / (std + EPS)
                 standardized_sources = (sources - mean) / (std + EPS)
-                standardized_estimated_sources = self.model(standardized_mixture)
+                with autocast(self.device_type, dtype=self.amp_dtype):
+                    standardized_estimated_sources = self.model(standardized_mixture)
+                standardized_estimated_sources = standardized_estimated_sources.float()
                 loss = self.criterion(standardized_estimated_sources, standardized_sources, batch_mean=False)
                 loss = loss.sum(dim=0)
                 valid_loss += loss.item()
                 
-                if idx < 5:
+                if idx < 5 and is_main_process():
                     estimated_sources = std * standardized_estimated_sources + mean
                     
                     mixture = mixture[0].squeeze(dim=0).detach().cpu()
@@ -84,11 +92,7 @@ class AdhocTrainer(TrainerBase):
                     os.makedirs(save_dir, exist_ok=True)
                     save_path = os.path.join(save_dir, "mixture.wav")
 
-                    if self.save_normalized:
-                        norm = torch.abs(mixture).max()
-                        mixture = mixture / norm
-                    
-                    torchaudio.save(save_path, mixture, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                    self.audio_writer.save(save_path, mixture, normalize=self.save_normalized)
                     
                     save_dir = os.path.join(self.sample_dir, titles[0], "epoch{}".format(epoch + 1))
                     os.makedirs(save_dir, exist_ok=True)
@@ -96,18 +100,19 @@ class AdhocTrainer(TrainerBase):
                         target = self.valid_loader.dataset.target[source_idx]
                         save_path = os.path.join(save_dir, "{}.wav".format(target))
                         
-                        if self.save_normalized:
-                            norm = torch.abs(estimated_source).max()
-                            estimated_source = estimated_source / norm
-                        
-                        torchaudio.save(save_path, estimated_source, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                        self.audio_writer.save(save_path, estimated_source, normalize=self.save_normalized)
+        
+        self.audio_writer.wait()
         
         valid_loss /= n_valid
         
         return valid_loss
 
     def save_model(self, epoch, model_path='./tmp.pth'):
-        if isinstance(self.model, nn.DataParallel):
+        if not is_main_process():
+            return
+        
+        if isinstance(self.model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
             config = self.model.module.get_config()
             config['state_dict'] = self.model.module.state_dict()
         else:
@@ -126,7 +131,7 @@ class AdhocTrainer(TrainerBase):
         config['sample_rate'] = self.train_loader.dataset.sample_rate
         config['sources'] = self.train_loader.dataset.sources
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class FinetuneTrainer(AdhocTrainer):
     def __init__(self, model, loader, criterion, optimizer, args):
@@ -145,12 +150,29 @@ class FinetuneTrainer(AdhocTrainer):
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = AsyncCheckpointWriter()
+        self.audio_writer = AsyncAudioWriter(self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
         self.valid_loss = torch.empty(self.epochs)
         
         self.use_cuda = args.use_cuda
+        
+        # Stage next batches on background thread if `--prefetch` is given, and report data wait time every epoch.
+        self.train_loader = wrap_prefetch_loader(self.train_loader, args, use_cuda=self.use_cuda)
+        
+        # Measure time of data loading, forward, backward, etc. every epoch if `--profile` is given.
+        self.train_loader = wrap_profiled_loader(self.train_loader, self.model, self.optimizer, args, use_cuda=self.use_cuda)
+        
+        if hasattr(args, 'amp'):
+            self.amp_dtype = get_amp_dtype(args.amp)
+        else:
+            self.amp_dtype = None
+        
+        self.device_type = 'cuda' if self.use_cuda else 'cpu'
+        self.scaler = build_grad_scaler(self.amp_dtype, device_type=self.device_type)
 
         # Continue from
         config = torch.load(args.continue_from, map_location=lambda storage, loc: storage)
@@ -176,7 +198,7 @@ class FinetuneTrainer(AdhocTrainer):
 
             self.best_loss = float('infinity')
 
-        if isinstance(self.model, nn.DataParallel):
+        if isinstance(self.model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
             self.model.module.load_state_dict(config['state_dict'])
         else:
             self.model.load_state_dict(config['state_dict'])
@@ -190,7 +212,10 @@ class FinetuneTrainer(AdhocTrainer):
             self.save_normalized = False
 
     def save_model(self, epoch, model_path='./tmp.pth'):
-        if isinstance(self.model, nn.DataParallel):
+        if not is_main_process():
+            return
+        
+        if isinstance(self.model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
             config = self.model.module.get_config()
             config['state_dict'] = self.model.module.state_dict()
         else:
@@ -207,7 +232,7 @@ class FinetuneTrainer(AdhocTrainer):
         config['epoch'] = epoch + 1
         config['is_finetune'] = True # For finetuner
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class AdhocFinetuneTrainer(FinetuneTrainer):
     def __init__(self, model, loader, pit_criterion, optimizer, args):
@@ -235,13 +260,27 @@ class AdhocTester(TesterBase):
             self.json_dir = os.path.abspath(args.json_dir)
             os.makedirs(self.json_dir, exist_ok=True)
         
+        if hasattr(args, 'n_eval_workers'):
+            self.n_eval_workers = args.n_eval_workers
+        else:
+            self.n_eval_workers = DEFAULT_N_EVAL_WORKERS
+        
+        self.audio_writer = AsyncAudioWriter(self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+        
         self.use_estimate_all, self.use_evaluate_all = args.estimate_all, args.evaluate_all
         
         self.use_cuda = args.use_cuda
         
+        if hasattr(args, 'amp'):
+            self.amp_dtype = get_amp_dtype(args.amp)
+        else:
+            self.amp_dtype = None
+        
+        self.device_type = 'cuda' if self.use_cuda else 'cpu'
+        
         config = torch.load(args.model_path, map_location=lambda storage, loc: storage)
         
-        if isinstance(self.model, nn.DataParallel):
+        if isinstance(self.model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
             self.model.module.load_state_dict(config['state_dict'])
         else:
             self.model.load_state_dict(config['state_dict'])
@@ -286,7 +325,9 @@ class AdhocTester(TesterBase):
 
                 standardized_estimated_sources = []
                 for _mixture in standardized_mixture:
-                    _estimated_sources = self.model(_mixture.unsqueeze(dim=0)) # (1, n_sources, n_mics, T_segment)
+                    with autocast(self.device_type, dtype=self.amp_dtype):
+                        _estimated_sources = self.model(_mixture.unsqueeze(dim=0)) # (1, n_sources, n_mics, T_segment)
+                    _estimated_sources = _estimated_sources.float()
                     standardized_estimated_sources.append(_estimated_sources.squeeze(dim=0))
                 standardized_estimated_sources = torch.stack(standardized_estimated_sources, dim=0) # (batch_size, n_sources, n_mics, T_segment)
                 estimated_sources = std * standardized_estimated_sources + mean
@@ -320,8 +361,7 @@ class AdhocTester(TesterBase):
                 for source_idx, target in enumerate(self.sources):
                     estimated_path = os.path.join(track_dir, "{}.wav".format(target))
                     estimated_source = estimated_sources[source_idx] # -> (n_mics, T)
-                    signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                    torchaudio.save(estimated_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                    self.audio_writer.save(estimated_path, estimated_source)
                 
                 s = "{},".format(name)
                 for idx, target in enumerate(self.sources):
@@ -336,6 +376,8 @@ class AdhocTester(TesterBase):
                 test_loss += loss # (n_sources,)
                 test_loss_improvement += loss_improvement # (n_sources,)
 
+        self.audio_writer.close()
+        
         test_loss /= n_test
         test_loss_improvement /= n_test
         
@@ -350,31 +392,4 @@ class AdhocTester(TesterBase):
         print(s, flush=True)
     
     def evaluate_all(self):
-        mus = musdb.DB(root=self.musdb18_root, subsets='test', is_wav=True)
-        
-        results = museval.EvalStore(frames_agg='median', tracks_agg='median')
-
-        for track in mus.tracks:
-            name = track.name
-            
-            estimates = {}
-            estimated_accompaniment = 0
-
-            for target in self.sources:
-                estimated_path = os.path.join(self.estimates_dir, name, "{}.wav".format(target))
-                estimated, _ = torchaudio.load(estimated_path)
-                estimated = estimated.numpy().transpose(1, 0)
-                estimates[target] = estimated
-                if target != 'vocals':
-                    estimated_accompaniment += estimated
-
-            estimates['accompaniment'] = estimated_accompaniment
-
-            # Evaluate using museval
-            scores = museval.eval_mus_track(track, estimates, output_dir=self.json_dir)
-            results.add_track(scores)
-
-            print(name)
-            print(scores, flush=True)
-
-        print(results)
\ No newline at end of file
+        evaluate_tracks(self.musdb18_root, self.estimates_dir, self.sources, json_dir=self.json_dir, num_workers=self.n_eval_workers)
@@ -37,6 +37,9 @@ parser.add_argument('--loss_dir', type=str, default='./tmp/loss', help='Loss dir
 parser.add_argument('--sample_dir', type=str, default='./tmp/sample', help='Sample directory')
 parser.add_argument('--continue_from', type=str, default=None, help='Resume training')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--prefetch', type=int, default=0, help='Number of training batches staged in advance on background thread. If 0, prefetching is disabled. Default: 0')
+parser.add_argument('--profile', type=str, default='none', choices=['none', 'timer', 'trace'], help='timer: Report time of data loading, forward, backward, etc. and throughput every epoch, trace: In addition, export torch.profiler traces as Chrome trace files. Default: none')
+parser.add_argument('--profile_dir', type=str, default='./tmp/profile', help='Directory of torch.profiler traces')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
@@ -117,6 +117,9 @@ class SpectrogramEvalDataset(SpectrogramDataset):
         
         return mixture, target, name
 
+    def __len__(self):
+        return len(self.json_data)
+
 class SpectrogramTestDataset(SpectrogramDataset):
     def __init__(self, musdb18_root, fft_size, hop_size=None, window_fn='hann', normalize=False, sample_rate=SAMPLE_RATE_MUSDB18, patch_size=256, sources=__sources__, target=None):
         super().__init__(musdb18_root, fft_size=fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize, sample_rate=sample_rate, sources=sources, target=target)
@@ -222,6 +225,9 @@ class SpectrogramTestDataset(SpectrogramDataset):
         
         return mixture, target, samples, name
 
+    def __len__(self):
+        return len(self.json_data)
+
 """
 Data loader
 """
@@ -1,15 +1,16 @@
 import os
 import time
 
-import musdb
-import museval
 import torch
-import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.mixed_precision import get_amp_dtype, autocast, build_grad_scaler
+from utils.async_writer import AsyncCheckpointWriter, AsyncAudioWriter
+from utils.prefetch import wrap_prefetch_loader
+from utils.profiler import wrap_profiled_loader
 from driver import apply_multichannel_wiener_filter_norbert, apply_multichannel_wiener_filter_torch
-from driver import TrainerBase, TesterBase
+from driver import DEFAULT_N_EVAL_WORKERS, TrainerBase, TesterBase, evaluate_tracks
 
 BITS_PER_SAMPLE_MUSDB18 = 16
 EPS = 1e-12
@@ -43,6 +44,9 @@ class AdhocTrainer(TrainerBase):
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = AsyncCheckpointWriter()
+        self.audio_writer = AsyncAudioWriter(self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+        
         self.epochs, self.anneal_epoch = args.epochs, args.anneal_epoch
         self.anneal_lr = args.anneal_lr
         
@@ -51,6 +55,20 @@ class AdhocTrainer(TrainerBase):
         
         self.use_cuda = args.use_cuda
         
+        # Stage next batches on background thread if `--prefetch` is given, and report data wait time every epoch.
+        self.train_loader = wrap_prefetch_loader(self.train_loader, args, use_cuda=self.use_cuda)
+        
+        # Measure time of data loading, forward, backward, etc. every epoch if `--profile` is given.
+        self.train_loader = wrap_profiled_loader(self.train_loader, self.model, self.optimizer, args, use_cuda=self.use_cuda)
+        
+        if hasattr(args, 'amp'):
+            self.amp_dtype = get_amp_dtype(args.amp)
+        else:
+            self.amp_dtype = None
+        
+        self.device_type = 'cuda' if self.use_cuda else 'cpu'
+        self.scaler = build_grad_scaler(self.amp_dtype, device_type=self.device_type)
+        
         if args.continue_from:
             config = torch.load(args.continue_from, map_location=lambda storage, loc: storage)
             
@@ -120,7 +138,9 @@ class AdhocTrainer(TrainerBase):
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1].clone(), valid_loss=self.valid_loss[:epoch + 1].clone(), save_path=save_path)
+        
+        self.checkpoint_writer.close()
     
     def run_one_epoch_train(self, epoch):
         # Override
@@ -140,17 +160,20 @@ class AdhocTrainer(TrainerBase):
             mixture_amplitude = torch.abs(mixture)
             source_amplitude = torch.abs(source)
             
-            estimated_sources_amplitude = self.model(mixture_amplitude)
-            
-            loss = self.criterion(estimated_sources_amplitude, source_amplitude)
+            with autocast(self.device_type, dtype=self.amp_dtype):
+                estimated_sources_amplitude = self.model(mixture_amplitude)
+                loss = self.criterion(estimated_sources_amplitude, source_amplitude)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.scaler.scale(loss).backward()
             
             if self.max_norm:
+                # Clip gradients in their true scale.
+                self.scaler.unscale_(self.optimizer)
                 nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
-            self.optimizer.step()
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
             
             train_loss += loss.item()
             
@@ -187,7 +210,9 @@ class AdhocTrainer(TrainerBase):
                 mixture_amplitude = torch.abs(mixture)
                 source_amplitude = torch.abs(source)
                 
-                estimated_source_amplitude = self.model(mixture_amplitude)
+                with autocast(self.device_type, dtype=self.amp_dtype):
+                    estimated_source_amplitude = self.model(mixture_amplitude)
+                estimated_source_amplitude = estimated_source_amplitude.float()
                 loss = self.criterion(estimated_source_amplitude, source_amplitude, batch_mean=False)
                 loss = loss.mean(dim=0)
                 valid_loss += loss.item()
@@ -206,12 +231,12 @@ class AdhocTrainer(TrainerBase):
 
                     os.makedirs(save_dir, exist_ok=True)
                     save_path = os.path.join(save_dir, "mixture.wav")
-                    signal = mixture.unsqueeze(dim=0) if mixture.dim() == 1 else mixture
-                    torchaudio.save(save_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                    self.audio_writer.save(save_path, mixture)
                     
                     save_path = os.path.join(save_dir, "epoch{}.wav".format(epoch + 1))
-                    signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                    torchaudio.save(save_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                    self.audio_writer.save(save_path, estimated_source)
+        
+        self.audio_writer.wait()
         
         valid_loss /= n_valid
         
@@ -243,9 +268,23 @@ class AdhocTester(TesterBase):
             self.json_dir = os.path.abspath(args.json_dir)
             os.makedirs(self.json_dir, exist_ok=True)
         
+        if hasattr(args, 'n_eval_workers'):
+            self.n_eval_workers = args.n_eval_workers
+        else:
+            self.n_eval_workers = DEFAULT_N_EVAL_WORKERS
+        
+        self.audio_writer = AsyncAudioWriter(self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+        
         self.use_estimate_all, self.use_evaluate_all = args.estimate_all, args.evaluate_all
 
         self.use_cuda = args.use_cuda
+        
+        if hasattr(args, 'amp'):
+            self.amp_dtype = get_amp_dtype(args.amp)
+        else:
+            self.amp_dtype = None
+        
+        self.device_type = 'cuda' if self.use_cuda else 'cpu'
         self.use_norbert = args.use_norbert
 
         is_data_parallel = isinstance(self.model, nn.DataParallel)
@@ -312,7 +351,9 @@ class AdhocTester(TesterBase):
                 for _mixture_amplitude in mixture_amplitude:
                     # _mixture_amplitude: (1, n_mics, n_bins, n_frames)
                     for target in self.sources:
-                        _estimated_sources_amplitude = self.model(_mixture_amplitude, target=target)
+                        with autocast(self.device_type, dtype=self.amp_dtype):
+                            _estimated_sources_amplitude = self.model(_mixture_amplitude, target=target)
+                        _estimated_sources_amplitude = _estimated_sources_amplitude.float()
                         estimated_sources_amplitude[target].append(_estimated_sources_amplitude)
                 
                 estimated_sources_amplitude = [
@@ -346,8 +387,7 @@ class AdhocTester(TesterBase):
                 for source_idx, target in enumerate(self.sources):
                     estimated_path = os.path.join(track_dir, "{}.wav".format(target))
                     estimated_source = estimated_sources[source_idx, :, :samples] # -> (n_mics, T)
-                    signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                    torchaudio.save(estimated_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                    self.audio_writer.save(estimated_path, estimated_source)
                 
                 s = "{},".format(name)
                 for idx, target in enumerate(self.sources):
@@ -362,6 +402,8 @@ class AdhocTester(TesterBase):
                 test_loss += loss # (n_sources,)
                 test_loss_improvement += loss_improvement # (n_sources,)
 
+        self.audio_writer.close()
+        
         test_loss /= n_test
         test_loss_improvement /= n_test
         
@@ -376,34 +418,7 @@ class AdhocTester(TesterBase):
         print(s, flush=True)
     
     def evaluate_all(self):
-        mus = musdb.DB(root=self.musdb18_root, subsets='test', is_wav=True)
-        
-        results = museval.EvalStore(frames_agg='median', tracks_agg='median')
-
-        for track in mus.tracks:
-            name = track.name
-            
-            estimates = {}
-            estimated_accompaniment = 0
-
-            for target in self.sources:
-                estimated_path = os.path.join(self.estimates_dir, name, "{}.wav".format(target))
-                estimated, _ = torchaudio.load(estimated_path)
-                estimated = estimated.numpy().transpose(1, 0)
-                estimates[target] = estimated
-                if target != 'vocals':
-                    estimated_accompaniment += estimated
-
-            estimates['accompaniment'] = estimated_accompaniment
-
-            # Evaluate using museval
-            scores = museval.eval_mus_track(track, estimates, output_dir=self.json_dir)
-            results.add_track(scores)
-
-            print(name)
-            print(scores, flush=True)
-
-        print(results)
+        evaluate_tracks(self.musdb18_root, self.estimates_dir, self.sources, json_dir=self.json_dir, num_workers=self.n_eval_workers)
 
     def apply_multichannel_wiener_filter(self, mixture, estimated_sources_amplitude, channels_first=True, eps=EPS):
         if self.use_norbert:
@@ -5,6 +5,7 @@ import torch
 import torchaudio
 import torch.nn.functional as F
 
+from utils.manifest import SegmentIndex
 from dataset import SpectrogramDataset
 
 __sources__ = ['bass', 'drums', 'other', 'vocals']
@@ -66,11 +67,12 @@ class SpectrogramTrainDataset(SpectrogramDataset):
                 samples_per_epoch = int(total_duration / duration)
 
             self.samples_per_epoch = samples_per_epoch
-            self.json_data = None
+            self.segments = None
         else:
             if overlap is None:
                 overlap = patch_samples // 2
             self.samples_per_epoch = None
+            lengths = []
 
             for trackID, name in enumerate(names):
                 mixture_path = os.path.join(musdb18_root, 'train', name, "mixture.wav")
@@ -89,16 +91,9 @@ class SpectrogramTrainDataset(SpectrogramDataset):
                 for source in sources:
                     track['path'][source] = os.path.join(musdb18_root, 'train', name, "{}.wav".format(source))
                 self.tracks.append(track)
+                lengths.append(track_samples)
 
-                for start in range(0, track_samples, patch_samples - overlap):
-                    if start + patch_samples >= track_samples:
-                        break
-                    data = {
-                        'trackID': trackID,
-                        'start': start,
-                        'samples': patch_samples,
-                    }
-                    self.json_data.append(data)
+            self.segments = SegmentIndex.from_lengths(names, lengths, samples=patch_samples, overlap=overlap, strict=True)
 
         if sample_rate != SAMPLE_RATE_MUSDB18:
             self.pre_resampler = torchaudio.transforms.Resample(SAMPLE_RATE_MUSDB18, sample_rate)
@@ -141,9 +136,7 @@ class SpectrogramTrainDataset(SpectrogramDataset):
         if self.augmentation:
             return self.samples_per_epoch
         else:
-            source = self.sources[0]
-            
-            return len(self.json_data[source])
+            return len(self.segments)
 
     def _getitem(self, idx):
         """
@@ -320,6 +313,9 @@ class SpectrogramEvalDataset(SpectrogramDataset):
         
         return mixture, target, name
 
+    def __len__(self):
+        return len(self.json_data)
+
 class SpectrogramTestDataset(SpectrogramDataset):
     def __init__(self, musdb18_root, fft_size, hop_size=None, window_fn='hann', normalize=False, sample_rate=SAMPLE_RATE_MUSDB18, patch_size=256, sources=__sources__, target=None):
         super().__init__(
@@ -439,6 +435,9 @@ class SpectrogramTestDataset(SpectrogramDataset):
         
         return mixture, target, samples, name
 
+    def __len__(self):
+        return len(self.json_data)
+
 """
 Data loader
 """
@@ -1,14 +1,14 @@
 import os
 import time
 
-import musdb
-import museval
 import torch
-import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
-from driver import TrainerBase, TesterBase
+from utils.async_writer import AsyncCheckpointWriter, AsyncAudioWriter
+from utils.prefetch import wrap_prefetch_loader
+from utils.profiler import wrap_profiled_loader
+from driver import DEFAULT_N_EVAL_WORKERS, TrainerBase, TesterBase, evaluate_tracks
 
 BITS_PER_SAMPLE_MUSDB18 = 16
 EPS = 1e-12
@@ -42,6 +42,9 @@ class AdhocTrainer(TrainerBase):
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = AsyncCheckpointWriter()
+        self.audio_writer = AsyncAudioWriter(self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
@@ -49,6 +52,12 @@ class AdhocTrainer(TrainerBase):
         
         self.use_cuda = args.use_cuda
         
+        # Stage next batches on background thread if `--prefetch` is given, and report data wait time every epoch.
+        self.train_loader = wrap_prefetch_loader(self.train_loader, args, use_cuda=self.use_cuda)
+        
+        # Measure time of data loading, forward, backward, etc. every epoch if `--profile` is given.
+        self.train_loader = wrap_profiled_loader(self.train_loader, self.model, self.optimizer, args, use_cuda=self.use_cuda)
+        
         if args.continue_from:
             config = torch.load(args.continue_from, map_location=lambda storage, loc: storage)
             
@@ -110,7 +119,9 @@ class AdhocTrainer(TrainerBase):
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch + 1], valid_loss=self.valid_loss[:epoch + 1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1].clone(), valid_loss=self.valid_loss[:epoch + 1].clone(), save_path=save_path)
+        
+        self.checkpoint_writer.close()
     
     def run_one_epoch_train(self, epoch):
         # Override
@@ -196,12 +207,12 @@ class AdhocTrainer(TrainerBase):
 
                     os.makedirs(save_dir, exist_ok=True)
                     save_path = os.path.join(save_dir, "mixture.wav")
-                    signal = mixture.unsqueeze(dim=0) if mixture.dim() == 1 else mixture
-                    torchaudio.save(save_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                    self.audio_writer.save(save_path, mixture)
                     
                     save_path = os.path.join(save_dir, "epoch{}.wav".format(epoch + 1))
-                    signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                    torchaudio.save(save_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                    self.audio_writer.save(save_path, estimated_source)
+        
+        self.audio_writer.wait()
         
         valid_loss /= n_valid
         
@@ -233,6 +244,13 @@ class SingleTargetTester(TesterBase):
             self.json_dir = os.path.abspath(args.json_dir)
             os.makedirs(self.json_dir, exist_ok=True)
         
+        if hasattr(args, 'n_eval_workers'):
+            self.n_eval_workers = args.n_eval_workers
+        else:
+            self.n_eval_workers = DEFAULT_N_EVAL_WORKERS
+        
+        self.audio_writer = AsyncAudioWriter(self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+        
         self.use_estimate_all, self.use_evaluate_all = args.estimate_all, args.evaluate_all
         
         self.use_cuda = args.use_cuda
@@ -314,12 +332,13 @@ class SingleTargetTester(TesterBase):
 
                 estimated_path = os.path.join(track_dir, "{}.wav".format(target))
                 estimated_source = estimated_source[:, :samples] # -> (n_mics, T)
-                signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                torchaudio.save(estimated_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                self.audio_writer.save(estimated_path, estimated_source)
             
                 test_loss += loss.item() # ()
                 test_loss_improvement += loss_improvement.item() # ()
 
+        self.audio_writer.close()
+        
         test_loss /= n_test
         test_loss_improvement /= n_test
         
@@ -331,26 +350,4 @@ class SingleTargetTester(TesterBase):
         print(s, flush=True)
     
     def evaluate_all(self):
-        mus = musdb.DB(root=self.musdb18_root, subsets='test', is_wav=True)
-        results = museval.EvalStore(frames_agg='median', tracks_agg='median')
-
-        target = self.target
-
-        for track in mus.tracks:
-            name = track.name
-            
-            estimated_path = os.path.join(self.estimates_dir, name, "{}.wav".format(target))
-            estimated, _ = torchaudio.load(estimated_path)
-            estimated = estimated.numpy().transpose(1, 0)
-            estimates = {
-                target: estimated
-            }
-
-            # Evaluate using museval
-            scores = museval.eval_mus_track(track, estimates, output_dir=self.json_dir)
-            results.add_track(scores)
-
-            print(name)
-            print(scores, flush=True)
-
-        print(results)
\ No newline at end of file
+        evaluate_tracks(self.musdb18_root, self.estimates_dir, [self.target], json_dir=self.json_dir, num_workers=self.n_eval_workers, accompaniment=False)
@@ -6,6 +6,9 @@ import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.async_writer import AsyncCheckpointWriter
+from utils.prefetch import wrap_prefetch_loader
+from utils.profiler import wrap_profiled_loader
 from driver import TrainerBase
 
 SAMPLE_RATE_MUSDB18 = 44100
@@ -38,6 +41,8 @@ class Trainer(TrainerBase):
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = AsyncCheckpointWriter()
+        
         self.epochs = args.epochs
         
         self.train_loss = {}
@@ -48,6 +53,12 @@ class Trainer(TrainerBase):
         
         self.use_cuda = args.use_cuda
         
+        # Stage next batches on background thread if `--prefetch` is given, and report data wait time every epoch.
+        self.train_loader = wrap_prefetch_loader(self.train_loader, args, use_cuda=self.use_cuda)
+        
+        # Measure time of data loading, forward, backward, etc. every epoch if `--profile` is given.
+        self.train_loader = wrap_profiled_loader(self.train_loader, self.model, self.optimizer, args, use_cuda=self.use_cuda)
+        
         if args.continue_from:
             package = torch.load(args.continue_from, map_location=lambda storage, loc: storage)
             
@@ -113,7 +124,9 @@ class Trainer(TrainerBase):
 
             for key in ['loss', 'main', 'reconstruction', 'similarity', 'dissimilarity']:
                 save_path = os.path.join(self.loss_dir, "{}.png".format(key))
-                draw_loss_curve(train_loss=self.train_loss[key][:epoch+1], valid_loss=self.valid_loss[key][:epoch+1], save_path=save_path)
+                self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[key][:epoch + 1].clone(), valid_loss=self.valid_loss[key][:epoch + 1].clone(), save_path=save_path)
+        
+        self.checkpoint_writer.close()
 
     def run_one_epoch(self, epoch):
         """
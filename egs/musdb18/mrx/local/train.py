@@ -8,8 +8,8 @@ import torch
 import torch.nn as nn
 
 from utils.utils import set_seed
-from utils.augmentation import SequentialAugmentation, choose_augmentation
-from dataset import AugmentationWaveTrainDataset, TrainDataLoader
+from utils.augmentation import SequentialAugmentation, choose_augmentation, choose_batch_augmentation
+from dataset import SAMPLE_RATE_MUSDB18, AugmentationWaveTrainDataset, build_resampled_musdb18, TrainDataLoader
 from adhoc_dataset import WaveEvalDataset, EvalDataLoader
 from adhoc_driver import AdhocTrainer
 from models.mrx import MultiResolutionCrossNet
@@ -23,6 +23,8 @@ parser.add_argument('--sample_rate', '-sr', type=int, default=44100, help='Sampl
 parser.add_argument('--duration', type=float, default=6, help='Duration')
 parser.add_argument('--valid_duration', type=float, default=30, help='Max duration for validation')
 parser.add_argument('--augmentation_path', type=str, default=None, help='Path to augmentation.yaml')
+parser.add_argument('--batch_augmentation', type=int, default=0, help='0: Apply augmentation to every source in dataset, 1: Apply augmentation to whole batch at once')
+parser.add_argument('--n_remixes', type=int, default=0, help='Number of in-batch remixes of sources. 0: Not remix sources.')
 parser.add_argument('--sources', type=str, default="[bass,drums,other,vocals]", help='Source names')
 parser.add_argument('--criterion', type=str, default='sisdr', choices=['sisdr'], help='Criterion')
 parser.add_argument('--optimizer', type=str, default='adam', choices=['sgd', 'adam', 'rmsprop'], help='Optimizer, [sgd, adam, rmsprop]')
@@ -38,8 +40,14 @@ parser.add_argument('--sample_dir', type=str, default='./tmp/sample', help='Samp
 parser.add_argument('--continue_from', type=str, default=None, help='Resume training')
 parser.add_argument('--use_norbert', type=int, default=0, help='Use norbert.wiener for multichannel wiener filetering. 0: Not use norbert, 1: Use norbert (you have to install norbert)')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--prefetch', type=int, default=0, help='Number of training batches staged in advance on background thread. If 0, prefetching is disabled. Default: 0')
+parser.add_argument('--profile', type=str, default='none', choices=['none', 'timer', 'trace'], help='timer: Report time of data loading, forward, backward, etc. and throughput every epoch, trace: In addition, export torch.profiler traces as Chrome trace files. Default: none')
+parser.add_argument('--profile_dir', type=str, default='./tmp/profile', help='Directory of torch.profiler traces')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--num_workers', type=int, default=0, help='# of workers given to data loader for training.')
+parser.add_argument('--cache_size', type=float, default=0, help='Size of decoded track cache per worker [GB]. 0: Not use cache.')
+parser.add_argument('--resample_corpus', type=int, default=0, help='1: Resample training tracks once before training if sample_rate is not 44100, 0: Resample every crop. Resampled corpus built before is used in both cases.')
+parser.add_argument('--resampled_root', type=str, default=None, help='Root directory of resampled corpora. Default: <musdb18_root>/.resampled')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
 def main(args):
@@ -55,15 +63,32 @@ def main(args):
         config_augmentation = yaml.safe_load(f)
     
     augmentation = SequentialAugmentation()
+
+    if args.batch_augmentation or args.n_remixes > 0:
+        batch_augmentation = SequentialAugmentation()
+
+        if args.n_remixes > 0:
+            batch_augmentation.append(choose_batch_augmentation('remix', n_remixes=args.n_remixes))
+    else:
+        batch_augmentation = None
+    
     for name in config_augmentation['augmentation']:
-        augmentation.append(choose_augmentation(name, **config_augmentation[name]))
+        if args.batch_augmentation:
+            batch_augmentation.append(choose_batch_augmentation(name, **config_augmentation[name]))
+        else:
+            augmentation.append(choose_augmentation(name, **config_augmentation[name]))
+    
+    if args.resample_corpus and args.sample_rate != SAMPLE_RATE_MUSDB18:
+        build_resampled_musdb18(args.musdb18_root, args.sample_rate, sources=args.sources, resampled_root=args.resampled_root, num_workers=args.num_workers)
     
     train_dataset = AugmentationWaveTrainDataset(
         args.musdb18_root,
         sample_rate=args.sample_rate, duration=args.duration, samples_per_epoch=args.samples_per_epoch,
         sources=args.sources, target=args.sources,
         include_valid=True,
-        augmentation=augmentation
+        augmentation=augmentation,
+        cache_bytes=int(args.cache_size * (1 << 30)),
+        resampled_root=args.resampled_root
     )
     valid_dataset = WaveEvalDataset(args.musdb18_root, sample_rate=args.sample_rate, patch_duration=args.duration, max_duration=args.valid_duration, sources=args.sources, target=args.sources)
     
@@ -71,7 +96,7 @@ def main(args):
     print("Valid dataset includes {} samples.".format(len(valid_dataset)))
     
     loader = {}
-    loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers)
+    loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers, batch_augmentation=batch_augmentation)
     loader['valid'] = EvalDataLoader(valid_dataset, batch_size=1, shuffle=False)
     
     if args.max_norm is not None and args.max_norm == 0:
@@ -112,6 +112,9 @@ class WaveEvalDataset(WaveDataset):
 
         return mixture, target, name
 
+    def __len__(self):
+        return len(self.json_data)
+
 """
 Data loader
 """
@@ -1,7 +1,6 @@
 import os
 
 import torch
-import torchaudio
 import torch.nn as nn
 
 from driver import TrainerBase
@@ -88,11 +87,7 @@ class AdhocTrainer(TrainerBase):
                     os.makedirs(save_dir, exist_ok=True)
                     save_path = os.path.join(save_dir, "mixture.wav")
 
-                    if self.save_normalized:
-                        norm = torch.abs(mixture).max()
-                        mixture = mixture / norm
-                    
-                    torchaudio.save(save_path, mixture, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                    self.audio_writer.save(save_path, mixture, normalize=self.save_normalized)
                     
                     save_dir = os.path.join(self.sample_dir, titles, "epoch{}".format(epoch + 1))
                     os.makedirs(save_dir, exist_ok=True)
@@ -101,11 +96,9 @@ class AdhocTrainer(TrainerBase):
                         target = self.valid_loader.dataset.target[source_idx]
                         save_path = os.path.join(save_dir, "{}.wav".format(target))
                         
-                        if self.save_normalized:
-                            norm = torch.abs(estimated_source).max()
-                            estimated_source = estimated_source / norm
-                        
-                        torchaudio.save(save_path, estimated_source, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                        self.audio_writer.save(save_path, estimated_source, normalize=self.save_normalized)
+        
+        self.audio_writer.wait()
         
         valid_loss /= n_valid
         
@@ -131,4 +124,4 @@ class AdhocTrainer(TrainerBase):
         config['sample_rate'] = self.train_loader.dataset.sample_rate
         config['sources'] = self.train_loader.dataset.sources
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
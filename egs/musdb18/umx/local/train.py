@@ -8,8 +8,8 @@ import torch
 import torch.nn as nn
 
 from utils.utils import set_seed
-from utils.augmentation import SequentialAugmentation, choose_augmentation
-from dataset import AugmentationSpectrogramTrainDataset, TrainDataLoader
+from utils.augmentation import SequentialAugmentation, choose_augmentation, choose_batch_augmentation
+from dataset import AugmentationSpectrogramTrainDataset, SpectrogramTrainDataLoader
 from adhoc_dataset import SpectrogramEvalDataset, EvalDataLoader
 from adhoc_driver import AdhocTrainer
 from models.umx import OpenUnmix
@@ -26,6 +26,8 @@ parser.add_argument('--hop_size', type=int, default=1024, help='Hop length')
 parser.add_argument('--max_bin', type=int, default=1487, help='Max frequency bin')
 parser.add_argument('--window_fn', type=str, default='hann', help='Window function')
 parser.add_argument('--augmentation_path', type=str, default=None, help='Path to augmentation.yaml')
+parser.add_argument('--batch_augmentation', type=int, default=0, help='0: Apply augmentation to every source in dataset, 1: Apply augmentation to whole batch at once')
+parser.add_argument('--n_remixes', type=int, default=0, help='Number of in-batch remixes of sources. 0: Not remix sources.')
 parser.add_argument('--hidden_channels', type=int, default=512, help='# of hidden channels')
 parser.add_argument('--num_layers', type=int, default=3, help='# of layers in LSTM')
 parser.add_argument('--dropout', type=float, default=0, help='dropout')
@@ -45,8 +47,12 @@ parser.add_argument('--loss_dir', type=str, default='./tmp/loss', help='Loss dir
 parser.add_argument('--sample_dir', type=str, default='./tmp/sample', help='Sample directory')
 parser.add_argument('--continue_from', type=str, default=None, help='Resume training')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--prefetch', type=int, default=0, help='Number of training batches staged in advance on background thread. If 0, prefetching is disabled. Default: 0')
+parser.add_argument('--profile', type=str, default='none', choices=['none', 'timer', 'trace'], help='timer: Report time of data loading, forward, backward, etc. and throughput every epoch, trace: In addition, export torch.profiler traces as Chrome trace files. Default: none')
+parser.add_argument('--profile_dir', type=str, default='./tmp/profile', help='Directory of torch.profiler traces')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--num_workers', type=int, default=0, help='# of workers given to data loader for training.')
+parser.add_argument('--cache_size', type=float, default=0, help='Size of decoded track cache per worker [GB]. 0: Not use cache.')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
 def main(args):
@@ -65,8 +71,20 @@ def main(args):
         config_augmentation = yaml.safe_load(f)
     
     augmentation = SequentialAugmentation()
+
+    if args.batch_augmentation or args.n_remixes > 0:
+        batch_augmentation = SequentialAugmentation()
+
+        if args.n_remixes > 0:
+            batch_augmentation.append(choose_batch_augmentation('remix', n_remixes=args.n_remixes))
+    else:
+        batch_augmentation = None
+    
     for name in config_augmentation['augmentation']:
-        augmentation.append(choose_augmentation(name, **config_augmentation[name]))
+        if args.batch_augmentation:
+            batch_augmentation.append(choose_batch_augmentation(name, **config_augmentation[name]))
+        else:
+            augmentation.append(choose_augmentation(name, **config_augmentation[name]))
     
     train_dataset = AugmentationSpectrogramTrainDataset(
         args.musdb18_root,
@@ -74,7 +92,8 @@ def main(args):
         sample_rate=args.sample_rate, patch_samples=patch_samples, samples_per_epoch=args.samples_per_epoch,
         sources=args.sources, target=args.target,
         include_valid=True,
-        augmentation=augmentation
+        augmentation=augmentation,
+        cache_bytes=int(args.cache_size * (1 << 30))
     )
     valid_dataset = SpectrogramEvalDataset(args.musdb18_root, fft_size=args.fft_size, hop_size=args.hop_size, window_fn=args.window_fn, sample_rate=args.sample_rate, patch_size=patch_size, max_samples=max_samples, sources=args.sources, target=args.target)
     
@@ -82,7 +101,7 @@ def main(args):
     print("Valid dataset includes {} samples.".format(len(valid_dataset)))
     
     loader = {}
-    loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers)
+    loader['train'] = SpectrogramTrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers, batch_augmentation=batch_augmentation)
     loader['valid'] = EvalDataLoader(valid_dataset, batch_size=1, shuffle=False)
     
     if args.max_norm is not None and args.max_norm == 0:
@@ -1,15 +1,15 @@
 import os
 import time
 
-import musdb
-import museval
 import torch
-import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.async_writer import AsyncCheckpointWriter, AsyncAudioWriter
+from utils.prefetch import wrap_prefetch_loader
+from utils.profiler import wrap_profiled_loader
 from driver import apply_multichannel_wiener_filter_norbert, apply_multichannel_wiener_filter_torch
-from driver import TrainerBase, TesterBase
+from driver import DEFAULT_N_EVAL_WORKERS, TrainerBase, TesterBase, evaluate_tracks
 
 BITS_PER_SAMPLE_MUSDB18 = 16
 EPS = 1e-12
@@ -44,6 +44,9 @@ class AdhocSchedulerTrainer(TrainerBase):
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = AsyncCheckpointWriter()
+        self.audio_writer = AsyncAudioWriter(self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+        
         self.epochs = args.epochs
 
         self.combination = args.combination
@@ -57,6 +60,12 @@ class AdhocSchedulerTrainer(TrainerBase):
             self.valid_loss = torch.empty(self.epochs, n_sources)
         
         self.use_cuda = args.use_cuda
+        
+        # Stage next batches on background thread if `--prefetch` is given, and report data wait time every epoch.
+        self.train_loader = wrap_prefetch_loader(self.train_loader, args, use_cuda=self.use_cuda)
+        
+        # Measure time of data loading, forward, backward, etc. every epoch if `--profile` is given.
+        self.train_loader = wrap_profiled_loader(self.train_loader, self.model, self.optimizer, args, use_cuda=self.use_cuda)
         self.use_norbert = args.use_norbert
         
         if args.continue_from:
@@ -93,6 +102,8 @@ class AdhocSchedulerTrainer(TrainerBase):
             self.run_combination()
         else:
             self.run_no_combination()
+        
+        self.checkpoint_writer.close()
     
     def run_combination(self):
         for epoch in range(self.start_epoch, self.epochs):
@@ -121,7 +132,7 @@ class AdhocSchedulerTrainer(TrainerBase):
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch + 1], valid_loss=self.valid_loss[:epoch + 1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1].clone(), valid_loss=self.valid_loss[:epoch + 1].clone(), save_path=save_path)
 
     def run_no_combination(self):
         for epoch in range(self.start_epoch, self.epochs):
@@ -164,10 +175,10 @@ class AdhocSchedulerTrainer(TrainerBase):
                 save_dir = os.path.join(self.loss_dir, target)
                 os.makedirs(save_dir, exist_ok=True)
                 save_path = os.path.join(save_dir, "loss.png")
-                draw_loss_curve(train_loss=self.train_loss[:epoch + 1, idx], valid_loss=self.valid_loss[:epoch + 1, idx], save_path=save_path)
+                self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1, idx].clone(), valid_loss=self.valid_loss[:epoch + 1, idx].clone(), save_path=save_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch + 1].mean(dim=-1), valid_loss=self.valid_loss[:epoch + 1].mean(dim=-1), save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1].mean(dim=-1), valid_loss=self.valid_loss[:epoch + 1].mean(dim=-1), save_path=save_path)
 
     def run_one_epoch_train(self, epoch):
         # Override
@@ -238,16 +249,16 @@ class AdhocSchedulerTrainer(TrainerBase):
                     os.makedirs(track_dir, exist_ok=True)
 
                     save_path = os.path.join(track_dir, "mixture.wav")
-                    signal = mixture.unsqueeze(dim=0) if mixture.dim() == 1 else mixture
-                    torchaudio.save(save_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                    self.audio_writer.save(save_path, mixture)
 
                     epoch_dir = os.path.join(track_dir, "epoch{}".format(epoch + 1))
                     os.makedirs(epoch_dir, exist_ok=True)
 
                     for target, estimated_source in zip(self.sources, estimated_sources):
                         save_path = os.path.join(epoch_dir, "{}.wav".format(target))
-                        signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                        torchaudio.save(save_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                        self.audio_writer.save(save_path, estimated_source)
+        
+        self.audio_writer.wait()
         
         valid_loss /= n_valid
         
@@ -374,7 +385,7 @@ class AdhocSchedulerTrainer(TrainerBase):
         
         config['epoch'] = epoch + 1
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class AdhocTester(TesterBase):
     def __init__(self, model, loader, criterion, args):
@@ -402,6 +413,13 @@ class AdhocTester(TesterBase):
             self.json_dir = os.path.abspath(args.json_dir)
             os.makedirs(self.json_dir, exist_ok=True)
         
+        if hasattr(args, 'n_eval_workers'):
+            self.n_eval_workers = args.n_eval_workers
+        else:
+            self.n_eval_workers = DEFAULT_N_EVAL_WORKERS
+        
+        self.audio_writer = AsyncAudioWriter(self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+        
         self.combination = args.combination
 
         self.use_estimate_all, self.use_evaluate_all = args.estimate_all, args.evaluate_all
@@ -481,40 +499,13 @@ class AdhocTester(TesterBase):
                 for source_idx, target in enumerate(self.sources):
                     estimated_path = os.path.join(track_dir, "{}.wav".format(target))
                     estimated_source = estimated_sources[source_idx, :, :samples] # -> (n_mics, T)
-                    signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                    torchaudio.save(estimated_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_MUSDB18)
+                    self.audio_writer.save(estimated_path, estimated_source)
 
                 print("{} / {}".format(idx + 1, n_test), name, flush=True)
-    
-    def evaluate_all(self):
-        mus = musdb.DB(root=self.musdb18_root, subsets='test', is_wav=True)
         
-        results = museval.EvalStore(frames_agg='median', tracks_agg='median')
-
-        for track in mus.tracks:
-            name = track.name
-            
-            estimates = {}
-            estimated_accompaniment = 0
-
-            for target in self.sources:
-                estimated_path = os.path.join(self.estimates_dir, name, "{}.wav".format(target))
-                estimated, _ = torchaudio.load(estimated_path)
-                estimated = estimated.numpy().transpose(1, 0)
-                estimates[target] = estimated
-                if target != 'vocals':
-                    estimated_accompaniment += estimated
-
-            estimates['accompaniment'] = estimated_accompaniment
-
-            # Evaluate using museval
-            scores = museval.eval_mus_track(track, estimates, output_dir=self.json_dir)
-            results.add_track(scores)
-
-            print(name)
-            print(scores, flush=True)
-
-        print(results)
+        self.audio_writer.close()
+    def evaluate_all(self):
+        evaluate_tracks(self.musdb18_root, self.estimates_dir, self.sources, json_dir=self.json_dir, num_workers=self.n_eval_workers)
 
     def apply_multichannel_wiener_filter(self, mixture, estimated_sources_amplitude, channels_first=True, eps=EPS):
         if self.use_norbert:
@@ -3,9 +3,9 @@
 
 import argparse
 import torch
-import torch.nn as nn
 
 from utils.utils import set_seed
+from utils.distributed import init_distributed, get_rank, distribute_model
 from dataset import ThresholdWeightSpectrogramTrainDataset, TrainDataLoader, EvalDataLoader
 from driver import AnchoredAttractorTrainer
 from models.adanet import ADANet
@@ -19,6 +19,8 @@ parser.add_argument('--valid_json_path', type=str, default=None, help='Path for
 parser.add_argument('--sample_rate', '-sr', type=int, default=8000, help='Sampling rate')
 parser.add_argument('--window_fn', type=str, default='hamming', help='Window function')
 parser.add_argument('--threshold', type=float, default=40, help='Wight threshold. Default: 40 ')
+parser.add_argument('--feature_cache_dir', type=str, default=None, help='Directory to cache threshold weights. If None, they are computed on the fly.')
+parser.add_argument('--num_workers', type=int, default=0, help='Number of workers for data loading and feature caching')
 
 # Model configuration
 parser.add_argument('--fft_size', type=int, default=256, help='Window length')
@@ -42,19 +44,35 @@ parser.add_argument('--loss_dir', type=str, default='./tmp/loss', help='Loss dir
 parser.add_argument('--sample_dir', type=str, default='./tmp/sample', help='Sample directory')
 parser.add_argument('--continue_from', type=str, default=None, help='Resume training')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--prefetch', type=int, default=0, help='Number of training batches staged in advance on background thread. If 0, prefetching is disabled. Default: 0')
+parser.add_argument('--profile', type=str, default='none', choices=['none', 'timer', 'trace'], help='timer: Report time of data loading, forward, backward, etc. and throughput every epoch, trace: In addition, export torch.profiler traces as Chrome trace files. Default: none')
+parser.add_argument('--profile_dir', type=str, default='./tmp/profile', help='Directory of torch.profiler traces')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
 def main(args):
-    set_seed(args.seed)
+    # Launched by `torchrun --nproc_per_node <N> local/train.py ...` for multi-process training.
+    distributed = init_distributed(use_cuda=args.use_cuda)
+    # Every process draws different random crops and mixtures.
+    set_seed(args.seed + get_rank())
     
     train_dataset = ThresholdWeightSpectrogramTrainDataset(args.wav_root, args.train_json_path, fft_size=args.fft_size, hop_size=args.hop_size, window_fn=args.window_fn, threshold=args.threshold)
     valid_dataset = ThresholdWeightSpectrogramTrainDataset(args.wav_root, args.valid_json_path, fft_size=args.fft_size, hop_size=args.hop_size, window_fn=args.window_fn, threshold=args.threshold)
+
+    if args.feature_cache_dir is not None:
+        train_dataset.build_feature_cache(args.feature_cache_dir, num_workers=args.num_workers)
+        valid_dataset.build_feature_cache(args.feature_cache_dir, num_workers=args.num_workers)
+    
     print("Training dataset includes {} samples.".format(len(train_dataset)))
     print("Valid dataset includes {} samples.".format(len(valid_dataset)))
     
     loader = {}
-    loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
+    if distributed:
+        # batch_size is per process.
+        train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset, shuffle=True)
+        loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, sampler=train_sampler, num_workers=args.num_workers)
+    else:
+        loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers)
     loader['valid'] = TrainDataLoader(valid_dataset, batch_size=args.batch_size, shuffle=False)
     
     args.n_bins = args.fft_size//2 + 1
@@ -67,12 +85,13 @@ def main(args):
     if args.use_cuda:
         if torch.cuda.is_available():
             model.cuda()
-            model = nn.DataParallel(model)
+            model = distribute_model(model, use_cuda=True)
             print("Use CUDA")
         else:
             raise ValueError("Cannot use CUDA.")
     else:
         print("Does NOT use CUDA")
+        model = distribute_model(model)
     
     # Optimizer
     if args.optimizer == 'sgd':
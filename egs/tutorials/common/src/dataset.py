@@ -1,9 +1,12 @@
 import os
 import json
+import hashlib
+import functools
 
 import torch
 import torchaudio
 
+from utils.feature_cache import build_feature_cache, feature_collate_fn
 from algorithm.frequency_mask import ideal_binary_mask, ideal_ratio_mask, wiener_filter_mask
 
 EPS=1e-12
@@ -107,6 +110,7 @@ class SpectrogramDataset(WaveDataset):
         else:
             self.window = None
         
+        self.window_fn = window_fn
         self.normalize = normalize
         
     def __getitem__(self, idx):
@@ -148,8 +152,11 @@ class IdealMaskSpectrogramDataset(SpectrogramDataset):
         else:
             raise NotImplementedError("Not support mask {}".format(mask_type))
         
+        self.mask_type = mask_type
         self.threshold = threshold
         self.eps = eps
+
+        self.feature_cache = None
     
     def __getitem__(self, idx):
         """
@@ -161,21 +168,45 @@ class IdealMaskSpectrogramDataset(SpectrogramDataset):
             T (), <int>: Number of samples in time-domain
             segment_IDs (n_sources,) <list<str>>
         """
-        threshold = self.threshold
-        eps = self.eps
-        
         mixture, sources, T, segment_IDs = super().__getitem__(idx) # (1, n_bins, n_frames), (n_sources, n_bins, n_frames)
-        sources_amplitude = torch.abs(sources)
-        ideal_mask = self.generate_mask(sources_amplitude)
-        
-        mixture_amplitude = torch.abs(mixture)
-        log_amplitude = 20 * torch.log10(mixture_amplitude + eps)
-        max_log_amplitude = torch.max(log_amplitude)
-        threshold = 10**((max_log_amplitude - threshold) / 20)
-        threshold_weight = torch.where(mixture_amplitude > threshold, torch.ones_like(mixture_amplitude), torch.zeros_like(mixture_amplitude))
+
+        if self.feature_cache is None:
+            ideal_mask = self.generate_mask(torch.abs(sources))
+            threshold_weight = compute_threshold_weight(mixture, threshold=self.threshold, eps=self.eps)
+        else:
+            features = self.feature_cache[idx]
+            ideal_mask, threshold_weight = features['ideal_mask'], features['threshold_weight']
         
         return mixture, sources, ideal_mask, threshold_weight, T, segment_IDs
 
+    def compute_features(self, idx):
+        """
+        Returns:
+            features <dict<str, torch.Tensor>>: Ideal mask and threshold weight of `idx`-th example
+        """
+        mixture, sources, _, _ = super().__getitem__(idx)
+        ideal_mask = self.generate_mask(torch.abs(sources))
+        threshold_weight = compute_threshold_weight(mixture, threshold=self.threshold, eps=self.eps)
+
+        return {'ideal_mask': ideal_mask, 'threshold_weight': threshold_weight}
+
+    def build_feature_cache(self, cache_root, num_workers=0):
+        """
+        Precompute ideal masks and threshold weights, and read them from `cache_root` afterwards.
+        Masks are stored as float16, so IRM and WFM are rounded to about 3 significant digits.
+        Args:
+            cache_root <str>: Root directory of feature caches
+            num_workers <int>: Number of processes to compute features
+        """
+        config = {
+            'wav_root': self.wav_root,
+            'json_data': _fingerprint(self.json_data),
+            'fft_size': self.fft_size, 'hop_size': self.hop_size,
+            'window_fn': self.window_fn, 'normalize': self.normalize,
+            'mask_type': self.mask_type, 'threshold': self.threshold, 'eps': self.eps
+        }
+        self.feature_cache = build_feature_cache(self, cache_root, config, paths=_source_paths(self.wav_root, self.json_data), num_workers=num_workers)
+
 class IdealMaskSpectrogramTrainDataset(IdealMaskSpectrogramDataset):
     def __init__(self, wav_root, json_path, fft_size, hop_size=None, window_fn='hann', normalize=False, mask_type='ibm', threshold=40):
         super().__init__(wav_root, json_path, fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize, mask_type=mask_type, threshold=threshold)
@@ -233,6 +264,8 @@ class ThresholdWeightSpectrogramDataset(SpectrogramDataset):
         self.threshold = threshold
         self.eps = eps
 
+        self.feature_cache = None
+
     def __getitem__(self, idx):
         """
         Returns:
@@ -242,19 +275,41 @@ class ThresholdWeightSpectrogramDataset(SpectrogramDataset):
             T (), <int>: Number of samples in time-domain
             segment_IDs (n_sources,) <list<str>>
         """
-        threshold = self.threshold
-        eps = self.eps
-        
         mixture, sources, T, segment_IDs = super().__getitem__(idx) # (1, n_bins, n_frames), (n_sources, n_bins, n_frames)
-        
-        mixture_amplitude = torch.abs(mixture)
-        log_amplitude = 20 * torch.log10(mixture_amplitude + eps)
-        max_log_amplitude = torch.max(log_amplitude)
-        threshold = 10**((max_log_amplitude - threshold) / 20)
-        threshold_weight = torch.where(mixture_amplitude > threshold, torch.ones_like(mixture_amplitude), torch.zeros_like(mixture_amplitude))
+
+        if self.feature_cache is None:
+            threshold_weight = compute_threshold_weight(mixture, threshold=self.threshold, eps=self.eps)
+        else:
+            threshold_weight = self.feature_cache[idx]['threshold_weight']
         
         return mixture, sources, threshold_weight, T, segment_IDs
 
+    def compute_features(self, idx):
+        """
+        Returns:
+            features <dict<str, torch.Tensor>>: Threshold weight of `idx`-th example
+        """
+        mixture, _, _, _ = super().__getitem__(idx)
+        threshold_weight = compute_threshold_weight(mixture, threshold=self.threshold, eps=self.eps)
+
+        return {'threshold_weight': threshold_weight}
+
+    def build_feature_cache(self, cache_root, num_workers=0):
+        """
+        Precompute threshold weights, and read them from `cache_root` afterwards.
+        Args:
+            cache_root <str>: Root directory of feature caches
+            num_workers <int>: Number of processes to compute features
+        """
+        config = {
+            'wav_root': self.wav_root,
+            'json_data': _fingerprint(self.json_data),
+            'fft_size': self.fft_size, 'hop_size': self.hop_size,
+            'window_fn': self.window_fn, 'normalize': self.normalize,
+            'threshold': self.threshold, 'eps': self.eps
+        }
+        self.feature_cache = build_feature_cache(self, cache_root, config, paths=_source_paths(self.wav_root, self.json_data), num_workers=num_workers)
+
 class ThresholdWeightSpectrogramTrainDataset(ThresholdWeightSpectrogramDataset):
     def __init__(self, wav_root, json_path, fft_size, hop_size=None, window_fn='hann', normalize=False, threshold=40, eps=EPS):
         super().__init__(wav_root, json_path, fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize, threshold=threshold, eps=eps)
@@ -270,16 +325,51 @@ class ThresholdWeightSpectrogramTrainDataset(ThresholdWeightSpectrogramDataset):
         
         return mixture, sources, threshold_weight
 
+def compute_threshold_weight(mixture, threshold=40, eps=EPS):
+    """
+    Args:
+        mixture (1, n_bins, n_frames) <torch.Tensor>: Complex spectrogram
+        threshold <float>: Threshold in dB below maximum amplitude
+    Returns:
+        threshold_weight (1, n_bins, n_frames) <torch.Tensor>: 1 for time-frequency bins louder than threshold, 0 otherwise.
+    """
+    mixture_amplitude = torch.abs(mixture)
+    log_amplitude = 20 * torch.log10(mixture_amplitude + eps)
+    max_log_amplitude = torch.max(log_amplitude)
+    threshold = 10**((max_log_amplitude - threshold) / 20)
+    threshold_weight = torch.where(mixture_amplitude > threshold, torch.ones_like(mixture_amplitude), torch.zeros_like(mixture_amplitude))
+
+    return threshold_weight
+
+def _fingerprint(json_data):
+    return hashlib.sha1(json.dumps(json_data, sort_keys=True).encode()).hexdigest()[:16]
+
+def _source_paths(wav_root, json_data):
+    paths = set()
+
+    for data in json_data:
+        for source_data in data['sources'].values():
+            paths.add(os.path.join(wav_root, source_data['path']))
+
+    return sorted(paths)
+
 class TrainDataLoader(torch.utils.data.DataLoader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        if getattr(self.dataset, 'feature_cache', None) is not None:
+            # Cached features are float16 views of memory maps, and cast to float after batching.
+            self.collate_fn = functools.partial(feature_collate_fn, collate_fn=self.collate_fn)
+
 class EvalDataLoader(torch.utils.data.DataLoader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
         assert self.batch_size == 1, "batch_size is expected 1, but given {}".format(self.batch_size)
 
+        if getattr(self.dataset, 'feature_cache', None) is not None:
+            self.collate_fn = functools.partial(feature_collate_fn, collate_fn=self.collate_fn)
+
 class TestDataLoader(torch.utils.data.DataLoader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
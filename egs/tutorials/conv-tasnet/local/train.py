@@ -3,9 +3,9 @@
 
 import argparse
 import torch
-import torch.nn as nn
 
 from utils.utils import set_seed
+from utils.distributed import init_distributed, get_rank, distribute_model
 from dataset import WaveTrainDataset, TrainDataLoader
 from driver import Trainer
 from models.conv_tasnet import ConvTasNet
@@ -52,11 +52,17 @@ parser.add_argument('--loss_dir', type=str, default='./tmp/loss', help='Loss dir
 parser.add_argument('--sample_dir', type=str, default='./tmp/sample', help='Sample directory')
 parser.add_argument('--continue_from', type=str, default=None, help='Resume training')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--prefetch', type=int, default=0, help='Number of training batches staged in advance on background thread. If 0, prefetching is disabled. Default: 0')
+parser.add_argument('--profile', type=str, default='none', choices=['none', 'timer', 'trace'], help='timer: Report time of data loading, forward, backward, etc. and throughput every epoch, trace: In addition, export torch.profiler traces as Chrome trace files. Default: none')
+parser.add_argument('--profile_dir', type=str, default='./tmp/profile', help='Directory of torch.profiler traces')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
 def main(args):
-    set_seed(args.seed)
+    # Launched by `torchrun --nproc_per_node <N> local/train.py ...` for multi-process training.
+    distributed = init_distributed(use_cuda=args.use_cuda)
+    # Every process draws different random crops and mixtures.
+    set_seed(args.seed + get_rank())
     
     train_dataset = WaveTrainDataset(args.wav_root, args.train_json_path)
     valid_dataset = WaveTrainDataset(args.wav_root, args.valid_json_path)
@@ -64,7 +70,12 @@ def main(args):
     print("Valid dataset includes {} samples.".format(len(valid_dataset)))
     
     loader = {}
-    loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
+    if distributed:
+        # batch_size is per process.
+        train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset, shuffle=True)
+        loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, sampler=train_sampler)
+    else:
+        loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
     loader['valid'] = TrainDataLoader(valid_dataset, batch_size=args.batch_size, shuffle=False)
     
     if not args.enc_nonlinear:
@@ -85,12 +96,13 @@ def main(args):
     if args.use_cuda:
         if torch.cuda.is_available():
             model.cuda()
-            model = nn.DataParallel(model)
+            model = distribute_model(model, use_cuda=True)
             print("Use CUDA", flush=True)
         else:
             raise ValueError("Cannot use CUDA.")
     else:
         print("Does NOT use CUDA", flush=True)
+        model = distribute_model(model)
         
     # Optimizer
     if args.optimizer == 'sgd':
@@ -3,9 +3,9 @@
 
 import argparse
 import torch
-import torch.nn as nn
 
 from utils.utils import set_seed
+from utils.distributed import init_distributed, get_rank, distribute_model
 from dataset import SpectrogramTrainDataset, TrainDataLoader
 from driver import Trainer
 from models.dpcl_net import DeepEmbedding
@@ -33,9 +33,15 @@ parser.add_argument('--lr', type=float, default=0.0001, help='Learning rate')
 parser.add_argument('--criterion', type=str, default='affinity', choices=['affinity'], help='Criterion')
 parser.add_argument('--exp_dir', type=str, default='./tmp', help='Path to experiment')
 parser.add_argument('--continue_from', type=str, default=None, help='Model path when resuming training')
+parser.add_argument('--prefetch', type=int, default=0, help='Number of training batches staged in advance on background thread. If 0, prefetching is disabled. Default: 0')
+parser.add_argument('--profile', type=str, default='none', choices=['none', 'timer', 'trace'], help='timer: Report time of data loading, forward, backward, etc. and throughput every epoch, trace: In addition, export torch.profiler traces as Chrome trace files. Default: none')
+parser.add_argument('--profile_dir', type=str, default='./tmp/profile', help='Directory of torch.profiler traces')
 
 def main(args):
-    set_seed(args.seed)
+    # Launched by `torchrun --nproc_per_node <N> local/train.py ...` for multi-process training.
+    distributed = init_distributed(use_cuda=args.use_cuda)
+    # Every process draws different random crops and mixtures.
+    set_seed(args.seed + get_rank())
     
     train_dataset = SpectrogramTrainDataset(args.wav_root, args.train_json_path)
     valid_dataset = SpectrogramTrainDataset(args.wav_root, args.valid_json_path)
@@ -43,7 +49,12 @@ def main(args):
     print("Valid dataset includes {} samples.".format(len(valid_dataset)))
     
     loader = {}
-    loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
+    if distributed:
+        # batch_size is per process.
+        train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset, shuffle=True)
+        loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, sampler=train_sampler)
+    else:
+        loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
     loader['valid'] = TrainDataLoader(valid_dataset, batch_size=args.batch_size, shuffle=False)
 
     args.domain = 'amplitude'
@@ -65,12 +76,13 @@ def main(args):
     if args.use_cuda:
         if torch.cuda.is_available():
             model.cuda()
-            model = nn.DataParallel(model)
+            model = distribute_model(model, use_cuda=True)
             print("Use CUDA")
         else:
             raise ValueError("Cannot use CUDA.")
     else:
         print("Does NOT use CUDA")
+        model = distribute_model(model)
     
     # Optimizer
     if args.optimizer == 'sgd':
@@ -3,6 +3,8 @@ import os
 import torch
 import torchaudio
 
+from utils.manifest import build_segment_manifest
+
 EPS = 1e-12
 
 class WSJ0Dataset(torch.utils.data.Dataset):
@@ -18,13 +20,18 @@ class WSJ0Dataset(torch.utils.data.Dataset):
         self.task = task
 
 class WaveDataset(WSJ0Dataset):
-    def __init__(self, wav_root, list_path, task='separate-noisy', samples=32000, overlap=None, n_sources=2):
+    def __init__(self, wav_root, list_path, task='separate-noisy', samples=32000, overlap=None, max_samples=None, n_sources=2):
+        """
+        Args:
+            samples <int>: Segment length. If None, one segment per utterance is used, clipped by `max_samples`.
+            max_samples <int>: Maximum length of segment when `samples` is None.
+        """
         super().__init__(wav_root, list_path, task=task)
 
         wav_root = os.path.abspath(wav_root)
         list_path = os.path.abspath(list_path)
         
-        if overlap is None:
+        if samples is not None and overlap is None:
             overlap = samples // 2
         
         if task == 'enhance':
@@ -44,51 +51,8 @@ class WaveDataset(WSJ0Dataset):
         
         self.mix_type = mix_type
         
-        self.json_data = []
-        
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix_{}'.format(mix_type), '{}.wav'.format(ID))
-                
-                wave, _ = torchaudio.load(wav_path)
-                _, T_total = wave.size()
-                
-                for start_idx in range(0, T_total, samples - overlap):
-                    end_idx = start_idx + samples
-                    if end_idx > T_total:
-                        break
-                    data = {
-                        'sources': {},
-                        'mixture': {}
-                    }
-                    
-                    for source_idx in range(n_sources):
-                        source_data = {
-                            'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
-                            'start': start_idx,
-                            'end': end_idx
-                        }
-                        data['sources']['s{}'.format(source_idx + 1)] = source_data
-                    
-                    noise_data = {
-                        'path': os.path.join('noise', '{}.wav'.format(ID)),
-                        'start': start_idx,
-                        'end': end_idx
-                    }
-
-                    data['noise'] = noise_data
-
-                    mixture_data = {
-                        'path': os.path.join('mix_{}'.format(mix_type), '{}.wav'.format(ID)),
-                        'start': start_idx,
-                        'end': end_idx
-                    }
-                    
-                    data['mixture'] = mixture_data
-                    data['ID'] = ID
-                
-                    self.json_data.append(data)
+        self.n_sources = n_sources
+        self.segments = build_segment_manifest(wav_root, list_path, samples=samples, overlap=overlap, max_samples=max_samples, subdir='mix_{}'.format(mix_type))
         
     def __getitem__(self, idx):
         """
@@ -97,34 +61,30 @@ class WaveDataset(WSJ0Dataset):
             sources (n_sources, T) <torch.Tensor>
             segment_IDs (n_sources,) <list<str>>
         """
-        data = self.json_data[idx]
+        _, start, samples = self.segments[idx]
+        ID = self.segments.name(idx)
+        end = start + samples
         sources = []
         
-        for key in data['sources'].keys():
-            source_data = data['sources'][key]
-            start, end = source_data['start'], source_data['end']
-            wav_path = os.path.join(self.wav_root, source_data['path'])
-            wave, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+        for source_idx in range(self.n_sources):
+            wav_path = os.path.join(self.wav_root, 's{}'.format(source_idx + 1), '{}.wav'.format(ID))
+            wave, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=samples)
             sources.append(wave)
         
         sources = torch.cat(sources, dim=0)
 
-        noise_data = data['mixture']
-        start, end = noise_data['start'], noise_data['end']
-        wav_path = os.path.join(self.wav_root, noise_data['path'])
-        noise, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+        wav_path = os.path.join(self.wav_root, 'noise', '{}.wav'.format(ID))
+        noise, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=samples)
 
-        mixture_data = data['mixture']
-        start, end = mixture_data['start'], mixture_data['end']
-        wav_path = os.path.join(self.wav_root, mixture_data['path'])
-        mixture, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+        wav_path = os.path.join(self.wav_root, 'mix_{}'.format(self.mix_type), '{}.wav'.format(ID))
+        mixture, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=samples)
         
-        segment_ID = self.json_data[idx]['ID'] + '_{}-{}'.format(start, end)
+        segment_ID = ID + '_{}-{}'.format(start, end)
         
         return mixture, sources, noise, segment_ID
         
     def __len__(self):
-        return len(self.json_data)
+        return len(self.segments)
 
 class WaveTrainDataset(WaveDataset):
     def __init__(self, wav_root, list_path, task='separate-noisy', samples=32000, overlap=None, n_sources=2):
@@ -137,64 +97,11 @@ class WaveTrainDataset(WaveDataset):
 
 class WaveEvalDataset(WaveDataset):
     def __init__(self, wav_root, list_path, task='separate-noisy', max_samples=None, n_sources=2):
-        super().__init__(wav_root, list_path, task=task, n_sources=n_sources)
-
-        wav_root = os.path.abspath(wav_root)
-        list_path = os.path.abspath(list_path)
-
-        mix_type = self.mix_type
-
-        self.json_data = []
-        
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix_{}'.format(mix_type), '{}.wav'.format(ID))
-                wave, _ = torchaudio.load(wav_path)
-                _, T_total = wave.size()
-                
-                if max_samples is None:
-                    samples = T_total
-                else:
-                    if T_total < max_samples:
-                        samples = T_total
-                    else:
-                        samples = max_samples
-                
-                data = {
-                    'sources': {},
-                    'mixture': {}
-                }
-                
-                for source_idx in range(n_sources):
-                    source_data = {
-                        'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
-                        'start': 0,
-                        'end': samples
-                    }
-                    data['sources']['s{}'.format(source_idx + 1)] = source_data
-                
-                noise_data = {
-                    'path': os.path.join('noise', '{}.wav'.format(ID)),
-                    'start': 0,
-                    'end': samples
-                }
-
-                data['noise'] = noise_data
-                
-                mixture_data = {
-                    'path': os.path.join('mix_{}'.format(mix_type), '{}.wav'.format(ID)),
-                    'start': 0,
-                    'end': samples
-                }
-                data['mixture'] = mixture_data
-                data['ID'] = ID
-            
-                self.json_data.append(data)
+        super().__init__(wav_root, list_path, task=task, samples=None, max_samples=max_samples, n_sources=n_sources)
     
     def __getitem__(self, idx):
         mixture, sources, _, _ = super().__getitem__(idx)
-        segment_ID = self.json_data[idx]['ID']
+        segment_ID = self.segments.name(idx)
 
         return mixture, sources, segment_ID
 
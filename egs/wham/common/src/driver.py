@@ -1,18 +1,19 @@
 import os
-import shutil
-import subprocess
 import time
-import uuid
 
 import torch
-import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.async_writer import AsyncCheckpointWriter, AsyncAudioWriter
+from utils.mixed_precision import get_amp_dtype, autocast, build_grad_scaler
+from utils.distributed import is_main_process, all_reduce_mean
+from utils.prefetch import wrap_prefetch_loader
+from utils.profiler import wrap_profiled_loader
 from utils.bss import bss_eval_sources
+from utils.speech_quality import DEFAULT_N_WORKERS, SpeechQualityEvaluator
 
 BITS_PER_SAMPLE_WSJ0 = 16
-MIN_PESQ = -0.5
 HALVE_LR = 3
 EARLY_STOP = 10
 
@@ -40,6 +41,9 @@ class TrainerBase:
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = AsyncCheckpointWriter()
+        self.audio_writer = AsyncAudioWriter(self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
@@ -47,6 +51,20 @@ class TrainerBase:
         
         self.use_cuda = args.use_cuda
         
+        if hasattr(args, 'amp'):
+            self.amp_dtype = get_amp_dtype(args.amp)
+        else:
+            self.amp_dtype = None
+        
+        self.device_type = 'cuda' if self.use_cuda else 'cpu'
+        self.scaler = build_grad_scaler(self.amp_dtype, device_type=self.device_type)
+        
+        # Stage next batches on background thread if `--prefetch` is given, and report data wait time every epoch.
+        self.train_loader = wrap_prefetch_loader(self.train_loader, args, use_cuda=self.use_cuda)
+        
+        # Measure time of data loading, forward, backward, etc. every epoch if `--profile` is given.
+        self.train_loader = wrap_profiled_loader(self.train_loader, self.model, self.optimizer, args, use_cuda=self.use_cuda)
+        
         if args.continue_from:
             config = torch.load(args.continue_from, map_location=lambda storage, loc: storage)
             
@@ -59,7 +77,7 @@ class TrainerBase:
             self.prev_loss = self.valid_loss[self.start_epoch-1]
             self.no_improvement = config['no_improvement']
             
-            if isinstance(self.model, nn.DataParallel):
+            if isinstance(self.model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
                 self.model.module.load_state_dict(config['state_dict'])
             else:
                 self.model.load_state_dict(config['state_dict'])
@@ -91,11 +109,12 @@ class TrainerBase:
             self.train_loss[epoch] = train_loss
             self.valid_loss[epoch] = valid_loss
             
+            model_paths = []
+            
             if valid_loss < self.best_loss:
                 self.best_loss = valid_loss
                 self.no_improvement = 0
-                model_path = os.path.join(self.model_dir, "best.pth")
-                self.save_model(epoch, model_path)
+                model_paths.append(os.path.join(self.model_dir, "best.pth"))
             else:
                 if valid_loss >= self.prev_loss:
                     self.no_improvement += 1
@@ -113,16 +132,29 @@ class TrainerBase:
             
             self.prev_loss = valid_loss
             
-            model_path = os.path.join(self.model_dir, "last.pth")
-            self.save_model(epoch, model_path)
+            # best.pth is identical to last.pth in this epoch, so it is serialized only once.
+            model_paths.append(os.path.join(self.model_dir, "last.pth"))
+            self.save_model(epoch, model_paths)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+            if is_main_process():
+                self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1].clone(), valid_loss=self.valid_loss[:epoch + 1].clone(), save_path=save_path)
+        
+        self.checkpoint_writer.close()
     
     def run_one_epoch(self, epoch):
+        sampler = getattr(self.train_loader, 'sampler', None)
+        
+        if hasattr(sampler, 'set_epoch'):
+            # DistributedSampler shuffles differently every epoch.
+            sampler.set_epoch(epoch)
+        
         train_loss = self.run_one_epoch_train(epoch)
         valid_loss = self.run_one_epoch_eval(epoch)
 
+        # Every process makes same decision on learning rate and early stopping.
+        train_loss, valid_loss = all_reduce_mean(train_loss), all_reduce_mean(valid_loss)
+
         return train_loss, valid_loss
     
     def run_one_epoch_train(self, epoch):
@@ -139,16 +171,20 @@ class TrainerBase:
                 mixture = mixture.cuda()
                 sources = sources.cuda()
             
-            estimated_sources = self.model(mixture)
-            loss, _ = self.pit_criterion(estimated_sources, sources)
+            with autocast(self.device_type, dtype=self.amp_dtype):
+                estimated_sources = self.model(mixture)
+                loss, _ = self.pit_criterion(estimated_sources, sources)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.scaler.scale(loss).backward()
             
             if self.max_norm:
+                # Clip gradients in their true scale.
+                self.scaler.unscale_(self.optimizer)
                 nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
-            self.optimizer.step()
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
             
             train_loss += loss.item()
             
@@ -173,36 +209,37 @@ class TrainerBase:
                 if self.use_cuda:
                     mixture = mixture.cuda()
                     sources = sources.cuda()
-                output = self.model(mixture)
+                with autocast(self.device_type, dtype=self.amp_dtype):
+                    output = self.model(mixture)
+                output = output.float()
                 loss, _ = self.pit_criterion(output, sources, batch_mean=False)
                 loss = loss.sum(dim=0)
                 valid_loss += loss.item()
                 
-                if idx < 5:
+                if idx < 5 and is_main_process():
                     mixture = mixture[0].squeeze(dim=0).cpu()
                     estimated_sources = output[0].cpu()
                     
                     save_dir = os.path.join(self.sample_dir, segment_IDs[0])
                     os.makedirs(save_dir, exist_ok=True)
                     save_path = os.path.join(save_dir, "mixture.wav")
-                    norm = torch.abs(mixture).max()
-                    mixture = mixture / norm
-                    signal = mixture.unsqueeze(dim=0) if mixture.dim() == 1 else mixture
-                    torchaudio.save(save_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
+                    self.audio_writer.save(save_path, mixture, normalize=True)
                     
                     for source_idx, estimated_source in enumerate(estimated_sources):
                         save_path = os.path.join(save_dir, "epoch{}-{}.wav".format(epoch + 1, source_idx + 1))
-                        norm = torch.abs(estimated_source).max()
-                        estimated_source = estimated_source / norm
-                        signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                        torchaudio.save(save_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
+                        self.audio_writer.save(save_path, estimated_source, normalize=True)
+        
+        self.audio_writer.wait()
         
         valid_loss /= n_valid
         
         return valid_loss
     
     def save_model(self, epoch, model_path='./tmp.pth'):
-        if isinstance(self.model, nn.DataParallel):
+        if not is_main_process():
+            return
+        
+        if isinstance(self.model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
             config = self.model.module.get_config()
             config['state_dict'] = self.model.module.state_dict()
         else:
@@ -219,7 +256,7 @@ class TrainerBase:
         
         config['epoch'] = epoch + 1
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class TesterBase:
     def __init__(self, model, loader, pit_criterion, args):
@@ -241,11 +278,27 @@ class TesterBase:
             self.out_dir = os.path.abspath(args.out_dir)
             os.makedirs(self.out_dir, exist_ok=True)
         
+        self.audio_writer = AsyncAudioWriter(self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
+        
+        if hasattr(args, 'n_pesq_workers'):
+            n_pesq_workers = args.n_pesq_workers
+        else:
+            n_pesq_workers = DEFAULT_N_WORKERS
+        
+        self.speech_evaluator = SpeechQualityEvaluator(self.sample_rate, num_workers=n_pesq_workers)
+        
         self.use_cuda = args.use_cuda
         
+        if hasattr(args, 'amp'):
+            self.amp_dtype = get_amp_dtype(args.amp)
+        else:
+            self.amp_dtype = None
+        
+        self.device_type = 'cuda' if self.use_cuda else 'cpu'
+        
         config = torch.load(args.model_path, map_location=lambda storage, loc: storage)
         
-        if isinstance(self.model, nn.DataParallel):
+        if isinstance(self.model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
             self.model.module.load_state_dict(config['state_dict'])
         else:
             self.model.load_state_dict(config['state_dict'])
@@ -259,15 +312,9 @@ class TesterBase:
         test_sir_improvement = 0
         test_sar = 0
         test_pesq = 0
-        n_pesq_error = 0
         n_test = len(self.loader.dataset)
 
         print("ID, Loss, Loss improvement, SDR improvement, SIR improvement, SAR, PESQ", flush=True)
-
-        tmp_dir = os.path.join(os.getcwd(), 'tmp')
-        os.makedirs(tmp_dir, exist_ok=True)
-        shutil.copy('./PESQ', os.path.join(tmp_dir, 'PESQ'))
-        os.chdir(tmp_dir)
         
         with torch.no_grad():
             for idx, (mixture, sources, segment_IDs) in enumerate(self.loader):
@@ -278,7 +325,9 @@ class TesterBase:
                 loss_mixture, _ = self.pit_criterion(mixture, sources, batch_mean=False)
                 loss_mixture = loss_mixture.sum(dim=0)
                 
-                output = self.model(mixture)
+                with autocast(self.device_type, dtype=self.amp_dtype):
+                    output = self.model(mixture)
+                output = output.float()
                 loss, perm_idx = self.pit_criterion(output, sources, batch_mean=False)
                 loss = loss.sum(dim=0)
                 loss_improvement = loss_mixture.item() - loss.item()
@@ -290,14 +339,11 @@ class TesterBase:
                 segment_IDs = segment_IDs[0] # -> <str>
 
                 repeated_mixture = torch.tile(mixture, (self.n_sources, 1))
-                result_estimated = bss_eval_sources(
-                    reference_sources=sources,
-                    estimated_sources=estimated_sources
-                )
-                result_mixed = bss_eval_sources(
+                # Estimates and mixture share reference sources, so they are evaluated in one batch.
+                result_estimated, result_mixed = zip(*bss_eval_sources(
                     reference_sources=sources,
-                    estimated_sources=repeated_mixture
-                )
+                    estimated_sources=torch.stack([estimated_sources, repeated_mixture], dim=0)
+                ))
         
                 sdr_improvement = torch.mean(result_estimated[0] - result_mixed[0])
                 sir_improvement = torch.mean(result_estimated[1] - result_mixed[1])
@@ -306,14 +352,10 @@ class TesterBase:
                 norm = torch.abs(mixture).max()
                 mixture /= norm
                 mixture_ID = segment_IDs
-                
-                # Generate random number temporary wav file.
-                random_ID = str(uuid.uuid4())
 
                 if idx < 10 and self.out_dir is not None:
                     mixture_path = os.path.join(self.out_dir, "{}.wav".format(mixture_ID))
-                    signal = mixture.unsqueeze(dim=0) if mixture.dim() == 1 else mixture
-                    torchaudio.save(mixture_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
+                    self.audio_writer.save(mixture_path, mixture)
                 
                 for order_idx in range(self.n_sources):
                     source, estimated_source = sources[order_idx], estimated_sources[perm_idx[order_idx]]
@@ -323,56 +365,39 @@ class TesterBase:
                     source /= norm
                     if idx < 10 and  self.out_dir is not None:
                         source_path = os.path.join(self.out_dir, "{}_{}-target.wav".format(mixture_ID, order_idx + 1))
-                        signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
-                        torchaudio.save(source_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    source_path = "tmp-{}-target_{}.wav".format(order_idx + 1, random_ID)
-                    signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
-                    torchaudio.save(source_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
+                        self.audio_writer.save(source_path, source)
                     
                     # Estimated source
                     norm = torch.abs(estimated_source).max()
                     estimated_source /= norm
                     if idx < 10 and  self.out_dir is not None:
                         estimated_path = os.path.join(self.out_dir, "{}_{}-estimated.wav".format(mixture_ID, order_idx + 1))
-                        signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                        torchaudio.save(estimated_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    estimated_path = "tmp-{}-estimated_{}.wav".format(order_idx + 1, random_ID)
-                    signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                    torchaudio.save(estimated_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
+                        self.audio_writer.save(estimated_path, estimated_source)
                 
-                pesq = 0
+                # PESQ is evaluated by worker processes, while next utterances are separated.
+                ordered_estimated_sources = torch.stack([estimated_sources[perm_idx[order_idx]] for order_idx in range(self.n_sources)], dim=0)
+                result = (mixture_ID, loss.item(), loss_improvement, sdr_improvement.item(), sir_improvement.item(), sar.item())
+                self.speech_evaluator.submit(sources, ordered_estimated_sources, info=result)
                 
-                for source_idx in range(self.n_sources):
-                    source_path = "tmp-{}-target_{}.wav".format(source_idx + 1, random_ID)
-                    estimated_path = "tmp-{}-estimated_{}.wav".format(source_idx + 1, random_ID)
-                    
-                    command = "./PESQ +{} {} {}".format(self.sample_rate, source_path, estimated_path)
-                    command += " | grep Prediction | awk '{print $5}'"
-                    pesq_output = subprocess.check_output(command, shell=True)
-                    pesq_output = pesq_output.decode().strip()
-                    
-                    if pesq_output == '':
-                        # If processing error occurs in PESQ software, it is regarded as PESQ score is -0.5. (minimum of PESQ)
-                        n_pesq_error += 1
-                        pesq += MIN_PESQ
-                    else:
-                        pesq += float(pesq_output)
-                    
-                    subprocess.call("rm {}".format(source_path), shell=True)
-                    subprocess.call("rm {}".format(estimated_path), shell=True)
-                
-                pesq /= self.n_sources
-                print("{}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}".format(mixture_ID, loss.item(), loss_improvement, sdr_improvement.item(), sir_improvement.item(), sar.item(), pesq), flush=True)
+                for result, pesq, _ in self.speech_evaluator.collect():
+                    print("{}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}".format(*result, pesq), flush=True)
+                    test_pesq += pesq
                 
                 test_loss += loss.item()
                 test_loss_improvement += loss_improvement
                 test_sdr_improvement += sdr_improvement.item()
                 test_sir_improvement += sir_improvement.item()
                 test_sar += sar.item()
-                test_pesq += pesq
         
-        os.chdir("../") # back to the original directory
+        self.audio_writer.close()
 
+        for result, pesq, _ in self.speech_evaluator.collect(block=True):
+            print("{}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}".format(*result, pesq), flush=True)
+            test_pesq += pesq
+        
+        n_pesq_error = self.speech_evaluator.n_pesq_error
+        self.speech_evaluator.close()
+        
         test_loss /= n_test
         test_loss_improvement /= n_test
         test_sdr_improvement /= n_test
@@ -2,6 +2,7 @@ import os
 import time
 
 from utils.utils import draw_loss_curve
+from utils.distributed import is_main_process
 from driver import TrainerBase, TesterBase
 
 HALVE_LR = 3
@@ -44,7 +45,10 @@ class AdhocTrainer(TrainerBase):
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch + 1], valid_loss=self.valid_loss[:epoch + 1], save_path=save_path)
+            if is_main_process():
+                self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1].clone(), valid_loss=self.valid_loss[:epoch + 1].clone(), save_path=save_path)
+        
+        self.checkpoint_writer.close()
 
 class Tester(TesterBase):
     def __init__(self, model, loader, pit_criterion, args):
@@ -22,6 +22,7 @@ parser.add_argument('--criterion', type=str, default='sisdr', choices=['sdr', 's
 parser.add_argument('--out_dir', type=str, default=None, help='Output directory')
 parser.add_argument('--model_path', type=str, default='./tmp/model/best.pth', help='Path for model')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--n_pesq_workers', type=int, default=4, help='Number of worker processes to evaluate PESQ. 0: Evaluate in main process. Default: 4')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+
+from utils.manifest import read_list
+from utils.shard import pack_shards
+
+parser = argparse.ArgumentParser("Pack wsj0-mix into memory-mapped int16 shards")
+
+parser.add_argument('--wav_root', type=str, default=None, help='Path for wav ROOT directory, e.g. <wsj0-mix>/2speakers/wav8k/min/tr')
+parser.add_argument('--list_path', type=str, default=None, help='Path for mix_<n_sources>_spk_<max,min>_<tr,cv,tt>_mix')
+parser.add_argument('--shard_root', type=str, default=None, help='Path for shard directory. Default: <wav_root>/shards')
+parser.add_argument('--n_sources', type=int, default=2, help='# speakers')
+parser.add_argument('--shard_size', type=float, default=1, help='Maximum size of each shard [GB]')
+
+def main(args):
+    wav_root = os.path.abspath(args.wav_root)
+
+    if args.shard_root is None:
+        shard_root = os.path.join(wav_root, 'shards')
+    else:
+        shard_root = args.shard_root
+
+    stems = ['mix'] + ['s{}'.format(source_idx + 1) for source_idx in range(args.n_sources)]
+    IDs = read_list(args.list_path)
+
+    items = (
+        (ID, {stem: os.path.join(wav_root, stem, '{}.wav'.format(ID)) for stem in stems}) for ID in IDs
+    )
+
+    index = pack_shards(items, shard_root, stems=stems, shard_bytes=int(args.shard_size * (1 << 30)))
+
+    print("Packed {} utterances into {} shards at {}.".format(len(index['IDs']), len(index['shards']), shard_root))
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    print(args)
+    main(args)
@@ -0,0 +1,26 @@
+#!/bin/bash
+
+n_sources=2
+sr_k=8
+max_or_min='min'
+wsj0mix_root="../../../dataset/wsj0-mix"
+shard_size=1
+
+. ./path.sh
+. ./parse_options.sh || exit 1
+
+for data_type in "tr" "cv" "tt" ; do
+    wav_root="${wsj0mix_root}/${n_sources}speakers/wav${sr_k}k/${max_or_min}/${data_type}"
+    list_path="${wsj0mix_root}/${n_sources}speakers/mix_${n_sources}_spk_${max_or_min}_${data_type}_mix"
+
+    if [ -e "${wav_root}/shards/index.json" ]; then
+        echo "Already packed ${wav_root}"
+        continue
+    fi
+
+    pack_shards.py \
+    --wav_root "${wav_root}" \
+    --list_path "${list_path}" \
+    --n_sources ${n_sources} \
+    --shard_size ${shard_size}
+done
@@ -0,0 +1,4 @@
+#!/bin/bash
+
+export PATH="./local:$PATH"
+export PYTHONPATH="../../../src:./src:$PYTHONPATH"
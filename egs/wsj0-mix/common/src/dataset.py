@@ -1,9 +1,17 @@
 import os
+import random
+import functools
 
+import numpy as np
 import torch
 import torchaudio
 import torch.nn as nn
+import torch.nn.functional as F
 
+from utils.manifest import SegmentIndex, build_segment_manifest, read_list
+from utils.shard import ShardReader, int16_to_float
+from utils.feature_cache import build_feature_cache, feature_collate_fn
+from utils.bucketing import LengthBucketBatchSampler, pad_collate_fn
 from algorithm.frequency_mask import compute_ideal_binary_mask, compute_ideal_ratio_mask, compute_wiener_filter_mask
 
 EPS = 1e-12
@@ -16,51 +24,22 @@ class WSJ0Dataset(torch.utils.data.Dataset):
         self.list_path = os.path.abspath(list_path)
 
 class WaveDataset(WSJ0Dataset):
-    def __init__(self, wav_root, list_path, samples=32000, overlap=None, n_sources=2):
+    def __init__(self, wav_root, list_path, samples=32000, overlap=None, max_samples=None, n_sources=2):
+        """
+        Args:
+            samples <int>: Segment length. If None, one segment per utterance is used, clipped by `max_samples`.
+            max_samples <int>: Maximum length of segment when `samples` is None.
+        """
         super().__init__(wav_root, list_path)
 
         wav_root = os.path.abspath(wav_root)
         list_path = os.path.abspath(list_path)
         
-        if overlap is None:
+        if samples is not None and overlap is None:
             overlap = samples // 2
         
-        self.json_data = []
-        
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix', '{}.wav'.format(ID))
-                
-                wave, _ = torchaudio.load(wav_path)
-                _, T_total = wave.size()
-                
-                for start_idx in range(0, T_total, samples - overlap):
-                    end_idx = start_idx + samples
-                    if end_idx > T_total:
-                        break
-                    data = {
-                        'sources': {},
-                        'mixture': {}
-                    }
-                    
-                    for source_idx in range(n_sources):
-                        source_data = {
-                            'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
-                            'start': start_idx,
-                            'end': end_idx
-                        }
-                        data['sources']['s{}'.format(source_idx + 1)] = source_data
-                    
-                    mixture_data = {
-                        'path': os.path.join('mix', '{}.wav'.format(ID)),
-                        'start': start_idx,
-                        'end': end_idx
-                    }
-                    data['mixture'] = mixture_data
-                    data['ID'] = ID
-                
-                    self.json_data.append(data)
+        self.n_sources = n_sources
+        self.segments = build_segment_manifest(wav_root, list_path, samples=samples, overlap=overlap, max_samples=max_samples, subdir='mix')
         
     def __getitem__(self, idx):
         """
@@ -69,29 +48,27 @@ class WaveDataset(WSJ0Dataset):
             sources (n_sources, T) <torch.Tensor>
             segment_IDs (n_sources,) <list<str>>
         """
-        data = self.json_data[idx]
+        _, start, samples = self.segments[idx]
+        ID = self.segments.name(idx)
+        end = start + samples
         sources = []
         
-        for key in data['sources'].keys():
-            source_data = data['sources'][key]
-            start, end = source_data['start'], source_data['end']
-            wav_path = os.path.join(self.wav_root, source_data['path'])
-            wave, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+        for source_idx in range(self.n_sources):
+            wav_path = os.path.join(self.wav_root, 's{}'.format(source_idx + 1), '{}.wav'.format(ID))
+            wave, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=samples)
             sources.append(wave)
         
         sources = torch.cat(sources, dim=0)
         
-        mixture_data = data['mixture']
-        start, end = mixture_data['start'], mixture_data['end']
-        wav_path = os.path.join(self.wav_root, mixture_data['path'])
-        mixture, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+        wav_path = os.path.join(self.wav_root, 'mix', '{}.wav'.format(ID))
+        mixture, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=samples)
             
-        segment_ID = self.json_data[idx]['ID'] + '_{}-{}'.format(start, end)
+        segment_ID = ID + '_{}-{}'.format(start, end)
         
         return mixture, sources, segment_ID
         
     def __len__(self):
-        return len(self.json_data)
+        return len(self.segments)
 
 class WaveTrainDataset(WaveDataset):
     def __init__(self, wav_root, list_path, samples=32000, overlap=None, n_sources=2):
@@ -104,56 +81,11 @@ class WaveTrainDataset(WaveDataset):
 
 class WaveEvalDataset(WaveDataset):
     def __init__(self, wav_root, list_path, max_samples=None, n_sources=2):
-        super().__init__(wav_root, list_path, n_sources=n_sources)
-
-        wav_root = os.path.abspath(wav_root)
-        list_path = os.path.abspath(list_path)
-
-        self.json_data = []
-        
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix', '{}.wav'.format(ID))
-
-                wave, _ = torchaudio.load(wav_path)
-                
-                _, T_total = wave.size()
-                
-                if max_samples is None:
-                    samples = T_total
-                else:
-                    if T_total < max_samples:
-                        samples = T_total
-                    else:
-                        samples = max_samples
-                
-                data = {
-                    'sources': {},
-                    'mixture': {}
-                }
-                
-                for source_idx in range(n_sources):
-                    source_data = {
-                        'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
-                        'start': 0,
-                        'end': samples
-                    }
-                    data['sources']['s{}'.format(source_idx + 1)] = source_data
-                
-                mixture_data = {
-                    'path': os.path.join('mix', '{}.wav'.format(ID)),
-                    'start': 0,
-                    'end': samples
-                }
-                data['mixture'] = mixture_data
-                data['ID'] = ID
-            
-                self.json_data.append(data)
+        super().__init__(wav_root, list_path, samples=None, max_samples=max_samples, n_sources=n_sources)
     
     def __getitem__(self, idx):
         mixture, sources, _ = super().__getitem__(idx)
-        segment_ID = self.json_data[idx]['ID']
+        segment_ID = self.segments.name(idx)
     
         return mixture, sources, segment_ID
 
@@ -173,8 +105,8 @@ class WaveTestDataset(WaveEvalDataset):
         return mixture, sources, segment_ID
 
 class SpectrogramDataset(WaveDataset):
-    def __init__(self, wav_root, list_path, fft_size, hop_size=None, window_fn='hann', normalize=False, samples=32000, overlap=None, n_sources=2):
-        super().__init__(wav_root, list_path, samples=samples, overlap=overlap, n_sources=n_sources)
+    def __init__(self, wav_root, list_path, fft_size, hop_size=None, window_fn='hann', normalize=False, samples=32000, overlap=None, max_samples=None, n_sources=2):
+        super().__init__(wav_root, list_path, samples=samples, overlap=overlap, max_samples=max_samples, n_sources=n_sources)
         
         if hop_size is None:
             hop_size = fft_size // 2
@@ -192,6 +124,7 @@ class SpectrogramDataset(WaveDataset):
         else:
             self.window = None
         
+        self.window_fn = window_fn
         self.normalize = normalize
         
     def __getitem__(self, idx):
@@ -223,8 +156,8 @@ class SpectrogramDataset(WaveDataset):
         return mixture, sources, T, segment_IDs
 
 class IdealMaskSpectrogramDataset(SpectrogramDataset):
-    def __init__(self, wav_root, list_path, fft_size, hop_size=None, window_fn='hann', normalize=False, mask_type='ibm', threshold=40, samples=32000, overlap=None, n_sources=2, eps=EPS):
-        super().__init__(wav_root, list_path, fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize, samples=samples, overlap=overlap, n_sources=n_sources)
+    def __init__(self, wav_root, list_path, fft_size, hop_size=None, window_fn='hann', normalize=False, mask_type='ibm', threshold=40, samples=32000, overlap=None, max_samples=None, n_sources=2, eps=EPS):
+        super().__init__(wav_root, list_path, fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize, samples=samples, overlap=overlap, max_samples=max_samples, n_sources=n_sources)
         
         if mask_type == 'ibm':
             self.generate_mask = compute_ideal_binary_mask
@@ -235,8 +168,11 @@ class IdealMaskSpectrogramDataset(SpectrogramDataset):
         else:
             raise NotImplementedError("Not support mask {}".format(mask_type))
         
+        self.mask_type = mask_type
         self.threshold = threshold
         self.eps = eps
+
+        self.feature_cache = None
     
     def __getitem__(self, idx):
         """
@@ -248,21 +184,52 @@ class IdealMaskSpectrogramDataset(SpectrogramDataset):
             T (), <int>: Number of samples in time-domain
             segment_IDs (n_sources,) <list<str>>
         """
-        threshold = self.threshold
-        eps = self.eps
-        
         mixture, sources, T, segment_IDs = super().__getitem__(idx) # (1, n_bins, n_frames), (n_sources, n_bins, n_frames)
-        sources_amplitude = torch.abs(sources)
-        ideal_mask = self.generate_mask(sources_amplitude)
-        
-        mixture_amplitude = torch.abs(mixture)
-        log_amplitude = 20 * torch.log10(mixture_amplitude + eps)
-        max_log_amplitude = torch.max(log_amplitude)
-        threshold = 10**((max_log_amplitude - threshold) / 20)
-        threshold_weight = torch.where(mixture_amplitude > threshold, torch.ones_like(mixture_amplitude), torch.zeros_like(mixture_amplitude))
+
+        if self.feature_cache is None:
+            ideal_mask = self.generate_mask(torch.abs(sources))
+            threshold_weight = compute_threshold_weight(mixture, threshold=self.threshold, eps=self.eps)
+        else:
+            features = self.feature_cache[idx]
+            ideal_mask, threshold_weight = features['ideal_mask'], features['threshold_weight']
         
         return mixture, sources, ideal_mask, threshold_weight, T, segment_IDs
 
+    def compute_features(self, idx):
+        """
+        Returns:
+            features <dict<str, torch.Tensor>>: Ideal mask and threshold weight of `idx`-th example
+        """
+        mixture, sources, _, _ = super().__getitem__(idx)
+        ideal_mask = self.generate_mask(torch.abs(sources))
+        threshold_weight = compute_threshold_weight(mixture, threshold=self.threshold, eps=self.eps)
+
+        return {'ideal_mask': ideal_mask, 'threshold_weight': threshold_weight}
+
+    def build_feature_cache(self, cache_root, num_workers=0):
+        """
+        Precompute ideal masks and threshold weights, and read them from `cache_root` afterwards.
+        Masks are stored as float16, so IRM and WFM are rounded to about 3 significant digits.
+        Args:
+            cache_root <str>: Root directory of feature caches
+            num_workers <int>: Number of processes to compute features
+        """
+        config = {
+            'wav_root': self.wav_root,
+            'segments': self.segments.fingerprint(),
+            'n_sources': self.n_sources,
+            'fft_size': self.fft_size, 'hop_size': self.hop_size,
+            'window_fn': self.window_fn, 'normalize': self.normalize,
+            'mask_type': self.mask_type, 'threshold': self.threshold, 'eps': self.eps
+        }
+        paths = [self.list_path]
+
+        for ID in self.segments.names:
+            for subdir in ['mix'] + ['s{}'.format(source_idx + 1) for source_idx in range(self.n_sources)]:
+                paths.append(os.path.join(self.wav_root, subdir, '{}.wav'.format(ID)))
+
+        self.feature_cache = build_feature_cache(self, cache_root, config, paths=paths, num_workers=num_workers)
+
 class IdealMaskSpectrogramTrainDataset(IdealMaskSpectrogramDataset):
     def __init__(self, wav_root, list_path, fft_size, hop_size=None, window_fn='hann', normalize=False, mask_type='ibm', threshold=40, samples=32000, overlap=None, n_sources=2, eps=EPS):
         super().__init__(wav_root, list_path, fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize, mask_type=mask_type, threshold=threshold, samples=samples, overlap=overlap, n_sources=n_sources, eps=eps)
@@ -281,52 +248,7 @@ class IdealMaskSpectrogramTrainDataset(IdealMaskSpectrogramDataset):
 
 class IdealMaskSpectrogramEvalDataset(IdealMaskSpectrogramDataset):
     def __init__(self, wav_root, list_path, fft_size, hop_size=None, window_fn='hann', normalize=False, mask_type='ibm', threshold=40, max_samples=None, n_sources=2, eps=EPS):
-        super().__init__(wav_root, list_path, fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize, mask_type=mask_type, threshold=threshold, n_sources=n_sources, eps=eps)
-
-        wav_root = os.path.abspath(wav_root)
-        list_path = os.path.abspath(list_path)
-
-        self.json_data = []
-        
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix', '{}.wav'.format(ID))
-                
-                wave, _ = torchaudio.load(wav_path)
-                
-                _, T_total = wave.size()
-                
-                if max_samples is None:
-                    samples = T_total
-                else:
-                    if T_total < max_samples:
-                        samples = T_total
-                    else:
-                        samples = max_samples
-                
-                data = {
-                    'sources': {},
-                    'mixture': {}
-                }
-                
-                for source_idx in range(n_sources):
-                    source_data = {
-                        'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
-                        'start': 0,
-                        'end': samples
-                    }
-                    data['sources']['s{}'.format(source_idx+1)] = source_data
-                
-                mixture_data = {
-                    'path': os.path.join('mix', '{}.wav'.format(ID)),
-                    'start': 0,
-                    'end': samples
-                }
-                data['mixture'] = mixture_data
-                data['ID'] = ID
-            
-                self.json_data.append(data)
+        super().__init__(wav_root, list_path, fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize, mask_type=mask_type, threshold=threshold, samples=None, max_samples=max_samples, n_sources=n_sources, eps=eps)
 
     def __getitem__(self, idx):
         """
@@ -358,6 +280,211 @@ class IdealMaskSpectrogramTestDataset(IdealMaskSpectrogramDataset):
 
         return mixture, sources, ideal_mask, threshold_weight, T, segment_IDs
 
+def compute_threshold_weight(mixture, threshold=40, eps=EPS):
+    """
+    Args:
+        mixture (1, n_bins, n_frames) <torch.Tensor>: Complex spectrogram
+        threshold <float>: Threshold in dB below maximum amplitude
+    Returns:
+        threshold_weight (1, n_bins, n_frames) <torch.Tensor>: 1 for time-frequency bins louder than threshold, 0 otherwise.
+    """
+    mixture_amplitude = torch.abs(mixture)
+    log_amplitude = 20 * torch.log10(mixture_amplitude + eps)
+    max_log_amplitude = torch.max(log_amplitude)
+    threshold = 10**((max_log_amplitude - threshold) / 20)
+    threshold_weight = torch.where(mixture_amplitude > threshold, torch.ones_like(mixture_amplitude), torch.zeros_like(mixture_amplitude))
+
+    return threshold_weight
+
+"""
+    Dataset backed by packed shards.
+    See `utils.shard` and `common/local/pack_shards.py`.
+"""
+
+class MmapWaveDataset(WSJ0Dataset):
+    def __init__(self, wav_root, list_path, samples=32000, overlap=None, max_samples=None, n_sources=2, shard_root=None):
+        """
+        Args:
+            samples <int>: Segment length. If None, one segment per utterance is used, clipped by `max_samples`.
+            max_samples <int>: Maximum length of segment when `samples` is None.
+            shard_root <str>: Directory of packed shards. Default: `<wav_root>/shards`
+        """
+        super().__init__(wav_root, list_path)
+
+        if shard_root is None:
+            shard_root = os.path.join(self.wav_root, 'shards')
+        
+        if samples is not None and overlap is None:
+            overlap = samples // 2
+
+        self.reader = ShardReader(shard_root)
+        self.n_sources = n_sources
+
+        expected_stems = ['mix'] + ['s{}'.format(source_idx + 1) for source_idx in range(n_sources)]
+        assert self.reader.stems[:n_sources + 1] == expected_stems, "Stems of shards are expected to start with {}, but given {}.".format(expected_stems, self.reader.stems)
+
+        IDs = read_list(self.list_path)
+        lengths = [self.reader.num_samples(ID) for ID in IDs]
+        self.segments = SegmentIndex.from_lengths(IDs, lengths, samples=samples, overlap=overlap, max_samples=max_samples)
+
+    def __getitem__(self, idx):
+        """
+        Returns:
+            mixture (1, T) <torch.Tensor>
+            sources (n_sources, T) <torch.Tensor>
+            segment_ID <str>
+        """
+        _, start, samples = self.segments[idx]
+        ID = self.segments.name(idx)
+        end = start + samples
+
+        wave = self.reader.read(ID, start=start, end=end) # (1 + n_sources, n_channels, T)
+        mixture = int16_to_float(wave[0])
+        sources = int16_to_float(wave[1: self.n_sources + 1])
+        sources = sources.reshape(-1, sources.size(-1))
+
+        segment_ID = ID + '_{}-{}'.format(start, end)
+
+        return mixture, sources, segment_ID
+
+    def __len__(self):
+        return len(self.segments)
+
+class MmapWaveTrainDataset(MmapWaveDataset):
+    def __init__(self, wav_root, list_path, samples=32000, overlap=None, n_sources=2, shard_root=None):
+        super().__init__(wav_root, list_path, samples=samples, overlap=overlap, n_sources=n_sources, shard_root=shard_root)
+    
+    def __getitem__(self, idx):
+        mixture, sources, _ = super().__getitem__(idx)
+        
+        return mixture, sources
+
+class MmapWaveEvalDataset(MmapWaveDataset):
+    def __init__(self, wav_root, list_path, max_samples=None, n_sources=2, shard_root=None):
+        super().__init__(wav_root, list_path, samples=None, max_samples=max_samples, n_sources=n_sources, shard_root=shard_root)
+
+    def __getitem__(self, idx):
+        mixture, sources, _ = super().__getitem__(idx)
+        segment_ID = self.segments.name(idx)
+    
+        return mixture, sources, segment_ID
+
+class MmapWaveTestDataset(MmapWaveEvalDataset):
+    def __init__(self, wav_root, list_path, max_samples=None, n_sources=2, shard_root=None):
+        super().__init__(wav_root, list_path, max_samples=max_samples, n_sources=n_sources, shard_root=shard_root)
+
+"""
+    Dataset with dynamic mixing.
+"""
+
+class DynamicMixingWaveTrainDataset(WSJ0Dataset):
+    """
+    Training dataset which mixes single-speaker utterances on the fly instead of reading pre-rendered mixtures.
+    Utterances are collected from `s1`, `s2`, ... of mixtures in `list_path`, and the speaker of utterance is given by the first 3 characters of its name as in WSJ0.
+    """
+    def __init__(self, wav_root, list_path, samples=32000, n_sources=2, max_snr=5, samples_per_epoch=None, eps=EPS):
+        """
+        Args:
+            wav_root <str>: Root directory of wsj0-mix
+            list_path <str>: List of mixture IDs, e.g. `<utterance>_<snr>_<utterance>_<snr>`
+            samples <int>: Number of samples of each example
+            n_sources <int>: Number of speakers in each example. It can be larger than that of mixtures in `list_path`.
+            max_snr <float>: Level of each source is drawn from [-max_snr/2, max_snr/2] dB.
+            samples_per_epoch <int>: Number of examples in one epoch. If None, total length of utterances divided by `samples * n_sources` is used.
+        """
+        super().__init__(wav_root, list_path)
+
+        IDs = read_list(self.list_path)
+        n_utterances = len(IDs[0].split('_')) // 2
+
+        paths, lengths, speaker_utterances = [], [], {}
+        names = set()
+
+        for source_idx in range(n_utterances):
+            subdir = 's{}'.format(source_idx + 1)
+            segments = build_segment_manifest(self.wav_root, self.list_path, subdir=subdir)
+
+            for idx in range(len(segments)):
+                ID = segments.name(idx)
+                name = ID.split('_')[2 * source_idx]
+
+                if name in names:
+                    continue
+                
+                names.add(name)
+                speaker = name[:3]
+
+                if speaker not in speaker_utterances:
+                    speaker_utterances[speaker] = []
+                
+                speaker_utterances[speaker].append(len(paths))
+                paths.append(os.path.join(subdir, '{}.wav'.format(ID)))
+                lengths.append(segments[idx][2])
+        
+        assert len(speaker_utterances) >= n_sources, "{} speakers are required, but only {} speakers are found.".format(n_sources, len(speaker_utterances))
+
+        self.paths = np.array(paths, dtype=np.str_)
+        self.lengths = np.array(lengths, dtype=np.int64)
+        self.speakers = sorted(speaker_utterances.keys())
+        self.speaker_utterances = [np.array(speaker_utterances[speaker], dtype=np.int32) for speaker in self.speakers]
+
+        self.samples = samples
+        self.n_sources = n_sources
+        self.max_snr = max_snr
+        self.eps = eps
+
+        if samples_per_epoch is None:
+            samples_per_epoch = max(int(self.lengths.sum()) // (samples * n_sources), 1)
+        
+        self.samples_per_epoch = samples_per_epoch
+
+    def __getitem__(self, idx):
+        """
+        Args:
+            idx <int>: Ignored, because every example is drawn randomly.
+        Returns:
+            mixture (1, T) <torch.Tensor>
+            sources (n_sources, T) <torch.Tensor>
+        """
+        samples = self.samples
+        speaker_indices = random.sample(range(len(self.speakers)), self.n_sources)
+
+        sources, n_active = [], []
+
+        for speaker_idx in speaker_indices:
+            utterance_idx = random.choice(self.speaker_utterances[speaker_idx])
+            wav_path = os.path.join(self.wav_root, str(self.paths[utterance_idx]))
+            length = int(self.lengths[utterance_idx])
+
+            if length > samples:
+                start = random.randint(0, length - samples)
+                wave, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=samples)
+            else:
+                wave, _ = torchaudio.load(wav_path)
+                offset = random.randint(0, samples - length)
+                wave = F.pad(wave, (offset, samples - length - offset))
+            
+            sources.append(wave)
+            n_active.append(min(length, samples))
+        
+        sources = torch.cat(sources, dim=0) # (n_sources, T)
+        n_active = torch.tensor(n_active, dtype=sources.dtype).unsqueeze(dim=-1)
+
+        power = torch.sum(sources**2, dim=-1, keepdim=True) / n_active
+        level = self.max_snr * (torch.rand(self.n_sources, 1) - 0.5)
+        sources = 10**(level / 20) * sources / torch.sqrt(power + self.eps)
+        mixture = torch.sum(sources, dim=0, keepdim=True)
+
+        # Avoid clipping as in wsj0-mix
+        max_amplitude = torch.max(torch.abs(torch.cat([mixture, sources], dim=0)))
+        scale = 0.9 / (max_amplitude + self.eps)
+        mixture, sources = scale * mixture, scale * sources
+
+        return mixture, sources
+
+    def __len__(self):
+        return self.samples_per_epoch
+
 """
     Data loader
 """
@@ -366,12 +493,19 @@ class TrainDataLoader(torch.utils.data.DataLoader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        if getattr(self.dataset, 'feature_cache', None) is not None:
+            # Cached features are float16 views of memory maps, and cast to float after batching.
+            self.collate_fn = functools.partial(feature_collate_fn, collate_fn=self.collate_fn)
+
 class EvalDataLoader(torch.utils.data.DataLoader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
         assert self.batch_size == 1, "batch_size is expected 1, but given {}".format(self.batch_size)
 
+        if getattr(self.dataset, 'feature_cache', None) is not None:
+            self.collate_fn = functools.partial(feature_collate_fn, collate_fn=self.collate_fn)
+
 class TestDataLoader(torch.utils.data.DataLoader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -399,6 +533,21 @@ def test_collate_fn(batch):
     
     return batched_mixture, batched_sources, batched_segment_ID
 
+class BucketEvalDataLoader(torch.utils.data.DataLoader):
+    """
+    Data loader for evaluation, which batches utterances of similar length.
+    Yields (mixture, sources, segment_IDs, lengths), where mixture and sources are zero-padded to the longest utterance in batch.
+    With `max_padding=0`, only utterances of same length are batched, so no padding is introduced.
+    """
+    def __init__(self, dataset, batch_size=1, max_padding=0, max_samples=None, **kwargs):
+        batch_sampler = LengthBucketBatchSampler(dataset.segments.length, batch_size=batch_size, max_padding=max_padding, max_samples=max_samples)
+
+        super().__init__(dataset, batch_sampler=batch_sampler, collate_fn=pad_collate_fn, **kwargs)
+
+class BucketTestDataLoader(BucketEvalDataLoader):
+    def __init__(self, dataset, batch_size=1, max_padding=0, max_samples=None, **kwargs):
+        super().__init__(dataset, batch_size=batch_size, max_padding=max_padding, max_samples=max_samples, **kwargs)
+
 class AttractorTestDataLoader(torch.utils.data.DataLoader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -438,59 +587,22 @@ Dataset for unknown number of sources.
 """
 
 class MixedNumberSourcesWaveDataset(WSJ0Dataset):
-    def __init__(self, wav_root, list_path, samples=32000, overlap=None, max_n_sources=3):
+    def __init__(self, wav_root, list_path, samples=32000, overlap=None, max_samples=None, max_n_sources=3):
+        """
+        Args:
+            samples <int>: Segment length. If None, one segment per utterance is used, clipped by `max_samples`.
+            max_samples <int>: Maximum length of segment when `samples` is None.
+        """
         super().__init__(wav_root, list_path)
 
         wav_root = os.path.abspath(wav_root)
         list_path = os.path.abspath(list_path)
         
-        if overlap is None:
+        if samples is not None and overlap is None:
             overlap = samples//2
         
-        self.json_data = []
-        
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix', '{}.wav'.format(ID))
-                
-                wave, _ = torchaudio.load(wav_path)
-                _, T_total = wave.size()
-
-                n_sources = 0
-
-                for source_idx in range(max_n_sources):
-                    wav_path = os.path.join(wav_root, 's{}'.format(source_idx+1), '{}.wav'.format(ID))
-                    if not os.path.exists(wav_path):
-                        break
-                    n_sources += 1
-                
-                for start_idx in range(0, T_total, samples - overlap):
-                    end_idx = start_idx + samples
-                    if end_idx > T_total:
-                        break
-                    data = {
-                        'sources': {},
-                        'mixture': {}
-                    }
-                    
-                    for source_idx in range(n_sources):
-                        source_data = {
-                            'path': os.path.join('s{}'.format(source_idx+1), '{}.wav'.format(ID)),
-                            'start': start_idx,
-                            'end': end_idx
-                        }
-                        data['sources']['s{}'.format(source_idx+1)] = source_data
-                    
-                    mixture_data = {
-                        'path': os.path.join('mix', '{}.wav'.format(ID)),
-                        'start': start_idx,
-                        'end': end_idx
-                    }
-                    data['mixture'] = mixture_data
-                    data['ID'] = ID
-                
-                    self.json_data.append(data)
+        self.segments = build_segment_manifest(wav_root, list_path, samples=samples, overlap=overlap, max_samples=max_samples, subdir='mix')
+        self.n_sources = count_n_sources(wav_root, self.segments.names, max_n_sources=max_n_sources)
         
     def __getitem__(self, idx):
         """
@@ -499,29 +611,27 @@ class MixedNumberSourcesWaveDataset(WSJ0Dataset):
             sources (n_sources, T) <torch.Tensor>
             segment_IDs (n_sources,) <list<str>>
         """
-        data = self.json_data[idx]
+        trackID, start, samples = self.segments[idx]
+        ID = self.segments.name(idx)
+        end = start + samples
         sources = []
         
-        for key in data['sources'].keys():
-            source_data = data['sources'][key]
-            start, end = source_data['start'], source_data['end']
-            wav_path = os.path.join(self.wav_root, source_data['path'])
-            wave, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+        for source_idx in range(self.n_sources[trackID]):
+            wav_path = os.path.join(self.wav_root, 's{}'.format(source_idx+1), '{}.wav'.format(ID))
+            wave, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=samples)
             sources.append(wave)
         
         sources = torch.cat(sources, dim=0)
         
-        mixture_data = data['mixture']
-        start, end = mixture_data['start'], mixture_data['end']
-        wav_path = os.path.join(self.wav_root, mixture_data['path'])
-        mixture, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+        wav_path = os.path.join(self.wav_root, 'mix', '{}.wav'.format(ID))
+        mixture, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=samples)
             
-        segment_ID = self.json_data[idx]['ID'] + '_{}-{}'.format(start, end)
+        segment_ID = ID + '_{}-{}'.format(start, end)
         
         return mixture, sources, segment_ID
         
     def __len__(self):
-        return len(self.json_data)
+        return len(self.segments)
 
 class MixedNumberSourcesWaveTrainDataset(MixedNumberSourcesWaveDataset):
     def __init__(self, wav_root, list_path, samples=32000, overlap=None, max_n_sources=2):
@@ -534,66 +644,34 @@ class MixedNumberSourcesWaveTrainDataset(MixedNumberSourcesWaveDataset):
 
 class MixedNumberSourcesWaveEvalDataset(MixedNumberSourcesWaveDataset):
     def __init__(self, wav_root, list_path, max_samples=None, max_n_sources=3):
-        super().__init__(wav_root, list_path, max_n_sources=max_n_sources)
-
-        wav_root = os.path.abspath(wav_root)
-        list_path = os.path.abspath(list_path)
-
-        self.json_data = []
-        
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix', '{}.wav'.format(ID))
-                
-                wave, _ = torchaudio.load(wav_path)
-                _, T_total = wave.size()
-                
-                if max_samples is None:
-                    samples = T_total
-                else:
-                    if T_total < max_samples:
-                        samples = T_total
-                    else:
-                        samples = max_samples
-                
-                n_sources = 0
-
-                for source_idx in range(max_n_sources):
-                    wav_path = os.path.join(wav_root, 's{}'.format(source_idx+1), '{}.wav'.format(ID))
-                    if not os.path.exists(wav_path):
-                        break
-                    n_sources += 1
-                
-                data = {
-                    'sources': {},
-                    'mixture': {}
-                }
-                
-                for source_idx in range(n_sources):
-                    source_data = {
-                        'path': os.path.join('s{}'.format(source_idx+1), '{}.wav'.format(ID)),
-                        'start': 0,
-                        'end': samples
-                    }
-                    data['sources']['s{}'.format(source_idx+1)] = source_data
-                
-                mixture_data = {
-                    'path': os.path.join('mix', '{}.wav'.format(ID)),
-                    'start': 0,
-                    'end': samples
-                }
-                data['mixture'] = mixture_data
-                data['ID'] = ID
-            
-                self.json_data.append(data)
+        super().__init__(wav_root, list_path, samples=None, max_samples=max_samples, max_n_sources=max_n_sources)
     
     def __getitem__(self, idx):
         mixture, sources, _ = super().__getitem__(idx)
-        segment_ID = self.json_data[idx]['ID']
+        segment_ID = self.segments.name(idx)
     
         return mixture, sources, segment_ID
 
+def count_n_sources(wav_root, IDs, max_n_sources=3):
+    """
+    Args:
+        wav_root <str>: Root directory of dataset
+        IDs <list<str>>: Utterance IDs
+        max_n_sources <int>: Maximum number of sources
+    Returns:
+        n_sources <numpy.ndarray>: Number of existing `s*/<ID>.wav` per utterance with shape (len(IDs),)
+    """
+    n_sources = np.zeros(len(IDs), dtype=np.int32)
+
+    for trackID, ID in enumerate(IDs):
+        for source_idx in range(max_n_sources):
+            wav_path = os.path.join(wav_root, 's{}'.format(source_idx+1), '{}.wav'.format(ID))
+            if not os.path.exists(wav_path):
+                break
+            n_sources[trackID] += 1
+    
+    return n_sources
+
 class MixedNumberSourcesTrainDataLoader(TrainDataLoader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
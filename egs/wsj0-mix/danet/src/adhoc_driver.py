@@ -1,8 +1,5 @@
 import os
-import shutil
-import subprocess
 import time
-import uuid
 
 import torch
 import torchaudio
@@ -14,7 +11,6 @@ from driver import TrainerBase, TesterBase
 from criterion.pit import pit
 
 BITS_PER_SAMPLE_WSJ0 = 16
-MIN_PESQ = -0.5
 
 class AdhocTrainer(TrainerBase):
     def __init__(self, model, loader, criterion, optimizer, args):
@@ -90,7 +86,9 @@ class AdhocTrainer(TrainerBase):
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch + 1], valid_loss=self.valid_loss[:epoch + 1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1].clone(), valid_loss=self.valid_loss[:epoch + 1].clone(), save_path=save_path)
+        
+        self.checkpoint_writer.close()
     
     def run_one_epoch_train(self, epoch):
         # Override
@@ -237,15 +235,9 @@ class AdhocTester(TesterBase):
         test_sir_improvement = 0
         test_sar = 0
         test_pesq = 0
-        n_pesq_error = 0
         n_test = len(self.loader.dataset)
 
         print("ID, Loss, SDR improvement, SIR improvement, SAR, PESQ", flush=True)
-
-        tmp_dir = os.path.join(os.getcwd(), 'tmp')
-        os.makedirs(tmp_dir, exist_ok=True)
-        shutil.copy('./PESQ', os.path.join(tmp_dir, 'PESQ'))
-        os.chdir(tmp_dir)
         
         with torch.no_grad():
             for idx, (mixture, sources, ideal_mask, threshold_weight, T, segment_IDs) in enumerate(self.loader):
@@ -285,14 +277,11 @@ class AdhocTester(TesterBase):
                 estimated_sources = torch.istft(estimated_sources, n_fft=self.fft_size, hop_length=self.hop_size, normalized=self.normalize, window=self.window, length=T) # -> (n_sources, T)
                 
                 repeated_mixture = torch.tile(mixture, (self.n_sources, 1))
-                result_estimated = bss_eval_sources(
+                # Estimates and mixture share reference sources, so they are evaluated in one batch.
+                result_estimated, result_mixed = zip(*bss_eval_sources(
                     reference_sources=sources,
-                    estimated_sources=estimated_sources
-                )
-                result_mixed = bss_eval_sources(
-                    reference_sources=sources,
-                    estimated_sources=repeated_mixture
-                )
+                    estimated_sources=torch.stack([estimated_sources, repeated_mixture], dim=0)
+                ))
 
                 sdr_improvement = torch.mean(result_estimated[0] - result_mixed[0])
                 sir_improvement = torch.mean(result_estimated[1] - result_mixed[1])
@@ -301,9 +290,6 @@ class AdhocTester(TesterBase):
                 norm = torch.abs(mixture).max()
                 mixture /= norm
                 mixture_ID = segment_IDs
-
-                # Generate random number temporary wav file.
-                random_ID = str(uuid.uuid4())
                     
                 if idx < 10 and self.out_dir is not None:
                     mixture_path = os.path.join(self.out_dir, "{}.wav".format(mixture_ID))
@@ -320,9 +306,6 @@ class AdhocTester(TesterBase):
                         source_path = os.path.join(self.out_dir, "{}_{}-target.wav".format(mixture_ID, order_idx + 1))
                         signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
                         torchaudio.save(source_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    source_path = "tmp-{}-target_{}.wav".format(order_idx + 1, random_ID)
-                    signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
-                    torchaudio.save(source_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
                     
                     # Estimated source
                     norm = torch.abs(estimated_source).max()
@@ -331,39 +314,27 @@ class AdhocTester(TesterBase):
                         estimated_path = os.path.join(self.out_dir, "{}_{}-estimated.wav".format(mixture_ID, order_idx + 1))
                         signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
                         torchaudio.save(estimated_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    estimated_path = "tmp-{}-estimated_{}.wav".format(order_idx + 1, random_ID)
-                    signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                    torchaudio.save(estimated_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
 
-                pesq = 0
-                    
-                for source_idx in range(self.n_sources):
-                    source_path = "tmp-{}-target_{}.wav".format(source_idx + 1, random_ID)
-                    estimated_path = "tmp-{}-estimated_{}.wav".format(source_idx + 1, random_ID)
-                    
-                    command = "./PESQ +{} {} {}".format(self.sample_rate, source_path, estimated_path)
-                    command += " | grep Prediction | awk '{print $5}'"
-                    pesq_output = subprocess.check_output(command, shell=True)
-                    pesq_output = pesq_output.decode().strip()
-                    
-                    if pesq_output == '':
-                        # If processing error occurs in PESQ software, it is regarded as PESQ score is -0.5. (minimum of PESQ)
-                        n_pesq_error += 1
-                        pesq += MIN_PESQ
-                    else:
-                        pesq += float(pesq_output)
-                    
-                    subprocess.call("rm {}".format(source_path), shell=True)
-                    subprocess.call("rm {}".format(estimated_path), shell=True)
-
-                pesq /= self.n_sources
-                print("{}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}".format(mixture_ID, loss.item(), sdr_improvement.item(), sir_improvement.item(), sar.item(), pesq), flush=True)
+                # PESQ is evaluated by worker processes, while next utterances are separated.
+                ordered_estimated_sources = torch.stack([estimated_sources[perm_idx[order_idx]] for order_idx in range(self.n_sources)], dim=0)
+                result = (mixture_ID, loss.item(), sdr_improvement.item(), sir_improvement.item(), sar.item())
+                self.speech_evaluator.submit(sources, ordered_estimated_sources, info=result)
+                
+                for result, pesq, _ in self.speech_evaluator.collect():
+                    print("{}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}".format(*result, pesq), flush=True)
+                    test_pesq += pesq
                 
                 test_loss += loss.item()
                 test_sdr_improvement += sdr_improvement.item()
                 test_sir_improvement += sir_improvement.item()
                 test_sar += sar.item()
-                test_pesq += pesq
+        
+        for result, pesq, _ in self.speech_evaluator.collect(block=True):
+            print("{}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}".format(*result, pesq), flush=True)
+            test_pesq += pesq
+        
+        n_pesq_error = self.speech_evaluator.n_pesq_error
+        self.speech_evaluator.close()
         
         test_loss /= n_test
         test_sdr_improvement /= n_test
@@ -371,7 +342,5 @@ class AdhocTester(TesterBase):
         test_sar /= n_test
         test_pesq /= n_test
 
-        os.chdir("../") # back to the original directory
-
         print("Loss: {:.3f}, SDR improvement: {:3f}, SIR improvement: {:3f}, SAR: {:3f}, PESQ: {:.3f}".format(test_loss, test_sdr_improvement, test_sir_improvement, test_sar, test_pesq))
         print("Evaluation of PESQ returns error {} times".format(n_pesq_error))
\ No newline at end of file
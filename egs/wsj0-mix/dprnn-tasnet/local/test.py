@@ -6,7 +6,7 @@ import torch
 import torch.nn as nn
 
 from utils.utils import set_seed
-from dataset import WaveTestDataset, TestDataLoader
+from dataset import WaveTestDataset, TestDataLoader, BucketTestDataLoader
 from adhoc_driver import Tester
 from models.dprnn_tasnet import DPRNNTasNet
 from criterion.sdr import NegSISDR
@@ -19,9 +19,13 @@ parser.add_argument('--test_list_path', type=str, default=None, help='Path for m
 parser.add_argument('--sample_rate', '-sr', type=int, default=8000, help='Sampling rate')
 parser.add_argument('--n_sources', type=int, default=None, help='# speakers')
 parser.add_argument('--criterion', type=str, default='sisdr', choices=['sisdr'], help='Criterion')
+parser.add_argument('--batch_size', type=int, default=1, help='Batch size. If larger than 1, utterances of similar length are batched together.')
+parser.add_argument('--max_padding', type=int, default=0, help='Maximum difference of lengths in batch [samples]. 0: Only utterances of same length are batched.')
 parser.add_argument('--out_dir', type=str, default=None, help='Output directory')
 parser.add_argument('--model_path', type=str, default='./tmp/model/best.pth', help='Path for model')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--amp', type=str, default='none', choices=['none', 'fp16', 'bf16'], help='Mixed precision with autocast. SDR, STFT and Wiener filter are computed in float32. Default: none')
+parser.add_argument('--n_pesq_workers', type=int, default=4, help='Number of worker processes to evaluate PESQ. 0: Evaluate in main process. Default: 4')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
@@ -31,7 +35,10 @@ def main(args):
     test_dataset = WaveTestDataset(args.test_wav_root, args.test_list_path, n_sources=args.n_sources)
     print("Test dataset includes {} samples.".format(len(test_dataset)))
     
-    loader = TestDataLoader(test_dataset, batch_size=1, shuffle=False)
+    if args.batch_size > 1:
+        loader = BucketTestDataLoader(test_dataset, batch_size=args.batch_size, max_padding=args.max_padding)
+    else:
+        loader = TestDataLoader(test_dataset, batch_size=1, shuffle=False)
     
     model = DPRNNTasNet.build_model(args.model_path)
     print(model)
@@ -6,6 +6,8 @@ import torch
 import torch.nn as nn
 
 from utils.utils import set_seed
+from utils.distributed import unwrap_model
+from utils.memory_budget import GiB, BatchSizeFinder
 from dataset import WaveTrainDataset, WaveEvalDataset, TrainDataLoader, EvalDataLoader
 from adhoc_driver import AdhocTrainer
 from models.dptnet import DPTNet
@@ -42,6 +44,7 @@ parser.add_argument('--sep_nonlinear', type=str, default='relu', help='Non-linea
 parser.add_argument('--sep_dropout', type=float, default=0, help='Dropout')
 parser.add_argument('--mask_nonlinear', type=str, default='sigmoid', help='Non-linear function of mask estiamtion')
 parser.add_argument('--n_sources', type=int, default=None, help='# speakers')
+parser.add_argument('--gradient_checkpointing', type=int, default=0, help='0: Store all activations, 1: Recompute activations of each separator block in backward to save memory')
 parser.add_argument('--criterion', type=str, default='sisdr', choices=['sisdr'], help='Criterion')
 parser.add_argument('--optimizer', type=str, default='adam', choices=['sgd', 'adam', 'rmsprop'], help='Optimizer, [sgd, adam, rmsprop]')
 parser.add_argument('--k1', type=float, default=2e-1, help='Learning rate during warm up. Default: 2e-1')
@@ -50,12 +53,16 @@ parser.add_argument('--weight_decay', type=float, default=0, help='Weight decay
 parser.add_argument('--warmup_steps', type=int, default=4000, help='Warmup steps')
 parser.add_argument('--max_norm', type=float, default=None, help='Gradient clipping')
 parser.add_argument('--batch_size', type=int, default=4, help='Batch size. Default: 4')
+parser.add_argument('--memory_budget', type=float, default=0, help='Memory budget [GiB] of one device. If positive, batch_size is replaced by the largest one whose forward and backward fit in the budget. Default: 0')
 parser.add_argument('--epochs', type=int, default=5, help='Number of epochs')
 parser.add_argument('--model_dir', type=str, default='./tmp/model', help='Model directory')
 parser.add_argument('--loss_dir', type=str, default='./tmp/loss', help='Loss directory')
 parser.add_argument('--sample_dir', type=str, default='./tmp/sample', help='Sample directory')
 parser.add_argument('--continue_from', type=str, default=None, help='Resume training')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--prefetch', type=int, default=0, help='Number of training batches staged in advance on background thread. If 0, prefetching is disabled. Default: 0')
+parser.add_argument('--profile', type=str, default='none', choices=['none', 'timer', 'trace'], help='timer: Report time of data loading, forward, backward, etc. and throughput every epoch, trace: In addition, export torch.profiler traces as Chrome trace files. Default: none')
+parser.add_argument('--profile_dir', type=str, default='./tmp/profile', help='Directory of torch.profiler traces')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
@@ -72,7 +79,6 @@ def main(args):
     print("Valid dataset includes {} samples.".format(len(valid_dataset)))
     
     loader = {}
-    loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
     loader['valid'] = EvalDataLoader(valid_dataset, batch_size=1, shuffle=False)
     
     if not args.enc_nonlinear:
@@ -88,7 +94,8 @@ def main(args):
         sep_num_heads=args.sep_num_heads, sep_norm=args.sep_norm, sep_nonlinear=args.sep_nonlinear, sep_dropout=args.sep_dropout,
         mask_nonlinear=args.mask_nonlinear,
         causal=args.causal,
-        n_sources=args.n_sources
+        n_sources=args.n_sources,
+        gradient_checkpointing=args.gradient_checkpointing
     )
     print(model)
     print("# Parameters: {}".format(model.num_parameters))
@@ -127,6 +134,13 @@ def main(args):
     
     pit_criterion = PIT1d(criterion, n_sources=args.n_sources)
     
+    if args.memory_budget > 0:
+        # Search on the model before DataParallel or DistributedDataParallel, so batch_size is per device.
+        finder = BatchSizeFinder(unwrap_model(model), pit_criterion, memory_budget=args.memory_budget * GiB, n_sources=args.n_sources, optimizer=optimizer)
+        args.batch_size = finder.find_max_batch_size(samples)
+    
+    loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
+    
     trainer = AdhocTrainer(model, loader, pit_criterion, optimizer, args)
     trainer.run()
 
@@ -1,16 +1,13 @@
 import os
-import shutil
-import subprocess
-import uuid
 
 from mir_eval.separation import bss_eval_sources
 import torch
 import torchaudio
 
 from utils.bss import bss_eval_sources
+from utils.speech_quality import DEFAULT_N_WORKERS, SpeechQualityEvaluator
 
 BITS_PER_SAMPLE_WSJ0 = 16
-MIN_PESQ = -0.5
 
 class AdhocTester:
     def __init__(self, method, loader, criterion, args):
@@ -31,6 +28,13 @@ class AdhocTester:
         if self.out_dir is not None:
             self.out_dir = os.path.abspath(args.out_dir)
             os.makedirs(self.out_dir, exist_ok=True)
+        
+        if hasattr(args, 'n_pesq_workers'):
+            n_pesq_workers = args.n_pesq_workers
+        else:
+            n_pesq_workers = DEFAULT_N_WORKERS
+        
+        self.speech_evaluator = SpeechQualityEvaluator(self.sample_rate, num_workers=n_pesq_workers)
     
     def run(self):
         test_loss = 0
@@ -39,15 +43,9 @@ class AdhocTester:
         test_sir_improvement = 0
         test_sar = 0
         test_pesq = 0
-        n_pesq_error = 0
         n_test = len(self.loader.dataset)
 
         print("ID, Loss, Loss improvement, SDR improvement, SIR improvement, SAR, PESQ", flush=True)
-
-        tmp_dir = os.path.join(os.getcwd(), 'tmp')
-        os.makedirs(tmp_dir, exist_ok=True)
-        shutil.copy('./PESQ', os.path.join(tmp_dir, 'PESQ'))
-        os.chdir(tmp_dir)
         
         with torch.no_grad():
             for idx, (mixture, sources, segment_IDs) in enumerate(self.loader):
@@ -65,23 +63,17 @@ class AdhocTester:
                 segment_IDs = segment_IDs[0] # -> <str>
 
                 repeated_mixture = torch.tile(mixture, (self.n_sources, 1))
-                result_oracle = bss_eval_sources(
+                # Estimates and mixture share reference sources, so they are evaluated in one batch.
+                result_oracle, result_mixed = zip(*bss_eval_sources(
                     reference_sources=sources,
-                    estimated_sources=oracle_sources
-                )
-                result_mixed = bss_eval_sources(
-                    reference_sources=sources,
-                    estimated_sources=repeated_mixture
-                )
+                    estimated_sources=torch.stack([oracle_sources, repeated_mixture], dim=0)
+                ))
         
                 sdr_improvement = torch.mean(result_oracle[0] - result_mixed[0])
                 sir_improvement = torch.mean(result_oracle[1] - result_mixed[1])
                 sar = torch.mean(result_oracle[2])
                 
                 mixture_ID = segment_IDs
-                
-                # Generate random number temporary wav file.
-                random_ID = str(uuid.uuid4())
 
                 if idx < 10 and self.out_dir is not None:
                     mixture_path = os.path.join(self.out_dir, "{}.wav".format(mixture_ID))
@@ -95,52 +87,34 @@ class AdhocTester:
                         source_path = os.path.join(self.out_dir, "{}_{}-target.wav".format(mixture_ID, order_idx + 1))
                         signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
                         torchaudio.save(source_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    source_path = "tmp-{}-target_{}.wav".format(order_idx + 1, random_ID)
-                    signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
-                    torchaudio.save(source_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
                     
                     # Oracle source
                     if idx < 10 and  self.out_dir is not None:
                         oracle_path = os.path.join(self.out_dir, "{}_{}-oracle.wav".format(mixture_ID, order_idx + 1))
                         signal = oracle_source.unsqueeze(dim=0) if oracle_source.dim() == 1 else oracle_source
                         torchaudio.save(oracle_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    oracle_path = "tmp-{}-oracle_{}.wav".format(order_idx + 1, random_ID)
-                    signal = oracle_source.unsqueeze(dim=0) if oracle_source.dim() == 1 else oracle_source
-                    torchaudio.save(oracle_path, signal, sample_rate=self.sample_rate, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                
-                pesq = 0
                 
-                for source_idx in range(self.n_sources):
-                    source_path = "tmp-{}-target_{}.wav".format(source_idx + 1, random_ID)
-                    oracle_path = "tmp-{}-oracle_{}.wav".format(source_idx + 1, random_ID)
-                    
-                    command = "./PESQ +{} {} {}".format(self.sample_rate, source_path, oracle_path)
-                    command += " | grep Prediction | awk '{print $5}'"
-                    pesq_output = subprocess.check_output(command, shell=True)
-                    pesq_output = pesq_output.decode().strip()
-                    
-                    if pesq_output == '':
-                        # If processing error occurs in PESQ software, it is regarded as PESQ score is -0.5. (minimum of PESQ)
-                        n_pesq_error += 1
-                        pesq += MIN_PESQ
-                    else:
-                        pesq += float(pesq_output)
-                    
-                    subprocess.call("rm {}".format(source_path), shell=True)
-                    subprocess.call("rm {}".format(oracle_path), shell=True)
+                # PESQ is evaluated by worker processes, while next utterances are separated.
+                result = (mixture_ID, loss.item(), loss_improvement, sdr_improvement.item(), sir_improvement.item(), sar.item())
+                self.speech_evaluator.submit(sources, oracle_sources, info=result)
                 
-                pesq /= self.n_sources
-                print("{}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}".format(mixture_ID, loss.item(), loss_improvement, sdr_improvement.item(), sir_improvement.item(), sar.item(), pesq), flush=True)
+                for result, pesq, _ in self.speech_evaluator.collect():
+                    print("{}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}".format(*result, pesq), flush=True)
+                    test_pesq += pesq
                 
                 test_loss += loss.item()
                 test_loss_improvement += loss_improvement
                 test_sdr_improvement += sdr_improvement.item()
                 test_sir_improvement += sir_improvement.item()
                 test_sar += sar.item()
-                test_pesq += pesq
-        
-        os.chdir("../") # back to the original directory
 
+        for result, pesq, _ in self.speech_evaluator.collect(block=True):
+            print("{}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}".format(*result, pesq), flush=True)
+            test_pesq += pesq
+        
+        n_pesq_error = self.speech_evaluator.n_pesq_error
+        self.speech_evaluator.close()
+        
         test_loss /= n_test
         test_loss_improvement /= n_test
         test_sdr_improvement /= n_test
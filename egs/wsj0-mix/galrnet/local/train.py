@@ -6,6 +6,8 @@ import torch
 import torch.nn as nn
 
 from utils.utils import set_seed
+from utils.distributed import unwrap_model
+from utils.memory_budget import GiB, BatchSizeFinder
 from dataset import WaveTrainDataset, WaveEvalDataset, TrainDataLoader, EvalDataLoader
 from adhoc_driver import AdhocTrainer
 from models.galrnet import GALRNet
@@ -41,18 +43,23 @@ parser.add_argument('--sep_dropout', type=float, default=0.1, help='Dropout rate
 parser.add_argument('--mask_nonlinear', type=str, default='sigmoid', help='Non-linear function of mask estiamtion')
 parser.add_argument('--causal', type=int, default=0, help='Causality')
 parser.add_argument('--n_sources', type=int, default=None, help='# speakers')
+parser.add_argument('--gradient_checkpointing', type=int, default=0, help='0: Store all activations, 1: Recompute activations of each separator block in backward to save memory')
 parser.add_argument('--criterion', type=str, default='sisdr', choices=['sisdr'], help='Criterion')
 parser.add_argument('--optimizer', type=str, default='adam', choices=['sgd', 'adam', 'rmsprop'], help='Optimizer, [sgd, adam, rmsprop]')
 parser.add_argument('--lr', type=float, default=1e-3, help='Learning rate. Default: 1e-3')
 parser.add_argument('--weight_decay', type=float, default=0, help='Weight decay (L2 penalty). Default: 0')
 parser.add_argument('--max_norm', type=float, default=None, help='Gradient clipping')
 parser.add_argument('--batch_size', type=int, default=4, help='Batch size. Default: 128')
+parser.add_argument('--memory_budget', type=float, default=0, help='Memory budget [GiB] of one device. If positive, batch_size is replaced by the largest one whose forward and backward fit in the budget. Default: 0')
 parser.add_argument('--epochs', type=int, default=5, help='Number of epochs')
 parser.add_argument('--model_dir', type=str, default='./tmp/model', help='Model directory')
 parser.add_argument('--loss_dir', type=str, default='./tmp/loss', help='Loss directory')
 parser.add_argument('--sample_dir', type=str, default='./tmp/sample', help='Sample directory')
 parser.add_argument('--continue_from', type=str, default=None, help='Resume training')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--prefetch', type=int, default=0, help='Number of training batches staged in advance on background thread. If 0, prefetching is disabled. Default: 0')
+parser.add_argument('--profile', type=str, default='none', choices=['none', 'timer', 'trace'], help='timer: Report time of data loading, forward, backward, etc. and throughput every epoch, trace: In addition, export torch.profiler traces as Chrome trace files. Default: none')
+parser.add_argument('--profile_dir', type=str, default='./tmp/profile', help='Directory of torch.profiler traces')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
@@ -69,7 +76,6 @@ def main(args):
     print("Valid dataset includes {} samples.".format(len(valid_dataset)))
     
     loader = {}
-    loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
     loader['valid'] = EvalDataLoader(valid_dataset, batch_size=1, shuffle=False)
     
     if not args.enc_nonlinear:
@@ -85,7 +91,8 @@ def main(args):
         mask_nonlinear=args.mask_nonlinear,
         causal=args.causal,
         n_sources=args.n_sources,
-        low_dimension=True
+        low_dimension=True,
+        gradient_checkpointing=args.gradient_checkpointing
     )
     print(model)
     print("# Parameters: {}".format(model.num_parameters))
@@ -118,6 +125,13 @@ def main(args):
     
     pit_criterion = PIT1d(criterion, n_sources=args.n_sources)
     
+    if args.memory_budget > 0:
+        # Search on the model before DataParallel or DistributedDataParallel, so batch_size is per device.
+        finder = BatchSizeFinder(unwrap_model(model), pit_criterion, memory_budget=args.memory_budget * GiB, n_sources=args.n_sources, optimizer=optimizer)
+        args.batch_size = finder.find_max_batch_size(samples)
+    
+    loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
+    
     trainer = AdhocTrainer(model, loader, pit_criterion, optimizer, args)
     trainer.run()
 
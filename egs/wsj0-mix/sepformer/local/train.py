@@ -4,10 +4,12 @@
 import argparse
 
 import torch
-import torch.nn as nn
 
 from utils.utils import set_seed
-from dataset import WaveTrainDataset, WaveEvalDataset, TrainDataLoader, EvalDataLoader
+from utils.distributed import init_distributed, get_rank, distribute_model, unwrap_model
+from utils.memory_budget import GiB, BatchSizeFinder
+from utils.mixed_precision import get_amp_dtype
+from dataset import WaveTrainDataset, WaveEvalDataset, DynamicMixingWaveTrainDataset, TrainDataLoader, EvalDataLoader, BucketEvalDataLoader
 from adhoc_driver import AdhocTrainer
 from models.sepformer import SepFormer
 from criterion.sdr import NegSISDR, ClippedNegSISDR
@@ -22,6 +24,8 @@ parser.add_argument('--valid_list_path', type=str, default=None, help='Path for
 parser.add_argument('--sample_rate', '-sr', type=int, default=8000, help='Sampling rate')
 parser.add_argument('--duration', type=float, default=2, help='Duration')
 parser.add_argument('--valid_duration', type=float, default=4, help='Duration for valid dataset for avoiding memory error.')
+parser.add_argument('--dynamic_mixing', type=int, default=0, help='0: Use pre-rendered mixtures, 1: Mix single-speaker utterances on the fly')
+parser.add_argument('--samples_per_epoch', type=int, default=-1, help='Training samples in one epoch when dynamic_mixing=1')
 parser.add_argument('--enc_basis', type=str, default='trainable', choices=['trainable','Fourier','trainableFourier','trainableFourierTrainablePhase'], help='Encoder type')
 parser.add_argument('--dec_basis', type=str, default='trainable', choices=['trainable','Fourier','trainableFourier','trainableFourierTrainablePhase', 'pinv'], help='Decoder type')
 parser.add_argument('--enc_nonlinear', type=str, default=None, help='Non-linear function of encoder')
@@ -47,6 +51,7 @@ parser.add_argument('--sep_nonlinear', type=str, default='relu', help='Non-linea
 parser.add_argument('--sep_dropout', type=float, default=0, help='Dropout')
 parser.add_argument('--mask_nonlinear', type=str, default='sigmoid', help='Non-linear function of mask estiamtion')
 parser.add_argument('--n_sources', type=int, default=None, help='# speakers')
+parser.add_argument('--gradient_checkpointing', type=int, default=0, help='0: Store all activations, 1: Recompute activations of each separator block in backward to save memory')
 parser.add_argument('--criterion', type=str, default='clipped-sisdr', choices=['clipped-sisdr', 'sisdr'], help='Criterion')
 parser.add_argument('--clip', type=float, default=30, help='Clip of SI-SDR.')
 parser.add_argument('--optimizer', type=str, default='adam', choices=['sgd', 'adam', 'rmsprop'], help='Optimizer, [sgd, adam, rmsprop]')
@@ -54,30 +59,46 @@ parser.add_argument('--lr', type=float, default=15e-5, help='Learning rate durin
 parser.add_argument('--weight_decay', type=float, default=0, help='Weight decay (L2 penalty). Default: 0')
 parser.add_argument('--max_norm', type=float, default=None, help='Gradient clipping')
 parser.add_argument('--batch_size', type=int, default=4, help='Batch size. Default: 4')
+parser.add_argument('--memory_budget', type=float, default=0, help='Memory budget [GiB] of one device. If positive, batch_size is replaced by the largest one whose forward and backward fit in the budget. Default: 0')
+parser.add_argument('--valid_batch_size', type=int, default=1, help='Batch size for validation. If larger than 1, utterances of same length are batched together.')
+parser.add_argument('--prefetch', type=int, default=0, help='Number of training batches staged in advance on background thread. If 0, prefetching is disabled. Default: 0')
 parser.add_argument('--epochs', type=int, default=200, help='Number of epochs')
 parser.add_argument('--model_dir', type=str, default='./tmp/model', help='Model directory')
 parser.add_argument('--loss_dir', type=str, default='./tmp/loss', help='Loss directory')
 parser.add_argument('--sample_dir', type=str, default='./tmp/sample', help='Sample directory')
 parser.add_argument('--continue_from', type=str, default=None, help='Resume training')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--amp', type=str, default='none', choices=['none', 'fp16', 'bf16'], help='Mixed precision with autocast. SDR, STFT and Wiener filter are computed in float32. Default: none')
+parser.add_argument('--profile', type=str, default='none', choices=['none', 'timer', 'trace'], help='timer: Report time of data loading, forward, backward, etc. and throughput every epoch, trace: In addition, export torch.profiler traces as Chrome trace files. Default: none')
+parser.add_argument('--profile_dir', type=str, default='./tmp/profile', help='Directory of torch.profiler traces')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
 def main(args):
-    set_seed(args.seed)
+    # Launched by `torchrun --nproc_per_node <N> local/train.py ...` for multi-process training.
+    distributed = init_distributed(use_cuda=args.use_cuda)
+    # Every process draws different random crops and mixtures.
+    set_seed(args.seed + get_rank())
     
     samples = int(args.sample_rate * args.duration)
     overlap = samples // 2
     max_samples = int(args.sample_rate * args.valid_duration)
     
-    train_dataset = WaveTrainDataset(args.train_wav_root, args.train_list_path, samples=samples, overlap=overlap, n_sources=args.n_sources)
+    if args.dynamic_mixing:
+        samples_per_epoch = args.samples_per_epoch if args.samples_per_epoch > 0 else None
+        train_dataset = DynamicMixingWaveTrainDataset(args.train_wav_root, args.train_list_path, samples=samples, n_sources=args.n_sources, samples_per_epoch=samples_per_epoch)
+    else:
+        train_dataset = WaveTrainDataset(args.train_wav_root, args.train_list_path, samples=samples, overlap=overlap, n_sources=args.n_sources)
+    
     valid_dataset = WaveEvalDataset(args.valid_wav_root, args.valid_list_path, max_samples=max_samples, n_sources=args.n_sources)
     print("Training dataset includes {} samples.".format(len(train_dataset)))
     print("Valid dataset includes {} samples.".format(len(valid_dataset)))
     
     loader = {}
-    loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
-    loader['valid'] = EvalDataLoader(valid_dataset, batch_size=1, shuffle=False)
+    if args.valid_batch_size > 1:
+        loader['valid'] = BucketEvalDataLoader(valid_dataset, batch_size=args.valid_batch_size)
+    else:
+        loader['valid'] = EvalDataLoader(valid_dataset, batch_size=1, shuffle=False)
     
     if not args.enc_nonlinear:
         args.enc_nonlinear = None
@@ -97,7 +118,8 @@ def main(args):
         sep_d_ff_intra=args.sep_d_ff_intra, sep_d_ff_inter=args.sep_d_ff_inter,
         sep_norm=args.sep_norm, sep_nonlinear=args.sep_nonlinear, sep_dropout=args.sep_dropout, mask_nonlinear=args.mask_nonlinear,
         causal=args.causal,
-        n_sources=args.n_sources
+        n_sources=args.n_sources,
+        gradient_checkpointing=args.gradient_checkpointing
     )
     print(model)
     print("# Parameters: {}".format(model.num_parameters))
@@ -105,12 +127,13 @@ def main(args):
     if args.use_cuda:
         if torch.cuda.is_available():
             model.cuda()
-            model = nn.DataParallel(model)
+            model = distribute_model(model, use_cuda=True)
             print("Use CUDA", flush=True)
         else:
             raise ValueError("Cannot use CUDA.")
     else:
         print("Does NOT use CUDA", flush=True)
+        model = distribute_model(model)
         
     # Optimizer
     if args.optimizer == 'sgd':
@@ -132,6 +155,18 @@ def main(args):
     
     pit_criterion = PIT1d(criterion, n_sources=args.n_sources)
     
+    if args.memory_budget > 0:
+        # Search on the model before DataParallel or DistributedDataParallel, so batch_size is per device.
+        finder = BatchSizeFinder(unwrap_model(model), pit_criterion, memory_budget=args.memory_budget * GiB, n_sources=args.n_sources, optimizer=optimizer, amp_dtype=get_amp_dtype(args.amp))
+        args.batch_size = finder.find_max_batch_size(samples)
+    
+    if distributed:
+        # batch_size is per process.
+        train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset, shuffle=True)
+        loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, sampler=train_sampler)
+    else:
+        loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
+    
     trainer = AdhocTrainer(model, loader, pit_criterion, optimizer, args)
     trainer.run()
 
@@ -1,7 +1,4 @@
-import os
-
 import torch
-import torchaudio
 
 from dataset import WaveDataset
 
@@ -26,58 +23,13 @@ class WaveTrainDataset(WaveDataset):
 
 class WaveEvalDataset(WaveDataset):
     def __init__(self, wav_root, list_path, max_samples=None, n_sources=2, spk_to_idx=None):
-        super().__init__(wav_root, list_path, n_sources=n_sources)
+        super().__init__(wav_root, list_path, samples=None, max_samples=max_samples, n_sources=n_sources)
 
         self.spk_to_idx = spk_to_idx
-
-        wav_root = os.path.abspath(wav_root)
-        list_path = os.path.abspath(list_path)
-
-        self.json_data = []
-        
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix', '{}.wav'.format(ID))
-
-                wave, _ = torchaudio.load(wav_path)
-                
-                _, T_total = wave.size()
-                
-                if max_samples is None:
-                    samples = T_total
-                else:
-                    if T_total < max_samples:
-                        samples = T_total
-                    else:
-                        samples = max_samples
-                
-                data = {
-                    'sources': {},
-                    'mixture': {}
-                }
-                
-                for source_idx in range(n_sources):
-                    source_data = {
-                        'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
-                        'start': 0,
-                        'end': samples
-                    }
-                    data['sources']['s{}'.format(source_idx + 1)] = source_data
-                
-                mixture_data = {
-                    'path': os.path.join('mix', '{}.wav'.format(ID)),
-                    'start': 0,
-                    'end': samples
-                }
-                data['mixture'] = mixture_data
-                data['ID'] = ID
-            
-                self.json_data.append(data)
     
     def __getitem__(self, idx):
         mixture, sources, _ = super().__getitem__(idx)
-        segment_ID = self.json_data[idx]['ID']
+        segment_ID = self.segments.name(idx)
 
         spk = segment_ID.split('_')[0:-1:2]
         spk_idx = []
@@ -7,6 +7,8 @@ import torch.nn as nn
 
 from utils.utils import draw_loss_curve
 from criterion.pit import pit as pit_wrapper
+from utils.prefetch import wrap_prefetch_loader
+from utils.profiler import wrap_profiled_loader
 
 BITS_PER_SAMPLE_WSJ0 = 16
 HALVE_LR = 3
@@ -44,6 +46,12 @@ class Trainer:
         self.return_all_layers = True
         self.use_cuda = args.use_cuda
         
+        # Stage next batches on background thread if `--prefetch` is given, and report data wait time every epoch.
+        self.train_loader = wrap_prefetch_loader(self.train_loader, args, use_cuda=self.use_cuda)
+        
+        # Measure time of data loading, forward, backward, etc. every epoch if `--profile` is given.
+        self.train_loader = wrap_profiled_loader(self.train_loader, self.model, self.optimizer, args, use_cuda=self.use_cuda)
+        
         if args.continue_from:
             config = torch.load(args.continue_from, map_location=lambda storage, loc: storage)
             
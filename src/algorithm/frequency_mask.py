@@ -3,6 +3,8 @@ import math
 
 import torch
 
+from utils.mixed_precision import float32
+
 EPS = 1e-12
 
 def compute_ideal_binary_mask(input, source_dim=-3):
@@ -194,6 +196,7 @@ def ideal_complex_mask(input, source_dim=None, eps=EPS):
     mask = compute_ideal_complex_mask(input, source_dim=source_dim, eps=eps)
     return mask
 
+@float32
 def multichannel_wiener_filter(mixture, estimated_sources_amplitude, iteration=1, channels_first=True, eps=EPS):
     """
     Multichannel Wiener filter.
@@ -89,4 +89,114 @@ class RandomSign:
     def __call__(self, input):
         output = apply_random_sign(input, rate=self.rate)
         
-        return output
\ No newline at end of file
+        return output
+
+"""
+    Batch augmentation
+    Input is expected as (batch_size, n_sources, *, T), e.g. (batch_size, n_sources, n_mics, T).
+    Random parameters are drawn independently for every source of every example on the device of input.
+"""
+def apply_batch_random_flip(input, flip_rate=0.5, dim=0):
+    """
+    Args:
+        input <torch.Tensor>: (batch_size, n_sources, *)
+        dim <int> or <tuple<int>>: Dimension(s) of each source (*) to be flipped, same as `apply_random_flip`.
+    Returns:
+        output <torch.Tensor>: (batch_size, n_sources, *)
+    """
+    if type(dim) is int:
+        dim = (dim,)
+    
+    dim = tuple(_dim + 2 if _dim >= 0 else _dim for _dim in dim)
+
+    flip = torch.rand(input.size()[:2], device=input.device) < flip_rate
+    flip = flip.view(*flip.size(), *([1] * (input.dim() - 2)))
+    output = torch.where(flip, torch.flip(input, dims=dim), input)
+
+    return output
+
+class BatchRandomFlip:
+    def __init__(self, flip_rate=0.5, dim=0):
+        self.flip_rate = flip_rate
+        self.dim = dim
+    
+    def __call__(self, input):
+        output = apply_batch_random_flip(input, flip_rate=self.flip_rate, dim=self.dim)
+
+        return output
+
+def apply_batch_random_gain(input, min=MINSCALE, max=MAXSCALE):
+    """
+    Args:
+        input <torch.Tensor>: (batch_size, n_sources, *)
+    Returns:
+        output <torch.Tensor>: (batch_size, n_sources, *)
+    """
+    scale = min + (max - min) * torch.rand(input.size()[:2], dtype=input.dtype, device=input.device)
+    scale = scale.view(*scale.size(), *([1] * (input.dim() - 2)))
+    output = scale * input
+
+    return output
+
+class BatchRandomGain:
+    def __init__(self, min=MINSCALE, max=MAXSCALE):
+        self.min, self.max = min, max
+    
+    def __call__(self, input):
+        output = apply_batch_random_gain(input, min=self.min, max=self.max)
+        
+        return output
+
+def apply_batch_random_sign(input, rate=0.5):
+    """
+    Args:
+        input <torch.Tensor>: (batch_size, n_sources, *)
+    Returns:
+        output <torch.Tensor>: (batch_size, n_sources, *)
+    """
+    flip = torch.rand(input.size()[:2], device=input.device) < rate
+    sign = 1 - 2 * flip.to(input.dtype)
+    sign = sign.view(*sign.size(), *([1] * (input.dim() - 2)))
+    output = sign * input
+
+    return output
+
+class BatchRandomSign:
+    def __init__(self, rate=0.5):
+        self.rate = rate
+    
+    def __call__(self, input):
+        output = apply_batch_random_sign(input, rate=self.rate)
+        
+        return output
+
+def apply_batch_remix(input, n_remixes=1):
+    """
+    Shuffle each source among examples in batch independently, which synthesizes new mixtures without reading audio.
+    Args:
+        input <torch.Tensor>: (batch_size, n_sources, *)
+        n_remixes <int>: Number of remixed batches. Outputs are concatenated along batch dimension.
+    Returns:
+        output <torch.Tensor>: (n_remixes * batch_size, n_sources, *)
+    """
+    batch_size, n_sources = input.size()[:2]
+    source_indices = torch.arange(n_sources, device=input.device)
+
+    output = []
+
+    for _ in range(n_remixes):
+        batch_indices = torch.argsort(torch.rand(batch_size, n_sources, device=input.device), dim=0)
+        output.append(input[batch_indices, source_indices])
+    
+    output = torch.cat(output, dim=0)
+
+    return output
+
+class BatchRemix:
+    def __init__(self, n_remixes=1):
+        self.n_remixes = n_remixes
+    
+    def __call__(self, input):
+        output = apply_batch_remix(input, n_remixes=self.n_remixes)
+
+        return output
@@ -45,6 +45,10 @@ class L1Loss(nn.Module):
     def maximize(self):
         return False
 
+    @property
+    def separable(self):
+        return _is_separable(self.dim, self.reduction)
+
 class L2Loss(nn.Module):
     def __init__(self, dim=1, reduction='mean'):
         """
@@ -91,6 +95,10 @@ class L2Loss(nn.Module):
     def maximize(self):
         return False
 
+    @property
+    def separable(self):
+        return _is_separable(self.dim, self.reduction)
+
 class L12Loss(nn.Module):
     def __init__(self, dim1=1, dim2=2, reduction='mean'):
         """
@@ -316,6 +324,20 @@ class NegCosineSimilarityLoss(nn.Module):
 
         return loss
 
+def _is_separable(dim, reduction):
+    """
+    Loss is separable if source axis (dim=1) is reduced by `reduction` rather than summed over with `dim`.
+    Args:
+        dim <int> or <tuple<int>>
+        reduction <str>
+    Returns:
+        separable <bool>
+    """
+    if type(dim) is int:
+        dim = (dim,)
+
+    return reduction in ['mean', 'sum'] and not 1 in dim
+
 def _test_l1loss():
     batch_size, C, T = 2, 4, 6
 
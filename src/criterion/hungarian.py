@@ -1,13 +1,200 @@
 import torch
 import torch.nn as nn
 
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+from criterion.pit import pairwise_loss
+
 """
 "Many-Speakers Single Channel Speech Separation with Optimal Permutation Training"
+See https://arxiv.org/abs/2104.08955
 """
 
+def hungarian_pit(criterion, input, target, n_sources=None, batch_mean=True):
+    """
+    Permutation invariant training with optimal assignment by Hungarian algorithm.
+    Criterion is evaluated n_sources^2 times in one batched call instead of n_sources! times, so many sources (e.g. 10 or 20) are tractable.
+    Args:
+        criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called. Loss between permuted input and target is assumed to be sum or mean of losses between paired sources.
+        input (batch_size, n_sources, *)
+        target (batch_size, n_sources, *)
+    Returns:
+        loss (batch_size,): minimum loss for each data
+        pattern (batch_size, n_sources): permutation indices
+    """
+    if n_sources is None:
+        n_sources = input.size(1)
+
+    with torch.no_grad():
+        possible_loss = pairwise_loss(criterion, input, target, n_sources=n_sources) # (batch_size, n_sources, n_sources)
+
+    if hasattr(criterion, "maximize") and criterion.maximize:
+        possible_loss = - possible_loss
+
+    pattern = assign(possible_loss)
+    pattern = pattern.to(target.device)
+
+    # Loss is evaluated again with gradient, so it is identical to that of PIT.
+    target = torch.gather(target, dim=1, index=pattern.view(*pattern.size(), *([1] * (target.dim() - 2))).expand_as(target))
+    loss = criterion(input, target, batch_mean=False)
+
+    if batch_mean:
+        loss = loss.mean(dim=0)
+
+    return loss, pattern
+
+def assign(cost):
+    """
+    Solves linear sum assignment problem for every data.
+    Uses scipy if available, otherwise Hungarian algorithm implemented here.
+    Args:
+        cost (batch_size, n_sources, n_sources): cost[:, i, j] is cost to assign j-th target to i-th input.
+    Returns:
+        pattern (batch_size, n_sources) <torch.LongTensor>: pattern[:, i] is target index assigned to i-th input.
+    """
+    cost = cost.detach().cpu().double()
+    pattern = []
+
+    for _cost in cost:
+        if linear_sum_assignment is None:
+            indices = _linear_sum_assignment(_cost.tolist())
+        else:
+            _, indices = linear_sum_assignment(_cost.numpy())
+            indices = indices.tolist()
+
+        pattern.append(indices)
+
+    pattern = torch.LongTensor(pattern)
+
+    return pattern
+
+def _linear_sum_assignment(cost):
+    """
+    Hungarian algorithm with potentials in O(n^3).
+    Args:
+        cost <list<list<float>>>: Square cost matrix
+    Returns:
+        indices <list<int>>: indices[i] is column assigned to i-th row.
+    """
+    n = len(cost)
+    inf = float('inf')
+
+    # 1-indexed. Column 0 is dummy.
+    u, v = [0] * (n + 1), [0] * (n + 1)
+    row_of_column, way = [0] * (n + 1), [0] * (n + 1)
+
+    for row in range(1, n + 1):
+        row_of_column[0] = row
+        column = 0
+        min_value = [inf] * (n + 1)
+        used = [False] * (n + 1)
+
+        while True:
+            used[column] = True
+            _row = row_of_column[column]
+            delta, next_column = inf, None
+
+            for _column in range(1, n + 1):
+                if used[_column]:
+                    continue
+
+                reduced = cost[_row - 1][_column - 1] - u[_row] - v[_column]
+
+                if reduced < min_value[_column]:
+                    min_value[_column] = reduced
+                    way[_column] = column
+
+                if min_value[_column] < delta:
+                    delta = min_value[_column]
+                    next_column = _column
+
+            for _column in range(n + 1):
+                if used[_column]:
+                    u[row_of_column[_column]] += delta
+                    v[_column] -= delta
+                else:
+                    min_value[_column] -= delta
+
+            column = next_column
+
+            if row_of_column[column] == 0:
+                break
+
+        while column != 0:
+            prev_column = way[column]
+            row_of_column[column] = row_of_column[prev_column]
+            column = prev_column
+
+    indices = [0] * n
+
+    for column in range(1, n + 1):
+        indices[row_of_column[column] - 1] = column - 1
+
+    return indices
+
 class HungarianLoss(nn.Module):
-    def __init__(self):
+    def __init__(self, criterion, n_sources=None):
+        """
+        Args:
+            criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called.
+        """
         super().__init__()
-    
+
+        self.criterion = criterion
+        self.n_sources = n_sources
+
     def forward(self, input, target, batch_mean=True):
-        raise NotImplementedError
\ No newline at end of file
+        """
+        Args:
+            input (batch_size, n_sources, *)
+            target (batch_size, n_sources, *)
+        Returns:
+            loss (batch_size,): minimum loss for each data
+            pattern (batch_size, n_sources): permutation indices
+        """
+        loss, pattern = hungarian_pit(self.criterion, input, target, n_sources=self.n_sources, batch_mean=batch_mean)
+
+        return loss, pattern
+
+class HungarianPIT(HungarianLoss):
+    def __init__(self, criterion, n_sources=None):
+        super().__init__(criterion, n_sources=n_sources)
+
+def _test_hungarian_pit():
+    torch.manual_seed(111)
+
+    batch_size, C, T = 4, 3, 1024
+    input = torch.randn(batch_size, C, T)
+    target = torch.randn(batch_size, C, T)
+
+    print('-'*10, "Negative SI-SDR (PIT)", '-'*10)
+    criterion = NegSISDR()
+    pit_criterion = PIT(criterion, n_sources=C)
+    loss, pattern = pit_criterion(input, target, batch_mean=False)
+
+    print(loss)
+    print(pattern)
+    print()
+
+    print('-'*10, "Negative SI-SDR (Hungarian)", '-'*10)
+    pit_criterion = HungarianPIT(criterion, n_sources=C)
+    loss, pattern = pit_criterion(input, target, batch_mean=False)
+
+    print(loss)
+    print(pattern)
+    print()
+
+    print('-'*10, "Hungarian algorithm", '-'*10)
+    cost = torch.randn(batch_size, 10, 10)
+    pattern = torch.LongTensor([_linear_sum_assignment(_cost.tolist()) for _cost in cost])
+    print(torch.equal(pattern, assign(cost)))
+
+if __name__ == '__main__':
+    from criterion.sdr import NegSISDR
+    from criterion.pit import PIT
+
+    print('='*10, "Hungarian PIT", '='*10)
+    _test_hungarian_pit()
@@ -1,9 +1,236 @@
+import itertools
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
 """
 "Unsupervised Sound Separation Using Mixture Invariant Training"
+See https://arxiv.org/abs/2006.12701
 """
-def mixit(input, target):
-    raise NotImplementedError
 
-class MixIT:
-    def __init__(self):
-        pass
\ No newline at end of file
+def mixit(criterion, input, target, n_mixtures=None, patterns=None, batch_mean=True):
+    """
+    Mixture invariant training. Estimated sources are remixed by every assignment to mixtures, and the best remix is chosen.
+    Remixes of all assignments are computed by one matmul, and scored by one criterion call.
+    Args:
+        criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called.
+        input (batch_size, n_sources, *): Estimated sources
+        target (batch_size, n_mixtures, *): Mixtures
+        patterns (P, n_sources) <torch.LongTensor>: Candidates of assignment, i.e. patterns[p, m] is index of mixture which m-th source belongs to. If None, all n_mixtures^n_sources assignments are used.
+    Returns:
+        loss (batch_size,): minimum loss for each data
+        pattern (batch_size, n_sources): assignment indices
+    """
+    if patterns is None:
+        if n_mixtures is None:
+            n_mixtures = target.size(1)
+        n_sources = input.size(1)
+        patterns = build_assignments(n_sources, n_mixtures)
+
+    with torch.no_grad():
+        possible_loss = assignment_loss(criterion, input, target, patterns) # (batch_size, P)
+
+        if hasattr(criterion, "maximize") and criterion.maximize:
+            indices = torch.argmax(possible_loss, dim=1) # (batch_size,)
+        else:
+            indices = torch.argmin(possible_loss, dim=1) # (batch_size,)
+
+    pattern = patterns.to(indices.device)[indices] # (batch_size, n_sources)
+
+    # Loss of chosen assignment is evaluated again with gradient, which does not keep graph of all assignments.
+    loss = _remix_loss(criterion, input, target, pattern.unsqueeze(dim=1)).squeeze(dim=1)
+
+    if batch_mean:
+        loss = loss.mean(dim=0)
+
+    return loss, pattern
+
+def greedy_mixit(criterion, input, target, n_mixtures=None, iteration=None, batch_mean=True):
+    """
+    Approximate mixture invariant training by greedy search, whose cost increases linearly with n_sources.
+    Starting from assignment of each source to the most correlated mixture, every move of one source to other mixture is scored by one criterion call, and the best move is taken until no move decreases loss.
+    Args:
+        criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called.
+        input (batch_size, n_sources, *): Estimated sources
+        target (batch_size, n_mixtures, *): Mixtures
+        iteration <int>: Maximum number of moves. If None, n_sources is used.
+    Returns:
+        loss (batch_size,): loss for each data
+        pattern (batch_size, n_sources): assignment indices
+    """
+    if n_mixtures is None:
+        n_mixtures = target.size(1)
+
+    batch_size, n_sources = input.size()[:2]
+
+    if iteration is None:
+        iteration = n_sources
+
+    maximize = hasattr(criterion, "maximize") and criterion.maximize
+
+    with torch.no_grad():
+        _input, _target = input.reshape(batch_size, n_sources, -1), target.reshape(batch_size, n_mixtures, -1)
+        _target = _target / (torch.linalg.vector_norm(_target, dim=2, keepdim=True) + 1e-12)
+        correlation = torch.bmm(_input, _target.transpose(1, 2)) # (batch_size, n_sources, n_mixtures)
+        pattern = torch.argmax(correlation, dim=2) # (batch_size, n_sources)
+
+        loss = _remix_loss(criterion, input, target, pattern.unsqueeze(dim=1)).squeeze(dim=1) # (batch_size,)
+
+        source_indices = torch.arange(n_sources, device=pattern.device)
+        mixture_indices = torch.arange(n_mixtures, device=pattern.device)
+
+        for _ in range(iteration):
+            # candidates[:, m * n_mixtures + n] moves m-th source to n-th mixture.
+            candidates = pattern.unsqueeze(dim=1).unsqueeze(dim=1).repeat(1, n_sources, n_mixtures, 1) # (batch_size, n_sources, n_mixtures, n_sources)
+            is_moved = source_indices.view(n_sources, 1, 1) == source_indices.view(1, 1, n_sources)
+            candidates = torch.where(is_moved, mixture_indices.view(1, 1, n_mixtures, 1), candidates)
+            candidates = candidates.view(batch_size, n_sources * n_mixtures, n_sources)
+
+            possible_loss = _remix_loss(criterion, input, target, candidates) # (batch_size, n_sources * n_mixtures)
+
+            if maximize:
+                best_loss, indices = torch.max(possible_loss, dim=1)
+                is_improved = best_loss > loss
+            else:
+                best_loss, indices = torch.min(possible_loss, dim=1)
+                is_improved = best_loss < loss
+
+            if not torch.any(is_improved):
+                break
+
+            best_pattern = candidates[torch.arange(batch_size, device=candidates.device), indices]
+            pattern = torch.where(is_improved.unsqueeze(dim=1), best_pattern, pattern)
+            loss = torch.where(is_improved, best_loss, loss)
+
+    loss = _remix_loss(criterion, input, target, pattern.unsqueeze(dim=1)).squeeze(dim=1)
+
+    if batch_mean:
+        loss = loss.mean(dim=0)
+
+    return loss, pattern
+
+def build_assignments(n_sources, n_mixtures=2):
+    """
+    Args:
+        n_sources <int>: Number of estimated sources
+        n_mixtures <int>: Number of mixtures
+    Returns:
+        patterns (n_mixtures^n_sources, n_sources) <torch.LongTensor>: All assignments of sources to mixtures
+    """
+    patterns = list(itertools.product(range(n_mixtures), repeat=n_sources))
+    patterns = torch.Tensor(patterns).long()
+
+    return patterns
+
+def assignment_loss(criterion, input, target, patterns):
+    """
+    Args:
+        criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called.
+        input (batch_size, n_sources, *): Estimated sources
+        target (batch_size, n_mixtures, *): Mixtures
+        patterns (P, n_sources) <torch.LongTensor>: Candidates of assignment
+    Returns:
+        loss (batch_size, P): Loss of each assignment
+    """
+    batch_size = input.size(0)
+    patterns = patterns.to(input.device)
+    patterns = patterns.unsqueeze(dim=0).expand(batch_size, -1, -1)
+
+    return _remix_loss(criterion, input, target, patterns)
+
+def _remix_loss(criterion, input, target, patterns):
+    """
+    Args:
+        input (batch_size, n_sources, *)
+        target (batch_size, n_mixtures, *)
+        patterns (batch_size, P, n_sources)
+    Returns:
+        loss (batch_size, P)
+    """
+    batch_size, n_sources = input.size()[:2]
+    n_mixtures = target.size(1)
+    data_size = target.size()[2:]
+    P = patterns.size(1)
+
+    mixing_matrix = F.one_hot(patterns, num_classes=n_mixtures).transpose(2, 3).to(input.dtype) # (batch_size, P, n_mixtures, n_sources)
+    remix = torch.matmul(mixing_matrix, input.reshape(batch_size, 1, n_sources, -1)) # (batch_size, P, n_mixtures, prod(data_size))
+    remix = remix.view(batch_size * P, n_mixtures, *data_size)
+
+    target = target.unsqueeze(dim=1).expand(-1, P, *([-1] * (target.dim() - 1)))
+    target = target.reshape(batch_size * P, n_mixtures, *data_size)
+
+    loss = criterion(remix, target, batch_mean=False)
+    loss = loss.view(batch_size, P)
+
+    return loss
+
+class MixIT(nn.Module):
+    def __init__(self, criterion, n_sources, n_mixtures=2, greedy=False, iteration=None):
+        """
+        Args:
+            criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called, e.g. NegSISDR.
+            n_sources <int>: Number of estimated sources
+            n_mixtures <int>: Number of mixtures
+            greedy <bool>: If True, assignment is searched greedily, which is recommended for large n_sources.
+            iteration <int>: Maximum number of moves in greedy search. If None, n_sources is used.
+        """
+        super().__init__()
+
+        self.criterion = criterion
+        self.n_sources, self.n_mixtures = n_sources, n_mixtures
+        self.greedy = greedy
+        self.iteration = iteration
+
+        if not self.greedy:
+            self.register_buffer('patterns', build_assignments(n_sources, n_mixtures=n_mixtures), persistent=False)
+
+    def forward(self, input, target, batch_mean=True):
+        """
+        Args:
+            input (batch_size, n_sources, *): Estimated sources
+            target (batch_size, n_mixtures, *): Mixtures
+        Returns:
+            loss (batch_size,): minimum loss for each data
+            pattern (batch_size, n_sources): assignment indices
+        """
+        if self.greedy:
+            loss, pattern = greedy_mixit(self.criterion, input, target, n_mixtures=self.n_mixtures, iteration=self.iteration, batch_mean=batch_mean)
+        else:
+            loss, pattern = mixit(self.criterion, input, target, patterns=self.patterns, batch_mean=batch_mean)
+
+        return loss, pattern
+
+def _test_mixit():
+    torch.manual_seed(111)
+
+    batch_size, M, T = 4, 4, 1024
+    sources = torch.randn(batch_size, M, T)
+    assignment = torch.randint(2, (batch_size, M))
+    mixing_matrix = F.one_hot(assignment, num_classes=2).transpose(1, 2).float()
+    target = torch.bmm(mixing_matrix, sources) # (batch_size, 2, T)
+    input = sources + 0.1 * torch.randn(batch_size, M, T)
+
+    print('-'*10, "Negative SI-SDR (exhaustive)", '-'*10)
+    criterion = NegSISDR()
+    mixit_criterion = MixIT(criterion, n_sources=M)
+    loss, pattern = mixit_criterion(input, target, batch_mean=False)
+
+    print(loss)
+    print(pattern)
+    print(assignment)
+    print()
+
+    print('-'*10, "Negative SI-SDR (greedy)", '-'*10)
+    mixit_criterion = MixIT(criterion, n_sources=M, greedy=True)
+    loss, pattern = mixit_criterion(input, target, batch_mean=False)
+
+    print(loss)
+    print(pattern)
+    print()
+
+if __name__ == '__main__':
+    from criterion.sdr import NegSISDR
+
+    print('='*10, "Mixture invariant training", '='*10)
+    _test_mixit()
@@ -22,15 +22,23 @@ def pit(criterion, input, target, n_sources=None, patterns=None, batch_mean=True
         patterns = list(itertools.permutations(range(n_sources)))
         patterns = torch.Tensor(patterns).long()
     
-    P = len(patterns)
-    possible_loss = []
-    
-    for idx in range(P):
-        pattern = patterns[idx]
-        loss = criterion(input, target[:, pattern], batch_mean=False)
-        possible_loss.append(loss)
-    
-    possible_loss = torch.stack(possible_loss, dim=1)
+    n_sources = patterns.size(1)
+
+    if is_separable(criterion) and input.size(1) == n_sources and target.size(1) == n_sources:
+        # Loss of each permutation is gathered from n_sources x n_sources pairwise losses instead of evaluating criterion n_sources! times.
+        # Input broadcast over sources (e.g. mixture as baseline, (batch_size, 1, *)) is evaluated permutation by permutation.
+        possible_loss = pairwise_loss(criterion, input, target, n_sources=n_sources, keepdim=True) # (batch_size, n_sources, n_sources)
+        possible_loss = permutation_loss(possible_loss, patterns, reduction=criterion.reduction) # (batch_size, P)
+    else:
+        P = len(patterns)
+        possible_loss = []
+        
+        for idx in range(P):
+            pattern = patterns[idx]
+            loss = criterion(input, target[:, pattern], batch_mean=False)
+            possible_loss.append(loss)
+        
+        possible_loss = torch.stack(possible_loss, dim=1)
     
     # possible_loss (batch_size, P)
     if hasattr(criterion, "maximize") and criterion.maximize:
@@ -43,6 +51,39 @@ def pit(criterion, input, target, n_sources=None, patterns=None, batch_mean=True
          
     return loss, patterns[indices]
 
+def is_separable(criterion):
+    """
+    Criterion is separable if its loss is mean or sum of losses of sources, e.g. SI-SDR with reduction='mean'.
+    Such criterion is expected to have `separable` property and `reduction` attribute.
+    Returns:
+        separable <bool>
+    """
+    return hasattr(criterion, "separable") and criterion.separable
+
+def permutation_loss(possible_loss, patterns, reduction='mean'):
+    """
+    Args:
+        possible_loss (batch_size, n_sources, n_sources): possible_loss[:, i, j] is loss between i-th input and j-th target.
+        patterns (P, n_sources) <torch.LongTensor>: Permutations
+        reduction <str>: Reduction over sources, 'mean' or 'sum'.
+    Returns:
+        loss (batch_size, P): Loss of each permutation
+    """
+    n_sources = patterns.size(1)
+    patterns = patterns.to(possible_loss.device)
+    source_indices = torch.arange(n_sources, device=possible_loss.device)
+
+    loss = possible_loss[:, source_indices, patterns] # (batch_size, P, n_sources)
+
+    if reduction == 'mean':
+        loss = loss.mean(dim=2)
+    elif reduction == 'sum':
+        loss = loss.sum(dim=2)
+    else:
+        raise ValueError("Invalid reduction type")
+
+    return loss
+
 class PIT(nn.Module):
     def __init__(self, criterion, n_sources):
         """
@@ -53,7 +94,7 @@ class PIT(nn.Module):
 
         self.criterion = criterion
         patterns = list(itertools.permutations(range(n_sources)))
-        self.patterns = torch.Tensor(patterns).long()
+        self.register_buffer('patterns', torch.Tensor(patterns).long(), persistent=False)
     
     def forward(self, input, target, batch_mean=True):
         """
@@ -84,11 +125,47 @@ class PIT2d(PIT):
         """
         super().__init__(criterion, n_sources)
 
+def pit_by_length(pit_criterion, input, target, lengths=None):
+    """
+    PIT for zero-padded batch. Examples of same length are evaluated together on their own samples, so losses are identical to those computed one by one.
+    Args:
+        pit_criterion <callable>: e.g. PIT1d, which is expected acceptable (input, target, batch_mean) when called.
+        input (batch_size, n_sources, *, T)
+        target (batch_size, n_sources, *, T)
+        lengths (batch_size,) <torch.LongTensor>: Number of valid samples of each example. If None, all samples are valid.
+    Returns:
+        loss (batch_size,): minimum loss for each data
+        pattern (batch_size, n_sources): permutation indices
+    """
+    if lengths is None:
+        return pit_criterion(input, target, batch_mean=False)
+    
+    batch_size = input.size(0)
+    loss, pattern = None, None
+
+    for length in torch.unique(lengths).tolist():
+        indices = torch.nonzero(lengths == length).squeeze(dim=1)
+        _loss, _pattern = pit_criterion(input[indices.to(input.device), ..., :length], target[indices.to(target.device), ..., :length], batch_mean=False)
+
+        if loss is None:
+            loss = _loss.new_zeros(batch_size)
+            pattern = _pattern.new_zeros(batch_size, *_pattern.size()[1:])
+        
+        loss[indices.to(loss.device)] = _loss
+        pattern[indices.to(pattern.device)] = _pattern
+    
+    return loss, pattern
+
 class ORPIT(nn.Module):
     """
     One-and-Rest permutation invariant training
     """
-    def __init__(self, criterion):
+    def __init__(self, criterion, n_sources=None):
+        """
+        Args:
+            criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called.
+            n_sources <int>: Not used. The number of sources is given by target.
+        """
         super().__init__()
 
         self.criterion = criterion
@@ -111,66 +188,78 @@ class ORPIT(nn.Module):
 
         if type(target) is torch.Tensor:
             batch_size = target.size(0)
-            lens_unpacked = [target.size(1)] * batch_size
+            lens_unpacked = torch.full((batch_size,), target.size(1), dtype=torch.long)
         else:
             target, lens_unpacked = nn.utils.rnn.pad_packed_sequence(target, batch_first=True)
 
-        # TODO: batch process
+        batch_size, max_n_sources = target.size()[:2]
+        data_size = target.size()[2:]
 
-        batch_size = input.size(0)
-        batch_loss, batch_indices = None, None
+        n_sources = lens_unpacked.to(target.device) # (batch_size,)
+        source_indices = torch.arange(max_n_sources, device=target.device)
+        is_valid = source_indices < n_sources.unsqueeze(dim=1) # (batch_size, max_n_sources)
+        mask = is_valid.view(batch_size, max_n_sources, *([1] * len(data_size))).to(target.dtype)
 
-        for batch_idx in range(batch_size):
-            n_sources = lens_unpacked[batch_idx] # <int>
-            _input, _target = input[batch_idx: batch_idx + 1], target[batch_idx: batch_idx + 1, : n_sources] # (1, 2, *), (1, n_sources, *)
-            input_one, input_rest = torch.unbind(_input, dim=1) # (1, *), (1, *)
+        # Every source is tried as 'one', and sum of others is 'rest'.
+        target_one = mask * target # (batch_size, max_n_sources, *)
+        target_rest = torch.sum(target_one, dim=1, keepdim=True) - target_one # (batch_size, max_n_sources, *)
 
-            possible_loss = None
-    
-            for idx in range(n_sources):
-                mask_one = torch.zeros_like(_target)
-                mask_one[:, idx] = 1.0
-                mask_rest = torch.ones_like(_target) - mask_one
-                target_one = torch.sum(mask_one * _target, dim=1) # (1, *)
-                target_rest = torch.sum(mask_rest * _target, dim=1) # (1, *)
-                
-                loss_one = criterion(input_one, target_one, batch_mean=False)
-                loss_rest = criterion(input_rest, target_rest, batch_mean=False)
-                loss = loss_one + loss_rest / (n_sources - 1)
-
-                if possible_loss is None:
-                    possible_loss = loss
-                else:
-                    possible_loss = torch.cat([possible_loss, loss], dim=0)
-            
-            if hasattr(criterion, "maximize") and criterion.maximize:
-                loss, indices = torch.max(possible_loss, dim=0, keepdim=True) # loss (1,), indices (1,)
-            else:
-                loss, indices = torch.min(possible_loss, dim=0, keepdim=True) # loss (1,), indices (1,)
-            
-            if batch_loss is None:
-                batch_loss = loss
-                batch_indices = indices
-            else:
-                batch_loss = torch.cat([batch_loss, loss], dim=0)
-                batch_indices = torch.cat([batch_indices, indices], dim=0)
+        input_one, input_rest = torch.unbind(input, dim=1) # (batch_size, *), (batch_size, *)
+        input_one = input_one.unsqueeze(dim=1).expand(-1, max_n_sources, *([-1] * len(data_size)))
+        input_rest = input_rest.unsqueeze(dim=1).expand(-1, max_n_sources, *([-1] * len(data_size)))
+
+        # Losses of 'one' and 'rest' for all candidates are computed by one criterion call.
+        _input = torch.stack([input_one, input_rest], dim=0).reshape(2 * batch_size * max_n_sources, *data_size)
+        _target = torch.stack([target_one, target_rest], dim=0).reshape(2 * batch_size * max_n_sources, *data_size)
+        loss_one, loss_rest = criterion(_input, _target, batch_mean=False).view(2, batch_size, max_n_sources)
+
+        possible_loss = loss_one + loss_rest / (n_sources.unsqueeze(dim=1) - 1).to(loss_rest.dtype) # (batch_size, max_n_sources)
+
+        if hasattr(criterion, "maximize") and criterion.maximize:
+            possible_loss = possible_loss.masked_fill(torch.logical_not(is_valid), float('-inf'))
+            batch_loss, batch_indices = torch.max(possible_loss, dim=1) # (batch_size,), (batch_size,)
+        else:
+            possible_loss = possible_loss.masked_fill(torch.logical_not(is_valid), float('inf'))
+            batch_loss, batch_indices = torch.min(possible_loss, dim=1) # (batch_size,), (batch_size,)
          
         if batch_mean:
             batch_loss = batch_loss.mean(dim=0)
             
         return batch_loss, batch_indices
 
-def sinkpit(criterion, input, target, n_sources=None, coldness=1e+0, iteration=10, batch_mean=True):    
+def pairwise_loss(criterion, input, target, n_sources=None, keepdim=False):
+    """
+    Evaluates criterion between every pair of estimated and target sources in one call.
+    Args:
+        criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called.
+        input (batch_size, n_sources, *)
+        target (batch_size, n_sources, *)
+        keepdim <bool>: If True, each pair is given to criterion as (batch_size * n_sources * n_sources, 1, *), so dimensions of separable criterion are kept as they are.
+    Returns:
+        loss (batch_size, n_sources, n_sources): loss[:, i, j] is criterion between input[:, i] and target[:, j].
+    """
     if n_sources is None:
         n_sources = input.size(1)
 
     batch_size = input.size(0)
 
     input_size, target_size = input.size()[2:], target.size()[2:]
-    input, target = input.unsqueeze(dim=2).expand(-1, -1, n_sources, -1).contiguous(), target.unsqueeze(dim=1).expand(-1, n_sources, -1, -1).contiguous()
-    input, target = input.view(batch_size * n_sources * n_sources, *input_size), target.view(batch_size * n_sources * n_sources, *target_size)
-    possible_loss = criterion(input, target, batch_mean=False)
-    possible_loss = possible_loss.view(batch_size, n_sources, n_sources)
+    input, target = input.unsqueeze(dim=2).expand(-1, -1, n_sources, *input_size), target.unsqueeze(dim=1).expand(-1, n_sources, -1, *target_size)
+    input, target = input.reshape(batch_size * n_sources * n_sources, *input_size), target.reshape(batch_size * n_sources * n_sources, *target_size)
+
+    if keepdim:
+        input, target = input.unsqueeze(dim=1), target.unsqueeze(dim=1)
+
+    loss = criterion(input, target, batch_mean=False)
+    loss = loss.view(batch_size, n_sources, n_sources)
+
+    return loss
+
+def sinkpit(criterion, input, target, n_sources=None, coldness=1e+0, iteration=10, batch_mean=True):    
+    if n_sources is None:
+        n_sources = input.size(1)
+
+    possible_loss = pairwise_loss(criterion, input, target, n_sources=n_sources)
 
     if hasattr(criterion, "maximize") and criterion.maximize:
         possible_loss = - possible_loss
@@ -263,6 +352,51 @@ def _test_pit():
     
     print(loss)
     print(pattern)
+    print()
+
+    print('-'*10, "Negative SI-SDR (pairwise vs. exhaustive)", '-'*10)
+    batch_size, C, T = 4, 3, 1024
+    input, target = torch.randn(batch_size, C, T), torch.randn(batch_size, C, T)
+    criterion = NegSISDR()
+
+    def exhaustive_criterion(input, target, batch_mean=True):
+        # Same as `criterion`, but not regarded as separable.
+        return criterion(input, target, batch_mean=batch_mean)
+
+    loss, pattern = pit(criterion, input, target, batch_mean=False)
+    exhaustive_loss, exhaustive_pattern = pit(exhaustive_criterion, input, target, batch_mean=False)
+
+    print(torch.allclose(loss, exhaustive_loss, atol=1e-5), torch.equal(pattern, exhaustive_pattern))
+    print()
+
+    print('-'*10, "L1 loss (pairwise vs. exhaustive)", '-'*10)
+    batch_size, C, F_bin, T_bin = 4, 3, 16, 32
+    input, target = torch.randn(batch_size, C, F_bin, T_bin), torch.randn(batch_size, C, F_bin, T_bin)
+    criterion = L1Loss(dim=(2,3), reduction='mean')
+
+    def exhaustive_criterion(input, target, batch_mean=True):
+        # Same as `criterion`, but not regarded as separable.
+        return criterion(input, target, batch_mean=batch_mean)
+
+    loss, pattern = pit(criterion, input, target, batch_mean=False)
+    exhaustive_loss, exhaustive_pattern = pit(exhaustive_criterion, input, target, batch_mean=False)
+
+    print(is_separable(criterion), torch.allclose(loss, exhaustive_loss, atol=1e-5), torch.equal(pattern, exhaustive_pattern))
+    print()
+
+    print('-'*10, "Negative SI-SDR (broadcast mixture)", '-'*10)
+    batch_size, C, T = 4, 2, 1024
+    target = torch.randn(batch_size, C, T)
+    mixture = target.sum(dim=1, keepdim=True)
+    criterion = NegSISDR()
+    pit_criterion = PIT1d(criterion, n_sources=C)
+
+    loss, _ = pit_criterion(mixture, target, batch_mean=False)
+    expected_loss = criterion(mixture, target, batch_mean=False)
+    lengths = torch.Tensor([T, T // 2, T, T // 2]).long()
+    loss_by_length, _ = pit_by_length(pit_criterion, mixture, target, lengths=lengths)
+
+    print(loss.size(), torch.allclose(loss, expected_loss), loss_by_length.size())
 
 def _test_orpit():
     torch.manual_seed(111)
@@ -1,8 +1,11 @@
 import torch
 import torch.nn as nn
 
+from utils.mixed_precision import float32
+
 EPS = 1e-12
 
+@float32
 def sdr(input, target, eps=EPS):
     """
     Source-to-distortion ratio (SDR)
@@ -66,6 +69,10 @@ class SDR(nn.Module):
     @property
     def maximize(self):
         return True
+
+    @property
+    def separable(self):
+        return self.reduction in ['mean', 'sum']
         
 class NegSDR(nn.Module):
     def __init__(self, reduction='mean', eps=EPS):
@@ -113,12 +120,17 @@ class NegSDR(nn.Module):
     def maximize(self):
         return False
 
+    @property
+    def separable(self):
+        return self.reduction in ['mean', 'sum']
+
 """
     Scale-invariant-SDR (source-to-distortion ratio)
     See "SDR - half-baked or well done?"
     https://arxiv.org/abs/1811.02508
 """
 
+@float32
 def sisdr(input, target, eps=EPS):
     """
     Scale-invariant-SDR (source-to-distortion ratio)
@@ -184,6 +196,10 @@ class SISDR(nn.Module):
     def maximize(self):
         return True
 
+    @property
+    def separable(self):
+        return self.reduction in ['mean', 'sum']
+
 class NegSISDR(nn.Module):
     def __init__(self, reduction='mean', eps=EPS):
         super().__init__()
@@ -230,6 +246,10 @@ class NegSISDR(nn.Module):
     def maximize(self):
         return False
 
+    @property
+    def separable(self):
+        return self.reduction in ['mean', 'sum']
+
 class ClippedSISDR(nn.Module):
     def __init__(self, max=None, reduction='mean', eps=EPS):
         super().__init__()
@@ -278,6 +298,10 @@ class ClippedSISDR(nn.Module):
     def maximize(self):
         return True
 
+    @property
+    def separable(self):
+        return self.reduction in ['mean', 'sum']
+
 class ClippedNegSISDR(nn.Module):
     def __init__(self, min=None, reduction='mean', eps=EPS):
         super().__init__()
@@ -326,10 +350,15 @@ class ClippedNegSISDR(nn.Module):
     def maximize(self):
         return False
 
+    @property
+    def separable(self):
+        return self.reduction in ['mean', 'sum']
+
 """
     Weighted SDR (signal-to-distortion ratio)
     See "Phase-Aware Speech Enhancement with Deep Complex U-Net"
 """
+@float32
 def weighted_sdr(input, target, source_dim=1, eps=EPS):
     """
     Args:
@@ -60,6 +60,7 @@ class ConvTasNet(nn.Module):
         sep_nonlinear='prelu', sep_norm=True, mask_nonlinear='sigmoid',
         causal=True,
         n_sources=2,
+        gradient_checkpointing=False,
         eps=EPS,
         **kwargs
     ):
@@ -98,6 +99,7 @@ class ConvTasNet(nn.Module):
         self.mask_nonlinear = mask_nonlinear
         
         self.n_sources = n_sources
+        self.gradient_checkpointing = gradient_checkpointing
         self.eps = eps
         
         # Network configuration
@@ -108,7 +110,7 @@ class ConvTasNet(nn.Module):
             n_basis, bottleneck_channels=sep_bottleneck_channels, hidden_channels=sep_hidden_channels, skip_channels=sep_skip_channels,
             kernel_size=sep_kernel_size, num_blocks=sep_num_blocks, num_layers=sep_num_layers,
             dilated=dilated, separable=separable, causal=causal, nonlinear=sep_nonlinear, norm=sep_norm, mask_nonlinear=mask_nonlinear,
-            n_sources=n_sources, eps=eps
+            n_sources=n_sources, gradient_checkpointing=gradient_checkpointing, eps=eps
         )
         self.decoder = decoder
     
@@ -194,6 +196,7 @@ class ConvTasNet(nn.Module):
             'sep_norm': self.sep_norm,
             'mask_nonlinear': self.mask_nonlinear,
             'n_sources': self.n_sources,
+            'gradient_checkpointing': self.gradient_checkpointing,
             'eps': self.eps
         }
         
@@ -223,6 +226,7 @@ class ConvTasNet(nn.Module):
         mask_nonlinear = config['mask_nonlinear']
         
         n_sources = config['n_sources']
+        gradient_checkpointing = config.get('gradient_checkpointing') or False
         
         eps = config['eps']
         
@@ -233,6 +237,7 @@ class ConvTasNet(nn.Module):
             sep_kernel_size=sep_kernel_size, sep_num_blocks=sep_num_blocks, sep_num_layers=sep_num_layers,
             dilated=dilated, separable=separable, causal=causal, sep_nonlinear=sep_nonlinear, sep_norm=sep_norm, mask_nonlinear=mask_nonlinear,
             n_sources=n_sources,
+            gradient_checkpointing=gradient_checkpointing,
             eps=eps
         )
 
@@ -309,6 +314,7 @@ class Separator(nn.Module):
         self, num_features, bottleneck_channels=128, hidden_channels=256, skip_channels=128, kernel_size=3, num_blocks=3, num_layers=8,
         dilated=True, separable=True, causal=True, nonlinear='prelu', norm=True, mask_nonlinear='sigmoid',
         n_sources=2,
+        gradient_checkpointing=False,
         eps=EPS
     ):
         super().__init__()
@@ -320,7 +326,8 @@ class Separator(nn.Module):
         self.bottleneck_conv1d = nn.Conv1d(num_features, bottleneck_channels, kernel_size=1, stride=1)
         self.tdcn = TimeDilatedConvNet(
             bottleneck_channels, hidden_channels=hidden_channels, skip_channels=skip_channels, kernel_size=kernel_size, num_blocks=num_blocks, num_layers=num_layers,
-            dilated=dilated, separable=separable, causal=causal, nonlinear=nonlinear, norm=norm
+            dilated=dilated, separable=separable, causal=causal, nonlinear=nonlinear, norm=norm,
+            gradient_checkpointing=gradient_checkpointing
         )
         self.prelu = nn.PReLU()
         self.mask_conv1d = nn.Conv1d(skip_channels, n_sources*num_features, kernel_size=1, stride=1)
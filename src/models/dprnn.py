@@ -1,15 +1,17 @@
 import torch
 import torch.nn as nn
 
-from utils.model import choose_rnn
+from utils.model import choose_rnn, checkpoint_forward
 from utils.tasnet import choose_layer_norm
 
 EPS = 1e-12
 
 class DPRNN(nn.Module):
-    def __init__(self, num_features, hidden_channels, num_blocks=6, norm=True, causal=False, rnn_type='lstm', eps=EPS):
+    def __init__(self, num_features, hidden_channels, num_blocks=6, norm=True, causal=False, rnn_type='lstm', gradient_checkpointing=False, eps=EPS):
         super().__init__()
         
+        self.gradient_checkpointing = gradient_checkpointing
+        
         # Network confguration
         net = []
         
@@ -25,7 +27,14 @@ class DPRNN(nn.Module):
         Returns:
             output (batch_size, num_features, S, chunk_size)
         """
-        output = self.net(input)
+        gradient_checkpointing = self.gradient_checkpointing
+
+        x = input
+
+        for block in self.net:
+            x = checkpoint_forward(block, x, enabled=gradient_checkpointing and self.training)
+
+        output = x
 
         return output
 
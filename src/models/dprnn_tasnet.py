@@ -40,6 +40,7 @@ class DPRNNTasNet(nn.Module):
         causal=True,
         rnn_type='lstm',
         n_sources=2,
+        gradient_checkpointing=False,
         eps=EPS,
         **kwargs
     ):
@@ -79,6 +80,7 @@ class DPRNNTasNet(nn.Module):
         self.rnn_type = rnn_type
         
         self.n_sources = n_sources
+        self.gradient_checkpointing = gradient_checkpointing
         self.eps = eps
         
         # Network configuration
@@ -92,6 +94,7 @@ class DPRNNTasNet(nn.Module):
             causal=causal,
             rnn_type=rnn_type,
             n_sources=n_sources,
+            gradient_checkpointing=gradient_checkpointing,
             eps=eps
         )
         self.decoder = decoder
@@ -175,6 +178,7 @@ class DPRNNTasNet(nn.Module):
             'mask_nonlinear': self.mask_nonlinear,
             'rnn_type': self.rnn_type,
             'n_sources': self.n_sources,
+            'gradient_checkpointing': self.gradient_checkpointing,
             'eps': self.eps
         }
     
@@ -202,6 +206,7 @@ class DPRNNTasNet(nn.Module):
         causal = config['causal']
         rnn_type = config.get('rnn_type') or 'lstm'
         n_sources = config['n_sources']
+        gradient_checkpointing = config.get('gradient_checkpointing') or False
         
         eps = config['eps']
         
@@ -215,6 +220,7 @@ class DPRNNTasNet(nn.Module):
             causal=causal,
             rnn_type=rnn_type,
             n_sources=n_sources,
+            gradient_checkpointing=gradient_checkpointing,
             eps=eps
         )
         
@@ -282,6 +288,7 @@ class Separator(nn.Module):
         causal=True,
         rnn_type='lstm',
         n_sources=2,
+        gradient_checkpointing=False,
         eps=EPS
     ):
         super().__init__()
@@ -295,7 +302,7 @@ class Separator(nn.Module):
         self.bottleneck_conv1d = nn.Conv1d(num_features, bottleneck_channels, kernel_size=1, stride=1)
         
         self.segment1d = Segment1d(chunk_size, hop_size)
-        self.dprnn = DPRNN(bottleneck_channels, hidden_channels, num_blocks=num_blocks, causal=causal, norm=norm, rnn_type=rnn_type, eps=eps)
+        self.dprnn = DPRNN(bottleneck_channels, hidden_channels, num_blocks=num_blocks, causal=causal, norm=norm, rnn_type=rnn_type, gradient_checkpointing=gradient_checkpointing, eps=eps)
         self.overlap_add1d = OverlapAdd1d(chunk_size, hop_size)
         
         self.prelu = nn.PReLU()
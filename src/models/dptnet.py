@@ -3,7 +3,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from utils.filterbank import choose_filterbank
-from utils.model import choose_rnn, choose_nonlinear
+from utils.model import choose_rnn, choose_nonlinear, checkpoint_forward
 from utils.tasnet import choose_layer_norm
 from models.gtu import GTU1d
 from models.dprnn_tasnet import Segment1d, OverlapAdd1d
@@ -37,6 +37,7 @@ class DPTNet(nn.Module):
         mask_nonlinear='relu',
         causal=False,
         n_sources=2,
+        gradient_checkpointing=False,
         eps=EPS,
         **kwargs
     ):
@@ -81,6 +82,7 @@ class DPTNet(nn.Module):
         self.mask_nonlinear = mask_nonlinear
         
         self.n_sources = n_sources
+        self.gradient_checkpointing = gradient_checkpointing
         self.eps = eps
         
         # Network configuration
@@ -94,6 +96,7 @@ class DPTNet(nn.Module):
             mask_nonlinear=mask_nonlinear,
             causal=causal,
             n_sources=n_sources,
+            gradient_checkpointing=gradient_checkpointing,
             eps=eps
         )
         self.decoder = decoder
@@ -167,6 +170,7 @@ class DPTNet(nn.Module):
             'mask_nonlinear': self.mask_nonlinear,
             'causal': self.causal,
             'n_sources': self.n_sources,
+            'gradient_checkpointing': self.gradient_checkpointing,
             'eps': self.eps
         }
     
@@ -194,6 +198,7 @@ class DPTNet(nn.Module):
 
         causal = config['causal']
         n_sources = config['n_sources']
+        gradient_checkpointing = config.get('gradient_checkpointing') or False
         
         eps = config['eps']
 
@@ -208,6 +213,7 @@ class DPTNet(nn.Module):
             mask_nonlinear=mask_nonlinear,
             causal=causal,
             n_sources=n_sources,
+            gradient_checkpointing=gradient_checkpointing,
             eps=eps
         )
         
@@ -268,6 +274,7 @@ class Separator(nn.Module):
         mask_nonlinear='relu',
         causal=True,
         n_sources=2,
+        gradient_checkpointing=False,
         eps=EPS
     ):
         super().__init__()
@@ -288,7 +295,9 @@ class Separator(nn.Module):
             bottleneck_channels, hidden_channels,
             num_blocks=num_blocks, num_heads=num_heads,
             norm=norm, nonlinear=nonlinear, dropout=dropout,
-            causal=causal, eps=eps
+            causal=causal,
+            gradient_checkpointing=gradient_checkpointing,
+            eps=eps
         )
         self.overlap_add1d = OverlapAdd1d(chunk_size, hop_size)
         self.prelu = nn.PReLU()
@@ -338,9 +347,11 @@ class Separator(nn.Module):
         return output
 
 class DualPathTransformer(nn.Module):
-    def __init__(self, num_features, hidden_channels, num_blocks=6, num_heads=4, norm=True, nonlinear='relu', dropout=0, causal=False, eps=EPS):
+    def __init__(self, num_features, hidden_channels, num_blocks=6, num_heads=4, norm=True, nonlinear='relu', dropout=0, causal=False, gradient_checkpointing=False, eps=EPS):
         super().__init__()
         
+        self.gradient_checkpointing = gradient_checkpointing
+        
         # Network confguration
         net = []
         
@@ -356,7 +367,14 @@ class DualPathTransformer(nn.Module):
         Returns:
             output (batch_size, num_features, S, chunk_size)
         """
-        output = self.net(input)
+        gradient_checkpointing = self.gradient_checkpointing
+
+        x = input
+
+        for block in self.net:
+            x = checkpoint_forward(block, x, enabled=gradient_checkpointing and self.training)
+
+        output = x
 
         return output
 
@@ -1,15 +1,18 @@
 import torch
 import torch.nn as nn
 
+from utils.model import checkpoint_forward
 from utils.tasnet import choose_layer_norm
 from models.dprnn import IntraChunkRNN as LocallyRecurrentBlock
 
 EPS = 1e-12
 
 class GALR(nn.Module):
-    def __init__(self, num_features, hidden_channels, num_blocks=6, num_heads=8, norm=True, dropout=1e-1, low_dimension=True, causal=False, eps=EPS, **kwargs):
+    def __init__(self, num_features, hidden_channels, num_blocks=6, num_heads=8, norm=True, dropout=1e-1, low_dimension=True, causal=False, gradient_checkpointing=False, eps=EPS, **kwargs):
         super().__init__()
         
+        self.gradient_checkpointing = gradient_checkpointing
+        
         # Network confguration
         net = []
         
@@ -25,7 +28,14 @@ class GALR(nn.Module):
         Returns:
             output (batch_size, num_features, S, chunk_size)
         """
-        output = self.net(input)
+        gradient_checkpointing = self.gradient_checkpointing
+
+        x = input
+
+        for block in self.net:
+            x = checkpoint_forward(block, x, enabled=gradient_checkpointing and self.training)
+
+        output = x
 
         return output
 
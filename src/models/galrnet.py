@@ -21,6 +21,7 @@ class GALRNet(nn.Module):
         causal=True,
         n_sources=2,
         low_dimension=True,
+        gradient_checkpointing=False,
         eps=EPS,
         **kwargs
     ):
@@ -62,6 +63,7 @@ class GALRNet(nn.Module):
         self.mask_nonlinear = mask_nonlinear
         
         self.n_sources = n_sources
+        self.gradient_checkpointing = gradient_checkpointing
         self.eps = eps
         
         # Network configuration
@@ -75,6 +77,7 @@ class GALRNet(nn.Module):
             low_dimension=low_dimension,
             causal=causal,
             n_sources=n_sources,
+            gradient_checkpointing=gradient_checkpointing,
             eps=eps
         )
         self.decoder = decoder
@@ -150,6 +153,7 @@ class GALRNet(nn.Module):
             'mask_nonlinear': self.mask_nonlinear,
             'causal': self.causal,
             'n_sources': self.n_sources,
+            'gradient_checkpointing': self.gradient_checkpointing,
             'eps': self.eps
         }
     
@@ -173,6 +177,7 @@ class Separator(nn.Module):
         low_dimension=True,
         causal=True,
         n_sources=2,
+        gradient_checkpointing=False,
         eps=EPS
     ):
         super().__init__()
@@ -195,6 +200,7 @@ class Separator(nn.Module):
                 norm=norm, dropout=dropout,
                 low_dimension=low_dimension,
                 causal=causal,
+                gradient_checkpointing=gradient_checkpointing,
                 eps=eps
             )
         else:
@@ -204,6 +210,7 @@ class Separator(nn.Module):
                 norm=norm, dropout=dropout,
                 low_dimension=low_dimension,
                 causal=causal,
+                gradient_checkpointing=gradient_checkpointing,
                 eps=eps
             )
         self.overlap_add1d = OverlapAdd1d(chunk_size, hop_size)
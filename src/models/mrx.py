@@ -4,6 +4,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from utils.utils_audio import build_window
+from utils.mixed_precision import float32
 from utils.model import choose_rnn
 from models.umx import TransformBlock1d
 
@@ -347,6 +348,7 @@ class STFT(nn.Module):
         
         self.window = nn.Parameter(window, requires_grad=False)
     
+    @float32
     def forward(self, input):
         """
         Args:
@@ -378,6 +380,7 @@ class iSTFT(nn.Module):
         
         self.window = nn.Parameter(window, requires_grad=False)
     
+    @float32
     def forward(self, input, length=None):
         """
         Args:
@@ -3,7 +3,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from utils.filterbank import choose_filterbank
-from utils.model import choose_nonlinear
+from utils.model import choose_nonlinear, checkpoint_forward
 from utils.tasnet import choose_layer_norm
 from models.transform import Segment1d, OverlapAdd1d
 from models.transformer import PositionalEncoding
@@ -23,6 +23,7 @@ class SepFormer(nn.Module):
         sep_norm=True, sep_nonlinear='relu', sep_dropout=1e-1, mask_nonlinear='relu',
         causal=True,
         n_sources=2,
+        gradient_checkpointing=False,
         eps=EPS,
         **kwargs
     ):
@@ -68,6 +69,7 @@ class SepFormer(nn.Module):
         self.sep_nonlinear, self.mask_nonlinear = sep_nonlinear, mask_nonlinear
         
         self.n_sources = n_sources
+        self.gradient_checkpointing = gradient_checkpointing
         self.eps = eps
         
         # Network configuration
@@ -83,6 +85,7 @@ class SepFormer(nn.Module):
             norm=sep_norm, nonlinear=sep_nonlinear, dropout=sep_dropout, mask_nonlinear=mask_nonlinear,
             causal=causal,
             n_sources=n_sources,
+            gradient_checkpointing=gradient_checkpointing,
             eps=eps
         )
         self.decoder = decoder
@@ -162,6 +165,7 @@ class SepFormer(nn.Module):
             'sep_norm': self.sep_norm, 'sep_nonlinear': self.sep_nonlinear, 'sep_dropout': self.sep_dropout, 'mask_nonlinear': self.mask_nonlinear,
             'causal': self.causal,
             'n_sources': self.n_sources,
+            'gradient_checkpointing': self.gradient_checkpointing,
             'eps': self.eps
         }
     
@@ -192,6 +196,7 @@ class SepFormer(nn.Module):
 
         causal = config['causal']
         n_sources = config['n_sources']
+        gradient_checkpointing = config.get('gradient_checkpointing') or False
         
         eps = config['eps']
         
@@ -208,6 +213,7 @@ class SepFormer(nn.Module):
             sep_norm=sep_norm, sep_nonlinear=sep_nonlinear, sep_dropout=sep_dropout, mask_nonlinear=mask_nonlinear,
             causal=causal,
             n_sources=n_sources,
+            gradient_checkpointing=gradient_checkpointing,
             eps=eps
         )
         
@@ -241,6 +247,7 @@ class Separator(nn.Module):
         norm=True, nonlinear='relu', dropout=1e-1, mask_nonlinear='relu',
         causal=False,
         n_sources=2,
+        gradient_checkpointing=False,
         eps=EPS
     ):
         super().__init__()
@@ -260,6 +267,7 @@ class Separator(nn.Module):
             d_intra=bottleneck_channels, d_inter=bottleneck_channels, d_ff_intra=d_ff_intra, d_ff_inter=d_ff_inter,
             norm=norm, dropout=dropout, nonlinear=nonlinear,
             causal=causal,
+            gradient_checkpointing=gradient_checkpointing,
             eps=eps
         )
         self.overlap_add1d = OverlapAdd1d(chunk_size, hop_size)
@@ -319,10 +327,13 @@ class SepFormerBackbone(nn.Module):
         num_heads_intra=8, num_heads_inter=8,
         d_intra=256, d_inter=256, d_ff_intra=1024, d_ff_inter=1024,
         norm=True, dropout=1e-1, nonlinear='relu', causal=False,
+        gradient_checkpointing=False,
         eps=EPS
     ):
         super().__init__()
         
+        self.gradient_checkpointing = gradient_checkpointing
+        
         # Network confguration
         net = []
         
@@ -346,7 +357,14 @@ class SepFormerBackbone(nn.Module):
         Returns:
             output (batch_size, num_features, S, chunk_size)
         """
-        output = self.net(input)
+        gradient_checkpointing = self.gradient_checkpointing
+
+        x = input
+
+        for block in self.net:
+            x = checkpoint_forward(block, x, enabled=gradient_checkpointing and self.training)
+
+        output = x
 
         return output
 
@@ -2,6 +2,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from utils.model import checkpoint_forward
 from utils.tasnet import choose_layer_norm
 
 """
@@ -11,10 +12,11 @@ Time dilated convolutional network.
 EPS = 1e-12
 
 class TimeDilatedConvNet(nn.Module):
-    def __init__(self, num_features, hidden_channels=256, skip_channels=256, kernel_size=3, num_blocks=3, num_layers=10, dilated=True, separable=False, causal=True, nonlinear=None, norm=True, eps=EPS):
+    def __init__(self, num_features, hidden_channels=256, skip_channels=256, kernel_size=3, num_blocks=3, num_layers=10, dilated=True, separable=False, causal=True, nonlinear=None, norm=True, gradient_checkpointing=False, eps=EPS):
         super().__init__()
         
         self.num_blocks = num_blocks
+        self.gradient_checkpointing = gradient_checkpointing
         
         net = []
         
@@ -28,12 +30,13 @@ class TimeDilatedConvNet(nn.Module):
         
     def forward(self, input):
         num_blocks = self.num_blocks
+        gradient_checkpointing = self.gradient_checkpointing
         
         x = input
         skip_connection = 0
         
         for idx in range(num_blocks):
-            x, skip = self.net[idx](x)
+            x, skip = checkpoint_forward(self.net[idx], x, enabled=gradient_checkpointing and self.training)
             skip_connection = skip_connection + skip
 
         output = skip_connection
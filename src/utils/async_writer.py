@@ -0,0 +1,242 @@
+import os
+import shutil
+import queue
+import atexit
+import threading
+
+import torch
+import torchaudio
+
+DEFAULT_MAX_PENDING = 2
+DEFAULT_N_AUDIO_WORKERS = 4
+DEFAULT_MAX_PENDING_AUDIO = 32
+
+class AsyncWriter:
+    """
+    Runs jobs (e.g. saving checkpoints or drawing loss curves) on background threads, so that training thread is not blocked by disk I/O.
+    With single worker, jobs are done in submitted order.
+    At most `max_pending` jobs are queued. If queue is full, `submit` waits, which bounds memory held by pending jobs.
+    Exception raised in a job is re-raised in main thread at next `submit`, `wait` or `close`.
+    Pending jobs are finished at `close`, which is also called when interpreter exits.
+    Args:
+        max_pending <int>: Maximum number of queued jobs
+        num_workers <int>: Number of worker threads
+    """
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING, num_workers=1):
+        assert max_pending > 0, "max_pending is expected positive, but given {}.".format(max_pending)
+        assert num_workers > 0, "num_workers is expected positive, but given {}.".format(num_workers)
+
+        self.max_pending = max_pending
+        self.num_workers = num_workers
+
+        self.jobs = None
+        self.threads = None
+        self.exception = None
+
+        atexit.register(self.close)
+
+    def submit(self, function, *args, **kwargs):
+        self._raise_if_failed()
+
+        if self.threads is None:
+            self.jobs = queue.Queue(maxsize=self.max_pending)
+            self.threads = [threading.Thread(target=self._consume, daemon=True) for _ in range(self.num_workers)]
+
+            for thread in self.threads:
+                thread.start()
+
+        self.jobs.put((function, args, kwargs))
+
+    def wait(self):
+        """
+        Blocks until all submitted jobs are done.
+        """
+        if self.threads is not None:
+            self.jobs.join()
+
+        self._raise_if_failed()
+
+    def close(self):
+        if self.threads is not None:
+            self.jobs.join()
+
+            for thread in self.threads:
+                self.jobs.put(_END)
+
+            for thread in self.threads:
+                thread.join()
+
+            self.threads = None
+
+        self._raise_if_failed()
+
+    def _consume(self):
+        while True:
+            item = self.jobs.get()
+
+            if item is _END:
+                self.jobs.task_done()
+                break
+
+            function, args, kwargs = item
+
+            try:
+                if self.exception is None:
+                    function(*args, **kwargs)
+            except Exception as e:
+                self.exception = e
+            finally:
+                self.jobs.task_done()
+
+    def _raise_if_failed(self):
+        if self.exception is not None:
+            exception = self.exception
+            self.exception = None
+            raise exception
+
+class AsyncCheckpointWriter(AsyncWriter):
+    """
+    Saves checkpoints on a background thread.
+    Tensors in checkpoint are copied to CPU at `save`, so training can update parameters and optimizer state while checkpoint is written.
+    Each file is written atomically, i.e. to a temporary file followed by rename, so interrupted training does not leave broken checkpoint.
+    When same checkpoint is saved to several paths (e.g. best.pth and last.pth), it is serialized once and copied.
+    Args:
+        max_pending <int>: Maximum number of checkpoints held in CPU memory waiting for being written
+    """
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING):
+        super().__init__(max_pending=max_pending)
+
+    def save(self, checkpoint, paths):
+        """
+        Args:
+            checkpoint <dict>: Checkpoint passed to `torch.save`
+            paths <str> or <list<str>>: Path(s) to checkpoint
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        else:
+            paths = list(paths)
+
+        checkpoint = snapshot(checkpoint)
+
+        self.submit(_save_checkpoint, checkpoint, paths)
+
+class AsyncAudioWriter(AsyncWriter):
+    """
+    Saves audio (e.g. samples of validation or estimates of test) on a pool of background threads.
+    Normalization and encoding are done by workers, so they overlap with forward pass of next example.
+    Args:
+        sample_rate <int>: Sampling rate
+        bits_per_sample <int>: Bits per sample of saved audio. If None, default of `torchaudio.save` is used.
+        num_workers <int>: Number of worker threads
+        max_pending <int>: Maximum number of signals held in memory waiting for being saved
+    """
+    def __init__(self, sample_rate, bits_per_sample=None, num_workers=DEFAULT_N_AUDIO_WORKERS, max_pending=DEFAULT_MAX_PENDING_AUDIO):
+        super().__init__(max_pending=max_pending, num_workers=num_workers)
+
+        self.sample_rate = sample_rate
+        self.bits_per_sample = bits_per_sample
+
+    def save(self, path, signal, normalize=False):
+        """
+        Args:
+            path <str>: Path to audio file
+            signal <torch.Tensor>: Signal with shape of (T,) or (n_channels, T)
+            normalize <bool>: If True, signal is divided by its maximum absolute value.
+        """
+        signal = snapshot(signal)
+
+        self.submit(_save_audio, path, signal, sample_rate=self.sample_rate, bits_per_sample=self.bits_per_sample, normalize=normalize)
+
+def snapshot(obj):
+    """
+    Copies tensors in nested dict, list and tuple to CPU. Other objects are kept as they are.
+    Args:
+        obj: Object to be copied, e.g. config including state_dict
+    Returns:
+        obj: Copied object
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    elif isinstance(obj, dict):
+        return type(obj)((key, snapshot(value)) for key, value in obj.items())
+    elif isinstance(obj, list):
+        return [snapshot(item) for item in obj]
+    elif isinstance(obj, tuple):
+        return tuple(snapshot(item) for item in obj)
+
+    return obj
+
+def _save_checkpoint(checkpoint, paths):
+    path = paths[0]
+    tmp_path = path + '.tmp'
+
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, path)
+
+    for _path in paths[1:]:
+        tmp_path = _path + '.tmp'
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, _path)
+
+def _save_audio(path, signal, sample_rate, bits_per_sample=None, normalize=False):
+    if normalize:
+        norm = torch.abs(signal).max()
+        signal = signal / norm
+
+    if signal.dim() == 1:
+        signal = signal.unsqueeze(dim=0)
+
+    if bits_per_sample is None:
+        torchaudio.save(path, signal, sample_rate=sample_rate)
+    else:
+        torchaudio.save(path, signal, sample_rate=sample_rate, bits_per_sample=bits_per_sample)
+
+_END = object()
+
+def _test_async_checkpoint_writer():
+    import tempfile
+
+    torch.manual_seed(111)
+
+    model = torch.nn.Linear(4, 2)
+    writer = AsyncCheckpointWriter()
+
+    with tempfile.TemporaryDirectory() as save_dir:
+        best_path, last_path = os.path.join(save_dir, "best.pth"), os.path.join(save_dir, "last.pth")
+        config = {'state_dict': model.state_dict(), 'epoch': 1}
+        writer.save(config, [best_path, last_path])
+
+        with torch.no_grad():
+            model.weight.add_(1)
+
+        writer.close()
+
+        best_config, last_config = torch.load(best_path), torch.load(last_path)
+        print(sorted(os.listdir(save_dir)))
+        print(torch.equal(best_config['state_dict']['weight'], last_config['state_dict']['weight']))
+        print(torch.equal(best_config['state_dict']['weight'] + 1, model.weight))
+
+def _test_async_audio_writer():
+    import tempfile
+
+    torch.manual_seed(111)
+
+    sample_rate = 8000
+    writer = AsyncAudioWriter(sample_rate=sample_rate, bits_per_sample=16)
+
+    with tempfile.TemporaryDirectory() as save_dir:
+        for idx in range(8):
+            signal = torch.randn(2, sample_rate)
+            writer.save(os.path.join(save_dir, "{}.wav".format(idx)), signal, normalize=True)
+
+        writer.close()
+
+        signal, _ = torchaudio.load(os.path.join(save_dir, "0.wav"))
+        print(sorted(os.listdir(save_dir)))
+        print(signal.size(), torch.abs(signal).max())
+
+if __name__ == '__main__':
+    _test_async_checkpoint_writer()
+    print()
+    _test_async_audio_writer()
@@ -0,0 +1,99 @@
+import collections
+import multiprocessing
+
+import torch
+import torchaudio
+
+class DecodedAudioCache:
+    """
+    LRU cache of decoded audio files with a byte budget.
+    Every DataLoader worker holds its own cache (the budget is per process), while hit/miss counters are shared among workers.
+    Counters are updated under a lock, because `+=` on shared memory is not atomic across workers.
+    Args:
+        max_bytes <int>: Budget of decoded samples in bytes. A file larger than `max_bytes` is read partially without caching.
+    """
+    def __init__(self, max_bytes):
+        assert max_bytes > 0, "max_bytes is expected positive, but given {}.".format(max_bytes)
+
+        self.max_bytes = max_bytes
+        self.counts = torch.zeros(3, dtype=torch.long).share_memory_() # hits, misses, evictions
+        self.counts_lock = multiprocessing.Lock()
+
+        self._waves = collections.OrderedDict()
+        self._bytes = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_waves'] = collections.OrderedDict()
+        state['_bytes'] = 0
+
+        return state
+
+    def load(self, path, frame_offset=0, num_frames=-1):
+        """
+        Same interface as `torchaudio.load`.
+        Args:
+            path <str>: Path to audio file
+            frame_offset <int>: Start sample
+            num_frames <int>: Number of samples. If -1, samples until the end are returned.
+        Returns:
+            wave <torch.Tensor>: (n_channels, num_frames)
+            sample_rate <int>: Sampling rate
+        """
+        if path in self._waves:
+            self._waves.move_to_end(path)
+            self._count(0)
+            wave, sample_rate = self._waves[path]
+        else:
+            self._count(1)
+            wave, sample_rate = torchaudio.load(path)
+            nbytes = wave.numel() * wave.element_size()
+
+            if nbytes <= self.max_bytes:
+                while self._bytes + nbytes > self.max_bytes:
+                    _, (evicted, _) = self._waves.popitem(last=False)
+                    self._bytes -= evicted.numel() * evicted.element_size()
+                    self._count(2)
+
+                self._waves[path] = wave, sample_rate
+                self._bytes += nbytes
+
+        return _crop(wave, frame_offset, num_frames).clone(), sample_rate
+
+    def _count(self, index):
+        with self.counts_lock:
+            self.counts[index] += 1
+
+    def clear(self):
+        self._waves.clear()
+        self._bytes = 0
+
+    def stats(self):
+        """
+        Returns:
+            stats <dict>: Hits, misses and evictions summed over all workers, and hit rate.
+        """
+        with self.counts_lock:
+            hits, misses, evictions = self.counts.tolist()
+        n_loads = hits + misses
+
+        stats = {
+            'hits': hits,
+            'misses': misses,
+            'evictions': evictions,
+            'hit_rate': hits / n_loads if n_loads > 0 else 0
+        }
+
+        return stats
+
+    def __str__(self):
+        stats = self.stats()
+        s = "Cache: {hits} hits, {misses} misses ({hit_rate:.1%} hit rate), {evictions} evictions".format(**stats)
+
+        return s
+
+def _crop(wave, frame_offset, num_frames):
+    if num_frames < 0:
+        return wave[:, frame_offset:]
+
+    return wave[:, frame_offset: frame_offset + num_frames]
@@ -1,4 +1,5 @@
-from augmentation import RandomFlip, RandomGain
+from augmentation import RandomFlip, RandomGain, RandomSign
+from augmentation import BatchRandomFlip, BatchRandomGain, BatchRandomSign, BatchRemix
 
 class SequentialAugmentation:
     def __init__(self, *args):
@@ -24,5 +25,25 @@ def choose_augmentation(name, **kwargs):
         return RandomGain(**kwargs)
     elif name == 'random_gain':
         return RandomGain(**kwargs)
+    elif name == 'random_sign':
+        return RandomSign(**kwargs)
+    else:
+        raise NotImplementedError("Not support {}.".format(name))
+
+def choose_batch_augmentation(name, **kwargs):
+    """
+    Same names as `choose_augmentation`, but returned augmentation is applied to (batch_size, n_sources, *) at once.
+    `remix` shuffles sources among examples in batch.
+    """
+    if name == 'random_flip':
+        return BatchRandomFlip(**kwargs)
+    elif name == 'random_scaling':
+        return BatchRandomGain(**kwargs)
+    elif name == 'random_gain':
+        return BatchRandomGain(**kwargs)
+    elif name == 'random_sign':
+        return BatchRandomSign(**kwargs)
+    elif name == 'remix':
+        return BatchRemix(**kwargs)
     else:
         raise NotImplementedError("Not support {}.".format(name))
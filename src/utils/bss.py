@@ -1,34 +1,120 @@
-from mir_eval.separation import bss_eval_sources as bss_eval_sources_np
+import itertools
+
 import torch
 
-def bss_eval_sources(reference_sources: torch.Tensor, estimated_sources: torch.Tensor, **kwargs):
+DEFAULT_FILTER_LENGTH = 512
+
+def bss_eval_sources(reference_sources: torch.Tensor, estimated_sources: torch.Tensor, filter_length=DEFAULT_FILTER_LENGTH, compute_permutation=True):
     """
-    Wrapper of mir_eval.separation.bss_eval_sources
+    BSS-eval (v3) of sources, which is compatible with mir_eval.separation.bss_eval_sources, implemented by torch.
+    Leading dimensions are batched, so several utterances (or estimates of same utterance) are evaluated at once on the device of inputs.
+    Leading dimensions of `reference_sources` and `estimated_sources` are broadcast, e.g. estimates of model and mixture can share references.
+    Zero-padding does not change metrics, so zero-padded utterances of different lengths can be batched.
     Args:
-        reference_sources <torch.Tensor>: (n_sources, T)
+        reference_sources <torch.Tensor>: (*, n_sources, T)
+        estimated_sources <torch.Tensor>: (*, n_sources, T)
+        filter_length <int>: Length of distortion filter
+        compute_permutation <bool>: If True, permutation of estimated sources which maximizes mean SIR is searched.
     Returns:
-        sdr <torch.DoubleTensor>: (n_sources,)
-        sir <torch.DoubleTensor>: (n_sources,)
-        sar <torch.DoubleTensor>: (n_sources,)
-        perm <torch.LongTensor>: (n_sources,)
+        sdr <torch.DoubleTensor>: (*, n_sources)
+        sir <torch.DoubleTensor>: (*, n_sources)
+        sar <torch.DoubleTensor>: (*, n_sources)
+        perm <torch.LongTensor>: (*, n_sources), i.e. perm[..., j] is index of estimated source corresponding to j-th reference source.
     """
-    reference_sources = reference_sources.numpy()
-    estimated_sources = estimated_sources.numpy()
+    assert reference_sources.size()[-2:] == estimated_sources.size()[-2:], "reference_sources and estimated_sources are expected same number of sources and length."
+
+    n_sources = reference_sources.size(-2)
+
+    sdr, sir, sar = _bss_eval_matrix(reference_sources.double(), estimated_sources.double(), filter_length=filter_length) # (*, n_sources, n_sources)
 
-    result = bss_eval_sources_np(
-        reference_sources=reference_sources,
-        estimated_sources=estimated_sources,
-        **kwargs
-    )
+    if compute_permutation:
+        patterns = list(itertools.permutations(range(n_sources)))
+        patterns = torch.Tensor(patterns).long().to(sir.device) # (P, n_sources)
+    else:
+        patterns = torch.arange(n_sources, device=sir.device).unsqueeze(dim=0) # (1, n_sources)
 
-    result = [
-        torch.from_numpy(_result) for _result in result
-    ]
+    source_indices = torch.arange(n_sources, device=sir.device)
+    mean_sir = sir[..., patterns, source_indices].mean(dim=-1) # (*, P)
+    indices = torch.argmax(mean_sir, dim=-1) # (*,)
+    perm = patterns[indices] # (*, n_sources)
 
-    sdr, sir, sar, perm = result
+    sdr = torch.gather(sdr, dim=-2, index=perm.unsqueeze(dim=-2)).squeeze(dim=-2)
+    sir = torch.gather(sir, dim=-2, index=perm.unsqueeze(dim=-2)).squeeze(dim=-2)
+    sar = torch.gather(sar, dim=-2, index=perm.unsqueeze(dim=-2)).squeeze(dim=-2)
 
     return sdr, sir, sar, perm
 
+def _bss_eval_matrix(reference_sources, estimated_sources, filter_length=DEFAULT_FILTER_LENGTH):
+    """
+    Args:
+        reference_sources (*, n_sources, T)
+        estimated_sources (*, n_sources, T)
+    Returns:
+        sdr (*, n_sources, n_sources): sdr[..., i, j] is SDR of i-th estimated source for j-th reference source.
+        sir (*, n_sources, n_sources)
+        sar (*, n_sources, n_sources)
+    """
+    n_sources, T = reference_sources.size()[-2:]
+    L = T + filter_length - 1
+    n_fft = 2**(L - 1).bit_length()
+    device = reference_sources.device
+
+    reference_spectrum = torch.fft.rfft(reference_sources, n=n_fft, dim=-1) # (*, n_sources, n_bins)
+    estimated_spectrum = torch.fft.rfft(estimated_sources, n=n_fft, dim=-1) # (*, n_sources, n_bins)
+
+    delays = torch.arange(filter_length, device=device)
+
+    # Inner products between delayed versions of reference sources, i.e. gram[..., i, a, j, b] = <s_i(t - a), s_j(t - b)>.
+    correlation = torch.fft.irfft(reference_spectrum.unsqueeze(dim=-2) * reference_spectrum.conj().unsqueeze(dim=-3), n=n_fft, dim=-1) # (*, n_sources, n_sources, n_fft)
+    gram = correlation[..., (delays.unsqueeze(dim=0) - delays.unsqueeze(dim=1)) % n_fft] # (*, n_sources, n_sources, filter_length, filter_length)
+
+    # Inner products between estimated sources and delayed versions of reference sources, i.e. inner[..., i, j, a] = <s_j(t - a), s_hat_i(t)>.
+    correlation = torch.fft.irfft(reference_spectrum.unsqueeze(dim=-3) * estimated_spectrum.conj().unsqueeze(dim=-2), n=n_fft, dim=-1) # (*, n_sources, n_sources, n_fft)
+    inner = correlation[..., (- delays) % n_fft] # (*, n_sources, n_sources, filter_length)
+
+    # Distortion filters of projection onto all reference sources
+    batch_size = inner.size()[:-3]
+    gram_all = gram.transpose(-3, -2).reshape(*gram.size()[:-4], n_sources * filter_length, n_sources * filter_length)
+    inner_all = inner.reshape(*batch_size, n_sources, n_sources * filter_length)
+    filter_all = _solve(gram_all, inner_all.transpose(-2, -1)).transpose(-2, -1) # (*, n_sources, n_sources * filter_length)
+    filter_all = filter_all.reshape(*batch_size, n_sources, n_sources, filter_length)
+
+    # Distortion filters of projection onto each reference source
+    gram_own = torch.diagonal(gram, dim1=-4, dim2=-3).permute(*range(gram.dim() - 4), -1, -3, -2) # (*, n_sources, filter_length, filter_length)
+    filter_own = _solve(gram_own.unsqueeze(dim=-4), inner.unsqueeze(dim=-1)).squeeze(dim=-1) # (*, n_sources, n_sources, filter_length)
+
+    # Projections by filtering
+    filter_all = torch.fft.rfft(filter_all, n=n_fft, dim=-1)
+    filter_own = torch.fft.rfft(filter_own, n=n_fft, dim=-1)
+    projection_all = torch.fft.irfft(torch.sum(filter_all * reference_spectrum.unsqueeze(dim=-3), dim=-2), n=n_fft, dim=-1)[..., :L] # (*, n_sources, L)
+    projection_own = torch.fft.irfft(filter_own * reference_spectrum.unsqueeze(dim=-3), n=n_fft, dim=-1)[..., :L] # (*, n_sources, n_sources, L)
+
+    estimated_sources = torch.nn.functional.pad(estimated_sources, (0, filter_length - 1))
+
+    # s_target = projection_own, e_interf = projection_all - projection_own, e_artif = estimated - projection_all
+    target_power = torch.sum(projection_own**2, dim=-1)
+    sdr = _safe_db(target_power, torch.sum((estimated_sources.unsqueeze(dim=-2) - projection_own)**2, dim=-1))
+    sir = _safe_db(target_power, torch.sum((projection_all.unsqueeze(dim=-2) - projection_own)**2, dim=-1))
+    sar = _safe_db(torch.sum(projection_all**2, dim=-1), torch.sum((estimated_sources - projection_all)**2, dim=-1))
+    sar = sar.unsqueeze(dim=-1).expand_as(sdr)
+
+    return sdr, sir, sar
+
+def _solve(A, B):
+    try:
+        X = torch.linalg.solve(A, B)
+    except RuntimeError:
+        # Singular, e.g. silent reference source
+        X = torch.linalg.pinv(A) @ B
+
+    return X
+
+def _safe_db(num, den):
+    db = 10 * torch.log10(num / den)
+    db = torch.where(den == 0, torch.full_like(db, float('inf')), db)
+
+    return db
+
 def _test_bss_eval_sources():
     reference_source_man, _ = torchaudio.load("data/single-channel/man-16000.wav")
     reference_source_woman, _ = torchaudio.load("data/single-channel/woman-16000.wav")
@@ -42,7 +128,28 @@ def _test_bss_eval_sources():
 
     print(result)
 
+def _test_bss_eval_sources_mir_eval():
+    from mir_eval.separation import bss_eval_sources as bss_eval_sources_np
+
+    torch.manual_seed(111)
+
+    batch_size, n_sources, T = 3, 2, 8000
+    reference_sources = torch.randn(batch_size, n_sources, T, dtype=torch.float64)
+    mixing = torch.eye(n_sources, dtype=torch.float64) + 0.3 * torch.rand(batch_size, n_sources, n_sources, dtype=torch.float64)
+    estimated_sources = torch.flip(mixing @ reference_sources, dims=(1,)) + 0.1 * torch.randn(batch_size, n_sources, T, dtype=torch.float64)
+
+    result = bss_eval_sources(reference_sources=reference_sources, estimated_sources=estimated_sources)
+
+    for batch_idx in range(batch_size):
+        result_np = bss_eval_sources_np(reference_sources[batch_idx].numpy(), estimated_sources[batch_idx].numpy())
+
+        for _result, _result_np in zip(result, result_np):
+            print(torch.allclose(_result[batch_idx], torch.from_numpy(_result_np).to(_result.dtype), atol=1e-4), end=" ")
+        print()
+
 if __name__ == '__main__':
     import torchaudio
 
-    _test_bss_eval_sources()
\ No newline at end of file
+    _test_bss_eval_sources()
+    print()
+    _test_bss_eval_sources_mir_eval()
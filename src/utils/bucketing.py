@@ -0,0 +1,101 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+class LengthBucketBatchSampler(torch.utils.data.Sampler):
+    """
+    Batch sampler which groups examples of similar length.
+    Examples are sorted by length, and a new batch is started when `batch_size`, `max_padding` or `max_samples` would be exceeded.
+    Args:
+        lengths <array-like>: Number of samples of each example
+        batch_size <int>: Maximum number of examples in batch
+        max_padding <int>: Maximum difference of lengths in batch. If 0, only examples with same length are batched together.
+        max_samples <int>: Maximum of `batch_size * longest length` in batch to bound memory. If None, not limited.
+        shuffle <bool>: If True, order of batches is shuffled every epoch.
+    """
+    def __init__(self, lengths, batch_size=1, max_padding=0, max_samples=None, shuffle=False):
+        super().__init__()
+
+        lengths = np.asarray(lengths, dtype=np.int64)
+        order = np.argsort(lengths, kind='stable')
+
+        batches = []
+        batch = []
+
+        for idx in order:
+            length = lengths[idx]
+
+            if len(batch) > 0:
+                is_full = len(batch) >= batch_size
+                is_padded = length - lengths[batch[0]] > max_padding
+                is_large = max_samples is not None and (len(batch) + 1) * length > max_samples
+
+                if is_full or is_padded or is_large:
+                    batches.append(batch)
+                    batch = []
+
+            batch.append(int(idx))
+
+        if len(batch) > 0:
+            batches.append(batch)
+
+        self.batches = batches
+        self.shuffle = shuffle
+
+    def __iter__(self):
+        if self.shuffle:
+            indices = torch.randperm(len(self.batches)).tolist()
+        else:
+            indices = range(len(self.batches))
+
+        for idx in indices:
+            yield self.batches[idx]
+
+    def __len__(self):
+        return len(self.batches)
+
+def pad_collate_fn(batch):
+    """
+    Pad tensors along the last dimension and append lengths.
+    Args:
+        batch <list<tuple>>: Each example is a tuple of tensors with shape (*, T) and other objects such as segment ID.
+    Returns:
+        batch <tuple>: Tensors (batch_size, *, max(T)), lists of other objects, and lengths (batch_size,) <torch.LongTensor>
+    """
+    lengths = []
+
+    for example in batch:
+        tensors = [item for item in example if torch.is_tensor(item)]
+        lengths.append(tensors[0].size(-1))
+
+    max_length = max(lengths)
+    batched = []
+
+    for items in zip(*batch):
+        if torch.is_tensor(items[0]):
+            items = [F.pad(item, (0, max_length - item.size(-1))) for item in items]
+            batched.append(torch.stack(items, dim=0))
+        else:
+            batched.append(list(items))
+
+    batched.append(torch.tensor(lengths, dtype=torch.long))
+
+    return tuple(batched)
+
+def _test_length_bucket_batch_sampler():
+    torch.manual_seed(111)
+
+    lengths = [5, 3, 5, 8, 5, 3, 7, 9]
+
+    sampler = LengthBucketBatchSampler(lengths, batch_size=2)
+    print([[lengths[idx] for idx in batch] for batch in sampler])
+
+    sampler = LengthBucketBatchSampler(lengths, batch_size=4, max_padding=2)
+    print([[lengths[idx] for idx in batch] for batch in sampler])
+
+    batch = [(torch.randn(1, length), torch.randn(2, length), 'ID{}'.format(idx)) for idx, length in enumerate([5, 3])]
+    mixture, sources, IDs, lengths = pad_collate_fn(batch)
+    print(mixture.size(), sources.size(), IDs, lengths)
+
+if __name__ == '__main__':
+    _test_length_bucket_batch_sampler()
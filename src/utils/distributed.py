@@ -0,0 +1,108 @@
+import os
+import builtins
+
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+
+def init_distributed(backend=None, use_cuda=False):
+    """
+    Initialize process group from environment variables set by `torchrun`, i.e. RANK, WORLD_SIZE, LOCAL_RANK, MASTER_ADDR and MASTER_PORT.
+    Processes except rank 0 do not print anything unless `print(..., force=True)`.
+    Args:
+        backend <str>: Backend of process group. If None, 'nccl' is used with CUDA, otherwise 'gloo'.
+        use_cuda <bool>: If True, each process uses the device of its local rank.
+    Returns:
+        distributed <bool>: True if launched with more than one process.
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+
+    if world_size <= 1:
+        return False
+
+    if dist.is_initialized():
+        return True
+
+    if backend is None:
+        backend = 'nccl' if use_cuda else 'gloo'
+
+    if use_cuda:
+        torch.cuda.set_device(int(os.environ.get('LOCAL_RANK', 0)))
+
+    dist.init_process_group(backend=backend)
+
+    _setup_print(is_main_process())
+
+    return True
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+def get_rank():
+    if is_distributed():
+        return dist.get_rank()
+
+    return 0
+
+def get_world_size():
+    if is_distributed():
+        return dist.get_world_size()
+
+    return 1
+
+def is_main_process():
+    return get_rank() == 0
+
+def distribute_model(model, use_cuda=False):
+    """
+    Args:
+        model <nn.Module>: Model on the device of this process
+        use_cuda <bool>: If True, `model` is on CUDA.
+    Returns:
+        model <nn.Module>: `nn.parallel.DistributedDataParallel` if distributed, `nn.DataParallel` if CUDA, otherwise `model` itself.
+    """
+    if is_distributed():
+        device_ids = [torch.cuda.current_device()] if use_cuda else None
+        model = nn.parallel.DistributedDataParallel(model, device_ids=device_ids)
+    elif use_cuda:
+        model = nn.DataParallel(model)
+
+    return model
+
+def unwrap_model(model):
+    """
+    Args:
+        model <nn.Module>: Model possibly wrapped by `nn.DataParallel` or `nn.parallel.DistributedDataParallel`
+    Returns:
+        model <nn.Module>: Underlying model
+    """
+    if isinstance(model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
+        return model.module
+
+    return model
+
+def all_reduce_mean(value):
+    """
+    Args:
+        value <float>: Value of this process, e.g. loss averaged over batches.
+    Returns:
+        value <float>: Value averaged over processes. If not distributed, `value` itself.
+    """
+    if not is_distributed():
+        return value
+
+    device = torch.device('cuda', torch.cuda.current_device()) if dist.get_backend() == 'nccl' else torch.device('cpu')
+    value = torch.tensor(float(value), dtype=torch.float64, device=device)
+    dist.all_reduce(value, op=dist.ReduceOp.SUM)
+    value = value.item() / get_world_size()
+
+    return value
+
+def _setup_print(is_main):
+    builtin_print = builtins.print
+
+    def print(*args, force=False, **kwargs):
+        if is_main or force:
+            builtin_print(*args, **kwargs)
+
+    builtins.print = print
@@ -0,0 +1,199 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+
+FEATURE_CACHE_VERSION = 1
+FEATURE_CACHE_INDEX = 'index.json'
+
+class FeatureCache:
+    """
+    On-disk cache of deterministic per-example features, e.g. ideal masks and threshold weights.
+    Every feature is stored in one flat file `<name>.bin`, and `index.json` keeps (offset, shape) of each example.
+    Memory maps are opened lazily, so that every DataLoader worker holds its own maps.
+    Features are returned as views of memory maps in stored dtype without copy. Use `feature_collate_fn` to cast them to float after batching.
+    Args:
+        cache_dir <str>: Directory built by `build_feature_cache`
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+
+        index_path = os.path.join(self.cache_dir, FEATURE_CACHE_INDEX)
+
+        with open(index_path) as f:
+            index = json.load(f)
+
+        self.config = index['config']
+        self.dtype = np.dtype(index['dtype'])
+        self.names = index['names']
+        self.items = index['items']
+
+        self._memmaps = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_memmaps'] = None
+
+        return state
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, idx):
+        """
+        Returns:
+            features <dict<str, torch.Tensor>>: Tensors of `idx`-th example in stored dtype (float16 by default)
+        """
+        if self._memmaps is None:
+            self._memmaps = {
+                name: np.memmap(os.path.join(self.cache_dir, '{}.bin'.format(name)), dtype=self.dtype, mode='c') for name in self.names
+            }
+
+        features = {}
+
+        for name, (offset, shape) in zip(self.names, self.items[idx]):
+            n_elements = int(np.prod(shape))
+            feature = self._memmaps[name][offset: offset + n_elements].reshape(shape)
+            features[name] = torch.from_numpy(feature)
+
+        return features
+
+def feature_collate_fn(batch, collate_fn=default_collate):
+    """
+    Collate examples including features read from `FeatureCache`, and cast float16 tensors to float32 once per batch.
+    Args:
+        batch <list>: Examples
+        collate_fn <callable>: Collate function applied before casting.
+    Returns:
+        batch: Same structure as `collate_fn(batch)`
+    """
+    return _to_float(collate_fn(batch))
+
+def _to_float(batch):
+    if torch.is_tensor(batch):
+        if batch.dtype == torch.float16:
+            batch = batch.float()
+        return batch
+
+    if isinstance(batch, dict):
+        return {key: _to_float(value) for key, value in batch.items()}
+
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(_to_float(item) for item in batch)
+
+    return batch
+
+def _stat_paths(paths):
+    hasher = hashlib.sha1()
+
+    for path in paths:
+        stat = os.stat(path)
+        hasher.update('{}:{}:{};'.format(path, stat.st_size, stat.st_mtime_ns).encode())
+
+    return hasher.hexdigest()[:16]
+
+class _FeatureDataset(torch.utils.data.Dataset):
+    def __init__(self, dataset):
+        super().__init__()
+
+        self.dataset = dataset
+
+    def __getitem__(self, idx):
+        return self.dataset.compute_features(idx)
+
+    def __len__(self):
+        return len(self.dataset)
+
+def build_feature_cache(dataset, cache_root, config, paths=None, num_workers=0, dtype=np.float16):
+    """
+    Load feature cache of `dataset` if exists, otherwise build it.
+    Files are written to a temporary directory under `cache_root`, which is renamed to the cache directory when completed.
+    If several processes build the same cache concurrently, the first completed one is used and the others are discarded.
+    Args:
+        dataset <torch.utils.data.Dataset>: Dataset with `compute_features(idx)`, which returns <dict<str, torch.Tensor>>.
+        cache_root <str>: Root directory of feature caches. Each configuration has own subdirectory.
+        config <dict>: JSON-serializable configuration which determines features.
+        paths <list<str>>: Source files of features. Their sizes and mtimes are included in the key, so that features are rebuilt when the files are regenerated.
+        num_workers <int>: Number of processes to compute features.
+        dtype <numpy.dtype>: Data type of stored features.
+    Returns:
+        cache <FeatureCache>: Feature cache of `dataset`
+    """
+    config = dict(config, version=FEATURE_CACHE_VERSION, dtype=np.dtype(dtype).name)
+
+    if paths is not None:
+        config['files'] = _stat_paths(paths)
+
+    key = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+    cache_dir = os.path.join(cache_root, key)
+    index_path = os.path.join(cache_dir, FEATURE_CACHE_INDEX)
+
+    if os.path.exists(index_path):
+        return FeatureCache(cache_dir)
+
+    os.makedirs(cache_root, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.{}-'.format(key), dir=cache_root)
+
+    try:
+        _write_feature_cache(dataset, tmp_dir, config, num_workers=num_workers, dtype=dtype)
+
+        if os.path.isdir(cache_dir) and not os.path.exists(index_path):
+            # Incomplete cache left by interrupted build
+            shutil.rmtree(cache_dir)
+
+        try:
+            os.replace(tmp_dir, cache_dir)
+        except OSError:
+            # Another process has published the same cache.
+            if not os.path.exists(index_path):
+                raise
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+
+    return FeatureCache(cache_dir)
+
+def _write_feature_cache(dataset, cache_dir, config, num_workers=0, dtype=np.float16):
+    index_path = os.path.join(cache_dir, FEATURE_CACHE_INDEX)
+    loader = torch.utils.data.DataLoader(_FeatureDataset(dataset), batch_size=None, shuffle=False, num_workers=num_workers)
+
+    names = None
+    files, sizes = {}, {}
+    items = []
+
+    try:
+        for features in loader:
+            if names is None:
+                names = sorted(features.keys())
+
+                for name in names:
+                    files[name] = open(os.path.join(cache_dir, '{}.bin'.format(name)), 'wb')
+                    sizes[name] = 0
+
+            item = []
+
+            for name in names:
+                feature = features[name].numpy().astype(dtype)
+                files[name].write(np.ascontiguousarray(feature).tobytes())
+                item.append([sizes[name], list(feature.shape)])
+                sizes[name] += feature.size
+
+            items.append(item)
+    finally:
+        for name in files:
+            files[name].close()
+
+    index = {
+        'config': config,
+        'dtype': np.dtype(dtype).name,
+        'names': names or [],
+        'items': items
+    }
+
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
@@ -0,0 +1,232 @@
+import os
+import hashlib
+import json
+import wave
+import warnings
+
+import numpy as np
+
+MANIFEST_VERSION = 2
+MANIFEST_DIR = '.manifest'
+
+class SegmentIndex:
+    """
+    Segment index stored as NumPy arrays instead of list of dict.
+    DataLoader workers forked from the main process share these buffers without touching refcounts of millions of Python objects.
+    Args:
+        names <list<str>> or <numpy.ndarray>: Track names (or utterance IDs), interned once per track.
+        track <numpy.ndarray>: Track index of each segment with shape (n_segments,)
+        start <numpy.ndarray>: Start sample of each segment with shape (n_segments,)
+        length <numpy.ndarray>: Number of samples of each segment with shape (n_segments,)
+    """
+    def __init__(self, names, track, start, length):
+        self.names = np.asarray(names, dtype=np.str_)
+        self.track = np.asarray(track, dtype=np.int32)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.length = np.asarray(length, dtype=np.int64)
+
+        assert self.track.shape == self.start.shape == self.length.shape, "track, start and length are expected to have same shape."
+
+    @classmethod
+    def from_lengths(cls, names, lengths, samples=None, overlap=None, max_samples=None, strict=False):
+        """
+        Args:
+            names <list<str>>: Track names
+            lengths <list<int>>: Number of samples of each track
+            samples <int>: Segment length. If None, one segment per track is created, clipped by `max_samples`.
+            overlap <int>: Overlap between segments. If None, `samples // 2` is used.
+            max_samples <int>: Maximum length of segment when `samples` is None.
+            strict <bool>: If True, segments have to end before the last sample, i.e. `start + samples < length`.
+        Returns:
+            segments <SegmentIndex>
+        """
+        lengths = np.asarray(lengths, dtype=np.int64)
+        n_tracks = len(lengths)
+
+        if samples is None:
+            track = np.arange(n_tracks)
+            start = np.zeros(n_tracks, dtype=np.int64)
+
+            if max_samples is None:
+                length = lengths
+            else:
+                length = np.minimum(lengths, max_samples)
+        else:
+            if overlap is None:
+                overlap = samples // 2
+
+            hop_size = samples - overlap
+
+            if strict:
+                n_segments = np.where(lengths > samples, (lengths - samples - 1) // hop_size + 1, 0)
+            else:
+                n_segments = np.where(lengths >= samples, (lengths - samples) // hop_size + 1, 0)
+
+            track = np.repeat(np.arange(n_tracks), n_segments)
+            offsets = np.cumsum(n_segments) - n_segments
+            start = (np.arange(len(track)) - np.repeat(offsets, n_segments)) * hop_size
+            length = np.full(len(track), samples, dtype=np.int64)
+
+        return cls(names, track, start, length)
+
+    def __len__(self):
+        return len(self.track)
+
+    def __getitem__(self, idx):
+        """
+        Returns:
+            trackID <int>: Track index
+            start <int>: Start sample
+            length <int>: Number of samples
+        """
+        return int(self.track[idx]), int(self.start[idx]), int(self.length[idx])
+
+    def name(self, idx):
+        """
+        Returns:
+            name <str>: Track name of `idx`-th segment
+        """
+        return str(self.names[self.track[idx]])
+
+    def fingerprint(self):
+        """
+        Returns:
+            fingerprint <str>: Hash of names and segments, which identifies the index.
+        """
+        hasher = hashlib.sha1()
+
+        for array in [self.names, self.track, self.start, self.length]:
+            hasher.update(np.ascontiguousarray(array).tobytes())
+
+        return hasher.hexdigest()[:16]
+
+def get_num_frames(path):
+    """
+    Read the number of frames from the header of audio file without decoding it.
+    Args:
+        path <str>: Path to audio file
+    Returns:
+        num_frames <int>: Number of samples per channel
+    """
+    try:
+        with wave.open(path, 'rb') as f:
+            num_frames = f.getnframes()
+    except (wave.Error, EOFError):
+        # e.g. IEEE float or WAVE_FORMAT_EXTENSIBLE, which `wave` cannot parse.
+        import torchaudio
+
+        audio_info = torchaudio.info(path)
+        num_frames = audio_info.num_frames
+
+    return num_frames
+
+def read_list(list_path):
+    """
+    Args:
+        list_path <str>: Path to list file, which contains one utterance ID per line.
+    Returns:
+        IDs <list<str>>: Utterance IDs
+    """
+    IDs = []
+
+    with open(list_path) as f:
+        for line in f:
+            ID = line.strip()
+            IDs.append(ID)
+
+    return IDs
+
+def build_segment_manifest(wav_root, list_path, samples=None, overlap=None, max_samples=None, subdir='mix', cache_dir=None, use_cache=True):
+    """
+    Build segment index from lengths of `<wav_root>/<subdir>/<ID>.wav`.
+    The index is stored under `cache_dir` and reused while the list file, the parameters and the mtimes of wav files are unchanged.
+    Args:
+        wav_root <str>: Root directory of dataset
+        list_path <str>: Path to list file
+        samples <int>: Segment length. If None, one segment per utterance is returned, clipped by `max_samples`.
+        overlap <int>: Overlap between segments. If None, `samples // 2` is used. Ignored when `samples` is None.
+        max_samples <int>: Maximum length of segment when `samples` is None.
+        subdir <str>: Subdirectory used to determine length of utterance.
+        cache_dir <str>: Directory to save manifest. Default: `<directory of list_path>/.manifest`
+        use_cache <bool>: If False, manifest is always built from scratch and never saved.
+    Returns:
+        segments <SegmentIndex>: Segment index whose names are utterance IDs
+    """
+    wav_root = os.path.abspath(wav_root)
+    list_path = os.path.abspath(list_path)
+
+    if samples is not None and overlap is None:
+        overlap = samples // 2
+
+    IDs = read_list(list_path)
+    wav_paths = [os.path.join(wav_root, subdir, '{}.wav'.format(ID)) for ID in IDs]
+
+    if not use_cache:
+        lengths = [get_num_frames(wav_path) for wav_path in wav_paths]
+        return SegmentIndex.from_lengths(IDs, lengths, samples=samples, overlap=overlap, max_samples=max_samples)
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(list_path), MANIFEST_DIR)
+
+    key = _compute_key(wav_root, list_path, wav_paths, samples=samples, overlap=overlap, max_samples=max_samples, subdir=subdir)
+    manifest_path = os.path.join(cache_dir, '{}_{}.npz'.format(os.path.basename(list_path), key))
+
+    segments = _load_manifest(manifest_path, key)
+
+    if segments is not None:
+        return segments
+
+    lengths = [get_num_frames(wav_path) for wav_path in wav_paths]
+    segments = SegmentIndex.from_lengths(IDs, lengths, samples=samples, overlap=overlap, max_samples=max_samples)
+    _save_manifest(manifest_path, key, segments)
+
+    return segments
+
+def _compute_key(wav_root, list_path, wav_paths, samples=None, overlap=None, max_samples=None, subdir='mix'):
+    hasher = hashlib.sha1()
+
+    header = {
+        'version': MANIFEST_VERSION,
+        'wav_root': wav_root,
+        'list_path': list_path,
+        'subdir': subdir,
+        'samples': samples,
+        'overlap': overlap,
+        'max_samples': max_samples
+    }
+    hasher.update(json.dumps(header, sort_keys=True).encode())
+
+    for path in [list_path] + wav_paths:
+        stat = os.stat(path)
+        hasher.update('{}:{}:{};'.format(path, stat.st_size, stat.st_mtime_ns).encode())
+
+    return hasher.hexdigest()[:16]
+
+def _load_manifest(manifest_path, key):
+    if not os.path.exists(manifest_path):
+        return None
+
+    try:
+        with np.load(manifest_path, allow_pickle=False) as data:
+            if str(data['key']) != key:
+                return None
+
+            segments = SegmentIndex(data['names'], data['track'], data['start'], data['length'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return segments
+
+def _save_manifest(manifest_path, key, segments):
+    tmp_path = '{}.{}.tmp.npz'.format(manifest_path[:-len('.npz')], os.getpid())
+
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+
+        np.savez(tmp_path, key=np.str_(key), names=segments.names, track=segments.track, start=segments.start, length=segments.length)
+        os.replace(tmp_path, manifest_path)
+    except OSError as e:
+        warnings.warn("Cannot save manifest to {}: {}".format(manifest_path, e), UserWarning)
+
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
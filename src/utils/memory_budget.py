@@ -0,0 +1,317 @@
+import time
+
+import torch
+
+from utils.mixed_precision import autocast
+
+GiB = 1024**3
+DEFAULT_N_TRIALS = 3
+DEFAULT_MAX_BATCH_SIZE = 1024
+
+class BatchSizeFinder:
+    """
+    Finds the largest batch size (or segment length) whose training step fits in memory budget.
+    One training step (forward, criterion and backward) is run with random input, and peak memory is measured on CUDA.
+    Memory of optimizer states (e.g. 2 tensors per parameter for Adam) is added, because `optimizer.step` is not run and parameters are not updated.
+    Batch size (or segment length) is doubled until the step does not fit, and then binary-searched between the last fitting and the first failing one.
+    Throughput of each fitting point is also reported.
+    On CPU, peak memory cannot be measured, so only out-of-memory errors are detected and `memory_budget` is ignored.
+    Args:
+        model <nn.Module>: Model on the device to be used, e.g. built by `build_model`. Gradients of `model` are cleared.
+        criterion <callable>: Criterion, e.g. `PIT1d(NegSISDR(), n_sources)`. If it returns tuple, first item is used as loss.
+        memory_budget <float>: Memory budget [byte]. If None, only out-of-memory errors are detected.
+        in_channels <int>: Number of channels of mixture
+        n_sources <int>: Number of sources. If None, `model.n_sources` is used.
+        input_fn <callable>: Function which returns (input, target) given (batch_size, samples). If None, random mixture (batch_size, in_channels, samples) and sources (batch_size, n_sources, samples) are used.
+        amp_dtype <torch.dtype>: Data type of autocast. If None, mixed precision is not used.
+        optimizer <torch.optim.Optimizer>: Optimizer used in training. Memory of its states is estimated from its type and hyperparameters. If None, states of Adam (2 tensors per parameter) are assumed.
+        n_trials <int>: Number of steps to measure throughput
+        verbose <bool>: If True, peak memory and throughput of every trial point are reported.
+    """
+    def __init__(self, model, criterion, memory_budget=None, in_channels=1, n_sources=None, input_fn=None, amp_dtype=None, optimizer=None, n_trials=DEFAULT_N_TRIALS, verbose=True):
+        self.model = model
+        self.criterion = criterion
+        self.memory_budget = memory_budget
+
+        if input_fn is None:
+            if n_sources is None:
+                n_sources = model.n_sources
+
+            self.in_channels, self.n_sources = in_channels, n_sources
+            self.input_fn = self._random_input
+        else:
+            self.input_fn = input_fn
+
+        self.amp_dtype = amp_dtype
+        self.n_trials = n_trials
+        self.verbose = verbose
+
+        self.device = next(model.parameters()).device
+        self.use_cuda = self.device.type == 'cuda'
+
+        parameter_bytes = sum([p.numel() * p.element_size() for p in model.parameters() if p.requires_grad])
+        self.optimizer_bytes = _n_optimizer_states(optimizer) * parameter_bytes
+
+        self.history = []
+
+    def find_max_batch_size(self, samples, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+        """
+        Args:
+            samples <int>: Length of training segment
+            max_batch_size <int>: Upper bound of search
+        Returns:
+            batch_size <int>: Largest batch size which fits in memory budget
+        """
+        batch_size = self._search(lambda batch_size: self.try_step(batch_size, samples), 1, max_batch_size)
+
+        if batch_size is None:
+            raise RuntimeError("Batch size 1 with {} samples does not fit in memory budget.".format(samples))
+
+        if self.verbose:
+            print("Max batch size: {} (samples {})".format(batch_size, samples), flush=True)
+
+        return batch_size
+
+    def find_max_samples(self, batch_size, min_samples, max_samples, multiple=1):
+        """
+        Args:
+            batch_size <int>: Batch size
+            min_samples <int>: Lower bound of search
+            max_samples <int>: Upper bound of search
+            multiple <int>: Segment length is searched in multiples of `multiple`, e.g. stride of encoder.
+        Returns:
+            samples <int>: Largest segment length which fits in memory budget
+        """
+        min_units, max_units = -(-min_samples // multiple), max_samples // multiple
+
+        assert 0 < min_units <= max_units, "No multiple of {} in [{}, {}].".format(multiple, min_samples, max_samples)
+
+        units = self._search(lambda units: self.try_step(batch_size, multiple * units), min_units, max_units)
+
+        if units is None:
+            raise RuntimeError("Batch size {} with {} samples does not fit in memory budget.".format(batch_size, multiple * min_units))
+
+        samples = multiple * units
+
+        if self.verbose:
+            print("Max samples: {} (batch size {})".format(samples, batch_size), flush=True)
+
+        return samples
+
+    def try_step(self, batch_size, samples):
+        """
+        Args:
+            batch_size <int>: Batch size
+            samples <int>: Length of training segment
+        Returns:
+            result <dict>: 'fits' (bool), 'memory' (peak memory [byte] including optimizer states, or None), and 'examples_per_sec' (or None).
+        """
+        result = {
+            'batch_size': batch_size,
+            'samples': samples,
+            'fits': False,
+            'memory': None,
+            'examples_per_sec': None
+        }
+
+        is_training = self.model.training
+        self.model.train()
+
+        try:
+            input, target = self.input_fn(batch_size, samples)
+
+            if self.use_cuda:
+                torch.cuda.synchronize(self.device)
+                torch.cuda.empty_cache()
+                torch.cuda.reset_peak_memory_stats(self.device)
+
+            self._step(input, target)
+
+            if self.use_cuda:
+                result['memory'] = torch.cuda.max_memory_allocated(self.device) + self.optimizer_bytes
+
+            if self.memory_budget is None or result['memory'] is None or result['memory'] <= self.memory_budget:
+                result['fits'] = True
+
+                self._synchronize()
+                start = time.perf_counter()
+
+                for _ in range(self.n_trials):
+                    self._step(input, target)
+
+                self._synchronize()
+                elapsed = time.perf_counter() - start
+                result['examples_per_sec'] = self.n_trials * batch_size / elapsed
+        except (RuntimeError, MemoryError) as e:
+            if not _is_out_of_memory(e):
+                raise e
+
+            result['fits'] = False
+            result['examples_per_sec'] = None
+        finally:
+            input, target = None, None
+            self.model.zero_grad(set_to_none=True)
+            self.model.train(is_training)
+
+            if self.use_cuda:
+                torch.cuda.empty_cache()
+
+        self.history.append(result)
+
+        if self.verbose:
+            print(_format_result(result, memory_budget=self.memory_budget), flush=True)
+
+        return result
+
+    def _step(self, input, target):
+        self.model.zero_grad(set_to_none=True)
+
+        with autocast(self.device.type, dtype=self.amp_dtype):
+            output = self.model(input)
+
+            if isinstance(output, (tuple, list)):
+                output = output[0]
+
+            loss = self.criterion(output, target)
+
+        if isinstance(loss, (tuple, list)):
+            loss = loss[0]
+
+        loss.mean().backward()
+
+    def _search(self, try_fn, low, high):
+        """
+        Returns:
+            value <int>: Largest value in [low, high] for which `try_fn` fits. None if `low` does not fit.
+        """
+        if not try_fn(low)['fits']:
+            return None
+
+        # Double until the step does not fit.
+        fit, fail = low, None
+
+        while fail is None and fit < high:
+            value = min(2 * fit, high)
+
+            if try_fn(value)['fits']:
+                fit = value
+            else:
+                fail = value
+
+        if fail is None:
+            return fit
+
+        # Binary search in (fit, fail)
+        while fail - fit > 1:
+            value = (fit + fail) // 2
+
+            if try_fn(value)['fits']:
+                fit = value
+            else:
+                fail = value
+
+        return fit
+
+    def _random_input(self, batch_size, samples):
+        input = torch.randn(batch_size, self.in_channels, samples, device=self.device)
+        target = torch.randn(batch_size, self.n_sources, samples, device=self.device)
+
+        return input, target
+
+    def _synchronize(self):
+        if self.use_cuda:
+            torch.cuda.synchronize(self.device)
+
+def find_max_batch_size(model, criterion, samples, memory_budget=None, max_batch_size=DEFAULT_MAX_BATCH_SIZE, **kwargs):
+    """
+    Args:
+        model <nn.Module>: Model on the device to be used
+        criterion <callable>: Criterion
+        samples <int>: Length of training segment
+        memory_budget <float>: Memory budget [byte]
+        max_batch_size <int>: Upper bound of search
+        kwargs: Keyword arguments of `BatchSizeFinder`
+    Returns:
+        batch_size <int>: Largest batch size which fits in memory budget
+    """
+    finder = BatchSizeFinder(model, criterion, memory_budget=memory_budget, **kwargs)
+
+    return finder.find_max_batch_size(samples, max_batch_size=max_batch_size)
+
+def _n_optimizer_states(optimizer):
+    """
+    Returns:
+        n_states <int>: Number of state tensors per parameter, which are allocated at first `optimizer.step`.
+    """
+    if optimizer is None:
+        return 2
+
+    defaults = optimizer.defaults
+
+    if isinstance(optimizer, (torch.optim.Adam, torch.optim.AdamW)):
+        return 3 if defaults.get('amsgrad', False) else 2
+    elif isinstance(optimizer, torch.optim.RMSprop):
+        n_states = 1
+        if defaults.get('momentum', 0) > 0:
+            n_states += 1
+        if defaults.get('centered', False):
+            n_states += 1
+        return n_states
+    elif isinstance(optimizer, torch.optim.SGD):
+        return 1 if defaults.get('momentum', 0) > 0 else 0
+
+    return 2
+
+def _is_out_of_memory(e):
+    if isinstance(e, MemoryError):
+        return True
+
+    message = str(e).lower()
+
+    # CUDA: "CUDA out of memory", CPU: "DefaultCPUAllocator: can't allocate memory" or "not enough memory"
+    return 'out of memory' in message or "can't allocate memory" in message or 'not enough memory' in message
+
+def _format_result(result, memory_budget=None):
+    s = "Batch size {}, samples {}: ".format(result['batch_size'], result['samples'])
+
+    if result['memory'] is not None:
+        s += "peak memory {:.2f} [GiB]".format(result['memory'] / GiB)
+
+        if memory_budget is not None:
+            s += " / {:.2f} [GiB]".format(memory_budget / GiB)
+        s += ", "
+
+    if result['fits']:
+        s += "{:.2f} [examples/sec]".format(result['examples_per_sec'])
+    else:
+        s += "does NOT fit"
+
+    return s
+
+def _test_batch_size_finder():
+    import torch.nn as nn
+
+    torch.manual_seed(111)
+
+    class Model(nn.Module):
+        def __init__(self, n_sources=2):
+            super().__init__()
+
+            self.n_sources = n_sources
+            self.conv = nn.Conv1d(1, n_sources, kernel_size=3, padding=1)
+
+        def forward(self, input):
+            return self.conv(input)
+
+    def criterion(input, target):
+        return torch.mean((input - target)**2, dim=(1, 2))
+
+    model = Model()
+    finder = BatchSizeFinder(model, criterion)
+
+    batch_size = finder.find_max_batch_size(samples=8000, max_batch_size=16)
+    samples = finder.find_max_samples(batch_size=4, min_samples=4000, max_samples=16000, multiple=8)
+    print(batch_size, samples)
+
+if __name__ == '__main__':
+    _test_batch_size_finder()
@@ -0,0 +1,92 @@
+import functools
+
+import torch
+
+AMP_DTYPES = {
+    'fp16': torch.float16,
+    'bf16': torch.bfloat16
+}
+
+def get_amp_dtype(amp):
+    """
+    Args:
+        amp <str>: 'fp16', 'bf16' or None ('none' is also accepted).
+    Returns:
+        dtype <torch.dtype>: Data type of autocast. None if mixed precision is not used.
+    """
+    if amp is None or amp == 'none':
+        return None
+
+    if not amp in AMP_DTYPES:
+        raise ValueError("Not support mixed precision {}".format(amp))
+
+    return AMP_DTYPES[amp]
+
+def autocast(device_type, dtype=None):
+    """
+    Args:
+        device_type <str>: 'cuda' or 'cpu'
+        dtype <torch.dtype>: Data type of autocast. If None, autocast is disabled.
+    Returns:
+        context <torch.autocast>: Context manager of autocast
+    """
+    return torch.autocast(device_type=device_type, dtype=dtype, enabled=dtype is not None)
+
+def build_grad_scaler(dtype, device_type='cuda'):
+    """
+    Loss scaling is required only for float16, whose exponent range is narrow.
+    Args:
+        dtype <torch.dtype>: Data type of autocast
+        device_type <str>: 'cuda' or 'cpu'
+    Returns:
+        scaler <torch.amp.GradScaler>: Grad scaler, which is no-op unless `dtype` is float16 on CUDA.
+    """
+    enabled = dtype == torch.float16 and device_type == 'cuda'
+
+    return torch.amp.GradScaler(device_type, enabled=enabled)
+
+def float32(func):
+    """
+    Decorator for numerically sensitive function, e.g. SDR or STFT.
+    Half precision tensors are cast to float32 (complex64 for complex32), and `func` runs with autocast disabled.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        args = [_to_float32(arg) for arg in args]
+        kwargs = {key: _to_float32(value) for key, value in kwargs.items()}
+
+        if not _is_autocast_enabled():
+            return func(*args, **kwargs)
+
+        with torch.autocast(device_type='cuda', enabled=False), torch.autocast(device_type='cpu', enabled=False):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+def _is_autocast_enabled():
+    return torch.is_autocast_enabled('cuda') or torch.is_autocast_enabled('cpu')
+
+def _to_float32(input):
+    if not torch.is_tensor(input):
+        return input
+
+    if input.dtype in [torch.float16, torch.bfloat16]:
+        return input.float()
+
+    if input.dtype == torch.complex32:
+        return input.to(torch.complex64)
+
+    return input
+
+def _test_float32():
+    @float32
+    def dtype_of(input):
+        return (input * input).dtype
+
+    input = torch.randn(4, 16)
+
+    with autocast('cpu', dtype=torch.bfloat16):
+        print(torch.matmul(input, input.t()).dtype, dtype_of(input.bfloat16()))
+
+if __name__ == '__main__':
+    _test_float32()
@@ -1,4 +1,6 @@
+import torch
 import torch.nn as nn
+import torch.utils.checkpoint
 
 def choose_nonlinear(name, **kwargs):
     if name == 'relu':
@@ -27,4 +29,41 @@ def choose_rnn(name, **kwargs):
     else:
         raise NotImplementedError("Invalid RNN is specified. Choose 'rnn', 'lstm', or 'gru' instead of {}.".format(name))
     
-    return rnn
\ No newline at end of file
+    return rnn
+
+def checkpoint_forward(module, *args, enabled=True):
+    """
+    Forward `module` with activation (gradient) checkpointing.
+    Intermediate activations of `module` are not stored, but recomputed in backward, which trades compute for memory.
+    Args:
+        module <nn.Module>: Module to be checkpointed, e.g. one block of separator
+        args: Inputs of `module`
+        enabled <bool>: If False or gradients are not required, `module` is called as usual.
+    Returns:
+        output: Output of `module`
+    """
+    if enabled and torch.is_grad_enabled():
+        return torch.utils.checkpoint.checkpoint(module, *args, use_reentrant=False)
+
+    return module(*args)
+
+def _test_checkpoint_forward():
+    torch.manual_seed(111)
+
+    module = nn.Sequential(nn.Linear(16, 32), nn.Tanh(), nn.Linear(32, 16))
+    input = torch.randn(4, 16)
+
+    outputs, grads = [], []
+
+    for enabled in [False, True]:
+        module.zero_grad()
+        x = input.clone().requires_grad_()
+        output = checkpoint_forward(module, x, enabled=enabled)
+        output.pow(2).sum().backward()
+        outputs.append(output.detach())
+        grads.append([x.grad] + [p.grad.clone() for p in module.parameters()])
+
+    print(torch.allclose(outputs[0], outputs[1]), all([torch.allclose(grad, grad_ckpt) for grad, grad_ckpt in zip(*grads)]))
+
+if __name__ == '__main__':
+    _test_checkpoint_forward()
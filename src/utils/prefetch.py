@@ -0,0 +1,228 @@
+import time
+import queue
+import threading
+
+import torch
+
+DEFAULT_N_PREFETCH = 2
+
+class PrefetchLoader:
+    """
+    Wrapper of data loader, which stages next `n_prefetch` batches on a background thread.
+    If `device` is CUDA, batches are pinned and copied to the device on a side stream with non-blocking transfer.
+    Without device, loading (e.g. collation, or reading audio when num_workers=0) still overlaps with computation in main thread.
+    Time spent waiting for data is measured per step, which tells whether the input pipeline is the bottleneck.
+    Args:
+        loader <torch.utils.data.DataLoader>: Data loader to be wrapped
+        device <torch.device>: Device to which batches are moved. If None, batches are yielded as they are.
+        n_prefetch <int>: Number of batches staged in advance
+        verbose <bool>: If True, data wait time is reported at the end of every epoch.
+    """
+    def __init__(self, loader, device=None, n_prefetch=DEFAULT_N_PREFETCH, verbose=False):
+        assert n_prefetch > 0, "n_prefetch is expected positive, but given {}.".format(n_prefetch)
+
+        if device is not None:
+            device = torch.device(device)
+
+            if device.type == 'cuda' and device.index is None:
+                device = torch.device('cuda', torch.cuda.current_device())
+
+        self.loader = loader
+        self.device = device
+        self.n_prefetch = n_prefetch
+        self.verbose = verbose
+
+        self.wait_time = 0
+        self.last_wait_time = 0
+        self.n_steps = 0
+
+    def __getattr__(self, name):
+        # e.g. dataset, batch_size, sampler
+        if name == 'loader':
+            raise AttributeError(name)
+
+        return getattr(self.loader, name)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        self.wait_time = 0
+        self.last_wait_time = 0
+        self.n_steps = 0
+
+        use_cuda = self.device is not None and self.device.type == 'cuda'
+        batches = queue.Queue(maxsize=self.n_prefetch)
+        stop = threading.Event()
+
+        thread = threading.Thread(target=self._produce, args=(batches, stop), daemon=True)
+        thread.start()
+
+        start = time.time()
+
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                item = batches.get()
+                self.last_wait_time = time.perf_counter() - wait_start
+
+                if item is _END:
+                    break
+
+                if isinstance(item, _ExceptionWrapper):
+                    raise item.exception
+
+                batch, event = item
+
+                if use_cuda:
+                    stream = torch.cuda.current_stream(self.device)
+                    stream.wait_event(event)
+                    _record_stream(batch, stream)
+                    self.last_wait_time = time.perf_counter() - wait_start
+
+                self.wait_time += self.last_wait_time
+                self.n_steps += 1
+
+                yield batch
+        finally:
+            stop.set()
+
+            # Unblock producer waiting for free slot.
+            while thread.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+        if self.verbose and self.n_steps > 0:
+            elapsed = time.time() - start
+            print(self, "({:.1%} of {:.3f} [sec])".format(self.wait_time / elapsed, elapsed), flush=True)
+
+    def _produce(self, batches, stop):
+        use_cuda = self.device is not None and self.device.type == 'cuda'
+
+        if use_cuda:
+            torch.cuda.set_device(self.device)
+            stream = torch.cuda.Stream(self.device)
+        else:
+            stream = None
+
+        try:
+            for batch in self.loader:
+                if stop.is_set():
+                    return
+
+                event = None
+
+                if use_cuda:
+                    with torch.cuda.stream(stream):
+                        batch = _to_device(batch, self.device, pin_memory=True)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                elif self.device is not None:
+                    batch = _to_device(batch, self.device)
+
+                if not _put(batches, (batch, event), stop):
+                    return
+        except Exception as e:
+            _put(batches, _ExceptionWrapper(e), stop)
+            return
+
+        _put(batches, _END, stop)
+
+    def stats(self):
+        """
+        Returns:
+            stats <dict>: Data wait time of current (or last) epoch
+        """
+        stats = {
+            'wait_time': self.wait_time,
+            'n_steps': self.n_steps,
+            'wait_time_per_step': self.wait_time / self.n_steps if self.n_steps > 0 else 0
+        }
+
+        return stats
+
+    def __str__(self):
+        stats = self.stats()
+        s = "Data wait: {wait_time:.3f} [sec] in {n_steps} steps, {wait_time_per_step:.4f} [sec/step]".format(**stats)
+
+        return s
+
+def wrap_prefetch_loader(loader, args, use_cuda=False):
+    """
+    Wraps training data loader by `PrefetchLoader` if `args.prefetch` is positive.
+    Prefetching is opt-in, i.e. disabled when `prefetch` is not given.
+    Args:
+        loader <torch.utils.data.DataLoader>: Training data loader
+        args <argparse.Namespace>: Arguments including `prefetch`, number of batches staged in advance.
+        use_cuda <bool>: If True, batches are copied to current CUDA device on background thread.
+    Returns:
+        loader: Wrapped (or given) data loader
+    """
+    n_prefetch = args.prefetch if hasattr(args, 'prefetch') else 0
+
+    if n_prefetch <= 0:
+        return loader
+
+    device = torch.device('cuda') if use_cuda else None
+
+    return PrefetchLoader(loader, device=device, n_prefetch=n_prefetch, verbose=True)
+
+class _ExceptionWrapper:
+    def __init__(self, exception):
+        self.exception = exception
+
+_END = object()
+
+def _put(batches, item, stop):
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+
+    return False
+
+def _to_device(batch, device, pin_memory=False):
+    if torch.is_tensor(batch):
+        if pin_memory and not batch.is_pinned():
+            batch = batch.pin_memory()
+
+        return batch.to(device, non_blocking=pin_memory)
+    elif isinstance(batch, tuple):
+        return tuple(_to_device(item, device, pin_memory=pin_memory) for item in batch)
+    elif isinstance(batch, list):
+        return [_to_device(item, device, pin_memory=pin_memory) for item in batch]
+    elif isinstance(batch, dict):
+        return {key: _to_device(item, device, pin_memory=pin_memory) for key, item in batch.items()}
+
+    return batch
+
+def _record_stream(batch, stream):
+    if torch.is_tensor(batch):
+        batch.record_stream(stream)
+    elif isinstance(batch, (tuple, list)):
+        for item in batch:
+            _record_stream(item, stream)
+    elif isinstance(batch, dict):
+        for item in batch.values():
+            _record_stream(item, stream)
+
+def _test_prefetch_loader():
+    torch.manual_seed(111)
+
+    dataset = torch.utils.data.TensorDataset(torch.randn(16, 1, 100), torch.randn(16, 2, 100))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=4)
+    loader = PrefetchLoader(loader, n_prefetch=2)
+
+    for mixture, sources in loader:
+        time.sleep(0.01)
+        print(mixture.size(), sources.size())
+
+    print(len(loader), len(loader.dataset))
+    print(loader)
+
+if __name__ == '__main__':
+    _test_prefetch_loader()
@@ -0,0 +1,286 @@
+import os
+import time
+
+import torch
+
+from utils.distributed import get_rank
+
+PROFILE_MODES = ['none', 'timer', 'trace']
+PHASES = ['data', 'h2d', 'forward', 'loss', 'backward', 'optimizer', 'other']
+
+# Window of torch.profiler per epoch, i.e. skip `wait` steps, warm up for `warmup` steps, and record `active` steps.
+DEFAULT_PROFILE_WAIT, DEFAULT_PROFILE_WARMUP, DEFAULT_PROFILE_ACTIVE = 5, 2, 5
+
+class ProfiledLoader:
+    """
+    Wrapper of training data loader, which measures time of each phase in training steps.
+    Phases are separated by hooks of `model` and `optimizer`, so training loop does not have to be modified.
+        data: Waiting for next batch
+        h2d: From batch is given to forward, e.g. copying batch to device
+        forward: Forward of `model`
+        loss: From end of forward to start of backward of `model`, e.g. criterion, zero_grad and backward of criterion
+        backward: From start of backward of `model` to `optimizer.step`, e.g. gradient clipping
+        optimizer: `optimizer.step`
+        other: Rest of step, e.g. logging
+    Throughput (examples/sec) and real time factor (processing time / duration of training audio) are reported at the end of every epoch.
+    With CUDA, device is synchronized at every boundary of phases for accurate timing, which slows down training a little.
+    Args:
+        loader <torch.utils.data.DataLoader>: Training data loader to be wrapped
+        model <nn.Module>: Model to be trained
+        optimizer <torch.optim.Optimizer>: Optimizer
+        duration <float>: Duration [sec] of one training example. If None, real time factor is not reported.
+        use_cuda <bool>: If True, device is synchronized to measure time.
+        trace_dir <str>: If given, `torch.profiler` traces a window of steps every epoch and exports it as Chrome trace file to `trace_dir`.
+        verbose <bool>: If True, timing is reported at the end of every epoch.
+    """
+    def __init__(self, loader, model, optimizer, duration=None, use_cuda=False, trace_dir=None, verbose=True):
+        self.loader = loader
+        self.model = model
+        self.optimizer = optimizer
+
+        self.duration = duration
+        self.use_cuda = use_cuda
+        self.trace_dir = trace_dir
+        self.verbose = verbose
+
+        if self.trace_dir is not None:
+            os.makedirs(self.trace_dir, exist_ok=True)
+
+        self.n_epochs = 0
+        self._reset_stats()
+
+        self.in_step = False
+
+        self.model.register_forward_pre_hook(self._forward_pre_hook)
+        self.model.register_forward_hook(self._forward_hook)
+        self.optimizer.register_step_pre_hook(self._step_pre_hook)
+        self.optimizer.register_step_post_hook(self._step_post_hook)
+
+    def __getattr__(self, name):
+        # e.g. dataset, batch_size, sampler
+        if name == 'loader':
+            raise AttributeError(name)
+
+        return getattr(self.loader, name)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        self._reset_stats()
+        self.n_epochs += 1
+
+        profiler = self._build_profiler()
+
+        if profiler is not None:
+            profiler.start()
+
+        iterator = iter(self.loader)
+        self._start_phase('data')
+
+        try:
+            while True:
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    break
+
+                self._start_phase('h2d')
+                self.n_steps += 1
+                self.n_examples += _batch_size(batch)
+
+                self.in_step = True
+
+                yield batch
+
+                self.in_step = False
+                self._start_phase('data')
+
+                if profiler is not None:
+                    profiler.step()
+        finally:
+            self.in_step = False
+            self._stop_phase()
+
+            if profiler is not None:
+                profiler.stop()
+
+        if self.verbose and self.n_steps > 0:
+            print(self, flush=True)
+
+    def _reset_stats(self):
+        self.times = {phase: 0 for phase in PHASES}
+        self.n_steps = 0
+        self.n_examples = 0
+
+        self.phase = None
+        self.phase_start = None
+
+    def _synchronize(self):
+        if self.use_cuda and torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    def _start_phase(self, phase):
+        self._stop_phase()
+
+        self.phase = phase
+        self.phase_start = time.perf_counter()
+
+    def _stop_phase(self):
+        if self.phase is None:
+            return
+
+        self._synchronize()
+        self.times[self.phase] += time.perf_counter() - self.phase_start
+        self.phase = None
+
+    def _forward_pre_hook(self, module, input):
+        if self.in_step and torch.is_grad_enabled():
+            self._start_phase('forward')
+
+    def _forward_hook(self, module, input, output):
+        if not (self.in_step and torch.is_grad_enabled()):
+            return
+
+        self._start_phase('loss')
+
+        output = _first_tensor(output, requires_grad=True)
+
+        if output is not None:
+            output.register_hook(self._backward_hook)
+
+    def _backward_hook(self, grad):
+        if self.in_step and self.phase == 'loss':
+            self._start_phase('backward')
+
+    def _step_pre_hook(self, optimizer, args, kwargs):
+        if self.in_step:
+            self._start_phase('optimizer')
+
+    def _step_post_hook(self, optimizer, args, kwargs):
+        if self.in_step:
+            self._start_phase('other')
+
+    def _build_profiler(self):
+        if self.trace_dir is None:
+            return None
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+
+        if self.use_cuda and torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+        schedule = torch.profiler.schedule(wait=DEFAULT_PROFILE_WAIT, warmup=DEFAULT_PROFILE_WARMUP, active=DEFAULT_PROFILE_ACTIVE, repeat=1)
+        profiler = torch.profiler.profile(activities=activities, schedule=schedule, on_trace_ready=self._export_trace)
+
+        return profiler
+
+    def _export_trace(self, profiler):
+        trace_path = os.path.join(self.trace_dir, "trace-epoch{}-rank{}.json".format(self.n_epochs, get_rank()))
+        profiler.export_chrome_trace(trace_path)
+        print("Save trace to {}".format(trace_path), flush=True)
+
+    def stats(self):
+        """
+        Returns:
+            stats <dict>: Time [sec/step] of each phase, throughput [examples/sec] and real time factor of current (or last) epoch
+        """
+        elapsed = sum(self.times.values())
+        n_steps = max(self.n_steps, 1)
+
+        stats = {
+            phase: self.times[phase] / n_steps for phase in PHASES
+        }
+        stats['step'] = elapsed / n_steps
+        stats['examples_per_sec'] = self.n_examples / elapsed if elapsed > 0 else 0
+
+        if self.duration is not None and self.n_examples > 0:
+            stats['rtf'] = elapsed / (self.duration * self.n_examples)
+        else:
+            stats['rtf'] = None
+
+        return stats
+
+    def __str__(self):
+        stats = self.stats()
+
+        s = "Step time: {:.4f} [sec/step] (".format(stats['step'])
+        s += ", ".join(["{} {:.4f}".format(phase, stats[phase]) for phase in PHASES])
+        s += "), {:.2f} [examples/sec]".format(stats['examples_per_sec'])
+
+        if stats['rtf'] is not None:
+            s += ", RTF {:.4f}".format(stats['rtf'])
+
+        return s
+
+def wrap_profiled_loader(loader, model, optimizer, args, use_cuda=False):
+    """
+    Wraps training data loader by `ProfiledLoader` if `args.profile` is 'timer' or 'trace'.
+    Args:
+        loader <torch.utils.data.DataLoader>: Training data loader
+        model <nn.Module>: Model to be trained
+        optimizer <torch.optim.Optimizer>: Optimizer
+        args <argparse.Namespace>: Arguments including `profile` and `profile_dir`. `duration` is used for real time factor if given.
+        use_cuda <bool>: If True, device is synchronized to measure time.
+    Returns:
+        loader: Wrapped (or given) data loader
+    """
+    profile = args.profile if hasattr(args, 'profile') else 'none'
+
+    if profile == 'none':
+        return loader
+
+    assert profile in PROFILE_MODES, "profile is expected one of {}, but given {}.".format(PROFILE_MODES, profile)
+
+    duration = args.duration if hasattr(args, 'duration') else None
+    trace_dir = args.profile_dir if profile == 'trace' else None
+
+    return ProfiledLoader(loader, model, optimizer, duration=duration, use_cuda=use_cuda, trace_dir=trace_dir)
+
+def _batch_size(batch):
+    tensor = _first_tensor(batch)
+
+    if tensor is None or tensor.dim() == 0:
+        return 0
+
+    return tensor.size(0)
+
+def _first_tensor(obj, requires_grad=False):
+    if torch.is_tensor(obj):
+        if requires_grad and not obj.requires_grad:
+            return None
+        return obj
+    elif isinstance(obj, (tuple, list)):
+        for item in obj:
+            tensor = _first_tensor(item, requires_grad=requires_grad)
+            if tensor is not None:
+                return tensor
+    elif isinstance(obj, dict):
+        for item in obj.values():
+            tensor = _first_tensor(item, requires_grad=requires_grad)
+            if tensor is not None:
+                return tensor
+
+    return None
+
+def _test_profiled_loader():
+    torch.manual_seed(111)
+
+    dataset = torch.utils.data.TensorDataset(torch.randn(16, 1, 100), torch.randn(16, 2, 100))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=4)
+
+    model = torch.nn.Conv1d(1, 2, kernel_size=3, padding=1)
+    optimizer = torch.optim.Adam(model.parameters())
+    loader = ProfiledLoader(loader, model, optimizer, duration=100 / 8000)
+
+    for mixture, sources in loader:
+        estimated_sources = model(mixture)
+        loss = torch.mean((estimated_sources - sources)**2)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    print(loader.stats())
+
+if __name__ == '__main__':
+    _test_profiled_loader()
@@ -0,0 +1,175 @@
+import os
+import json
+
+import torch
+import torchaudio
+import torchaudio.functional as aF
+
+RESAMPLED_CORPUS_VERSION = 1
+RESAMPLED_CORPUS_DIR = '.resampled'
+RESAMPLED_CORPUS_INDEX = 'index.json'
+
+class ResampledCorpus:
+    """
+    Corpus resampled offline by `build_resampled_corpus`.
+    Files keep relative paths of original corpus under `<cache_root>/sr<sample_rate>`, and `index.json` keeps number of samples of each file.
+    Args:
+        corpus_dir <str>: Directory built by `build_resampled_corpus`
+    """
+    def __init__(self, corpus_dir):
+        self.corpus_dir = os.path.abspath(corpus_dir)
+
+        index_path = os.path.join(self.corpus_dir, RESAMPLED_CORPUS_INDEX)
+
+        with open(index_path) as f:
+            index = json.load(f)
+
+        self.sample_rate = index['sample_rate']
+        self.num_frames = index['num_frames']
+
+    def path(self, rel_path):
+        """
+        Args:
+            rel_path <str>: Relative path of file in original corpus
+        Returns:
+            path <str>: Path to resampled file
+        """
+        return os.path.join(self.corpus_dir, rel_path)
+
+    def __contains__(self, rel_path):
+        return rel_path in self.num_frames
+
+def get_corpus_dir(root, sample_rate, cache_root=None):
+    """
+    Args:
+        root <str>: Root directory of original corpus
+        sample_rate <int>: Target sampling rate
+        cache_root <str>: Root directory of resampled corpora. Default: `<root>/.resampled`
+    Returns:
+        corpus_dir <str>: Directory of resampled corpus
+    """
+    if cache_root is None:
+        cache_root = os.path.join(root, RESAMPLED_CORPUS_DIR)
+
+    return os.path.join(cache_root, 'sr{}'.format(sample_rate))
+
+def load_resampled_corpus(root, sample_rate, rel_paths=None, cache_root=None):
+    """
+    Args:
+        root <str>: Root directory of original corpus
+        sample_rate <int>: Target sampling rate
+        rel_paths <list<str>>: Relative paths required to be included. If None, not checked.
+        cache_root <str>: Root directory of resampled corpora. Default: `<root>/.resampled`
+    Returns:
+        corpus <ResampledCorpus>: Resampled corpus if exists and includes all `rel_paths`, otherwise None.
+    """
+    corpus_dir = get_corpus_dir(root, sample_rate, cache_root=cache_root)
+    index_path = os.path.join(corpus_dir, RESAMPLED_CORPUS_INDEX)
+
+    if not os.path.exists(index_path):
+        return None
+
+    try:
+        corpus = ResampledCorpus(corpus_dir)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if corpus.sample_rate != sample_rate:
+        return None
+
+    if rel_paths is not None:
+        for rel_path in rel_paths:
+            if rel_path not in corpus:
+                return None
+
+    return corpus
+
+class _ResampleDataset(torch.utils.data.Dataset):
+    def __init__(self, root, corpus_dir, rel_paths, sample_rate):
+        super().__init__()
+
+        self.root = root
+        self.corpus_dir = corpus_dir
+        self.rel_paths = rel_paths
+        self.sample_rate = sample_rate
+
+    def __getitem__(self, idx):
+        rel_path = self.rel_paths[idx]
+        path = os.path.join(self.corpus_dir, rel_path)
+
+        if os.path.exists(path):
+            # Written by previous (interrupted) run.
+            audio_info = torchaudio.info(path)
+
+            if audio_info.sample_rate == self.sample_rate:
+                return rel_path, audio_info.num_frames
+
+        waveform, sample_rate = torchaudio.load(os.path.join(self.root, rel_path))
+
+        if sample_rate != self.sample_rate:
+            waveform = aF.resample(waveform, sample_rate, self.sample_rate)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        root, ext = os.path.splitext(path)
+        tmp_path = '{}.{}.tmp{}'.format(root, os.getpid(), ext)
+        torchaudio.save(tmp_path, waveform, self.sample_rate)
+        os.replace(tmp_path, path)
+
+        return rel_path, waveform.size(-1)
+
+    def __len__(self):
+        return len(self.rel_paths)
+
+def build_resampled_corpus(root, rel_paths, sample_rate, cache_root=None, num_workers=0):
+    """
+    Load resampled corpus if exists, otherwise resample every file once and save it.
+    Files which have already been written are reused, so an interrupted run can be resumed.
+    Resampled signals are saved in 32-bit float to avoid requantization.
+    Args:
+        root <str>: Root directory of original corpus
+        rel_paths <list<str>>: Relative paths of audio files under `root`
+        sample_rate <int>: Target sampling rate
+        cache_root <str>: Root directory of resampled corpora. Default: `<root>/.resampled`
+        num_workers <int>: Number of processes to resample files.
+    Returns:
+        corpus <ResampledCorpus>: Resampled corpus
+    """
+    root = os.path.abspath(root)
+    corpus = load_resampled_corpus(root, sample_rate, rel_paths=rel_paths, cache_root=cache_root)
+
+    if corpus is not None:
+        return corpus
+
+    corpus_dir = get_corpus_dir(root, sample_rate, cache_root=cache_root)
+    os.makedirs(corpus_dir, exist_ok=True)
+
+    dataset = _ResampleDataset(root, corpus_dir, rel_paths, sample_rate)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=None, shuffle=False, num_workers=num_workers)
+
+    previous = load_resampled_corpus(root, sample_rate, cache_root=cache_root)
+
+    if previous is None:
+        num_frames = {}
+    else:
+        # Keep files of previous builds, e.g. other subset of corpus.
+        num_frames = dict(previous.num_frames)
+
+    for rel_path, n_frames in loader:
+        num_frames[rel_path] = int(n_frames)
+
+    index = {
+        'version': RESAMPLED_CORPUS_VERSION,
+        'sample_rate': sample_rate,
+        'num_frames': num_frames
+    }
+
+    index_path = os.path.join(corpus_dir, RESAMPLED_CORPUS_INDEX)
+    tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+
+    os.replace(tmp_path, index_path)
+
+    return ResampledCorpus(corpus_dir)
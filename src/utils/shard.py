@@ -0,0 +1,188 @@
+import os
+import json
+
+import numpy as np
+import torch
+
+SHARD_INDEX = 'index.json'
+SHARD_BYTES = 1 << 30
+INT16_SCALE = 32768
+
+"""
+    Packed audio shards
+    All stems of an item are stored as one contiguous int16 block with shape (n_stems * n_channels, n_samples).
+    Blocks are appended to `shard-XXXXX.bin` files, and `index.json` keeps (shard, offset, n_channels, n_samples) of each item.
+"""
+
+def float_to_int16(input):
+    """
+    Args:
+        input <torch.Tensor>: Float tensor in [-1, 1)
+    Returns:
+        output <numpy.ndarray>: int16 array with same shape as input
+    """
+    output = torch.round(input * INT16_SCALE).clamp(-INT16_SCALE, INT16_SCALE - 1)
+    output = output.to(torch.int16).numpy()
+
+    return output
+
+def int16_to_float(input):
+    """
+    Args:
+        input <torch.Tensor>: int16 tensor
+    Returns:
+        output <torch.Tensor>: Float tensor in [-1, 1)
+    """
+    output = input.float() / INT16_SCALE
+
+    return output
+
+def pack_shards(items, shard_root, stems, sample_rate=None, shard_bytes=SHARD_BYTES):
+    """
+    Args:
+        items <iterable<tuple<str, dict<str, str>>>>: Pairs of item ID and paths of stems, i.e. (ID, {stem: path}).
+        shard_root <str>: Directory to save shards and index.
+        stems <list<str>>: Order of stems in each block, e.g. ['mix', 's1', 's2'].
+        sample_rate <int>: Expected sampling rate. If None, sampling rate of the first file is used.
+        shard_bytes <int>: Maximum size of each shard file. A single item larger than `shard_bytes` occupies its own shard.
+    Returns:
+        index <dict>: Content of `index.json`
+    """
+    import torchaudio
+
+    os.makedirs(shard_root, exist_ok=True)
+
+    shards = []
+    IDs, entries = [], []
+
+    shard_file = None
+    shard_size = 0
+
+    try:
+        for ID, paths in items:
+            block = []
+            n_channels = None
+
+            for stem in stems:
+                wave, _sample_rate = torchaudio.load(paths[stem])
+
+                if sample_rate is None:
+                    sample_rate = _sample_rate
+                elif _sample_rate != sample_rate:
+                    raise ValueError("Sampling rate of {} is {}, but {} is expected.".format(paths[stem], _sample_rate, sample_rate))
+
+                if n_channels is None:
+                    n_channels, n_samples = wave.size()
+                elif wave.size() != (n_channels, n_samples):
+                    raise ValueError("All stems of {} are expected to have shape {}, but {} has {}.".format(ID, (n_channels, n_samples), paths[stem], tuple(wave.size())))
+
+                block.append(float_to_int16(wave))
+
+            block = np.ascontiguousarray(np.concatenate(block, axis=0)) # (n_stems * n_channels, n_samples)
+
+            if shard_file is None or (shard_size > 0 and shard_size + block.nbytes > shard_bytes):
+                if shard_file is not None:
+                    shard_file.close()
+
+                shard_name = "shard-{:05d}.bin".format(len(shards))
+                shard_file = open(os.path.join(shard_root, shard_name), 'wb')
+                shards.append(shard_name)
+                shard_size = 0
+
+            offset = shard_size // block.itemsize
+            shard_file.write(block.tobytes())
+            shard_size += block.nbytes
+
+            IDs.append(ID)
+            entries.append([len(shards) - 1, offset, n_channels, n_samples])
+    finally:
+        if shard_file is not None:
+            shard_file.close()
+
+    index = {
+        'dtype': 'int16',
+        'sample_rate': sample_rate,
+        'stems': stems,
+        'shards': shards,
+        'IDs': IDs,
+        'items': entries
+    }
+
+    index_path = os.path.join(shard_root, SHARD_INDEX)
+    tmp_path = index_path + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+
+    os.replace(tmp_path, index_path)
+
+    return index
+
+class ShardReader:
+    """
+    Read-only access to packed shards through `np.memmap`.
+    Memory maps are opened lazily, so that every DataLoader worker holds its own maps.
+    """
+    def __init__(self, shard_root):
+        self.shard_root = os.path.abspath(shard_root)
+
+        index_path = os.path.join(self.shard_root, SHARD_INDEX)
+
+        if not os.path.exists(index_path):
+            raise FileNotFoundError("{} is not found. Pack the corpus with `pack_shards` first.".format(index_path))
+
+        with open(index_path) as f:
+            index = json.load(f)
+
+        self.sample_rate = index['sample_rate']
+        self.stems = index['stems']
+        self.shards = index['shards']
+        self.IDs = index['IDs']
+        self.items = index['items']
+
+        self.ID_to_idx = {ID: item_idx for item_idx, ID in enumerate(self.IDs)}
+
+        self._memmaps = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_memmaps'] = None
+
+        return state
+
+    def __len__(self):
+        return len(self.IDs)
+
+    def __contains__(self, ID):
+        return ID in self.ID_to_idx
+
+    def num_samples(self, ID):
+        _, _, _, n_samples = self.items[self.ID_to_idx[ID]]
+
+        return n_samples
+
+    def read(self, ID, start=0, end=None):
+        """
+        Args:
+            ID <str>: Item ID
+            start <int>: Start sample
+            end <int>: End sample. If None, the end of item is used.
+        Returns:
+            output <torch.Tensor>: int16 view with shape (n_stems, n_channels, end - start), which shares memory with the shard file.
+        """
+        if self._memmaps is None:
+            self._memmaps = [
+                np.memmap(os.path.join(self.shard_root, shard_name), dtype=np.int16, mode='c') for shard_name in self.shards
+            ]
+
+        shard_idx, offset, n_channels, n_samples = self.items[self.ID_to_idx[ID]]
+
+        if end is None:
+            end = n_samples
+
+        n_stems = len(self.stems)
+        block = self._memmaps[shard_idx][offset: offset + n_stems * n_channels * n_samples]
+        block = block.reshape(n_stems, n_channels, n_samples)[:, :, start: end]
+        output = torch.from_numpy(block)
+
+        return output
@@ -0,0 +1,260 @@
+import os
+import math
+import wave
+import tempfile
+import subprocess
+import multiprocessing
+import concurrent.futures
+from collections import deque
+
+import numpy as np
+import torch
+
+try:
+    from pesq import pesq as _pesq
+except ImportError:
+    _pesq = None
+
+try:
+    from pystoi import stoi as _stoi
+except ImportError:
+    _stoi = None
+
+MIN_PESQ = -0.5
+MAX_PESQ = 4.5
+DEFAULT_N_WORKERS = 4
+PESQ_BACKENDS = ['python', 'binary']
+
+class SpeechQualityEvaluator:
+    """
+    Evaluates PESQ (and STOI) of separated sources on a pool of worker processes, so that evaluation overlaps with separation of next utterances.
+    With 'python' backend, PESQ is computed in worker processes by `pesq` package, i.e. no temporary files and no subprocesses.
+    With 'binary' backend, PESQ executable (e.g. ./PESQ) is called in worker processes as before.
+    Results are returned in submitted order. If PESQ fails for a source, the source is regarded as MIN_PESQ, and the failure is counted in `n_pesq_error`.
+    Args:
+        sample_rate <int>: Sampling rate
+        num_workers <int>: Number of worker processes. If 0, evaluation is done in main process when submitted.
+        backend <str>: 'python' or 'binary'. If None, 'python' is used when `pesq` package is installed, otherwise 'binary'.
+        pesq_path <str>: Path to PESQ executable for 'binary' backend. Default: ./PESQ
+        mode <str>: Mode of `pesq` package, 'nb' (narrow-band P.862) or 'wb' (wide-band P.862.2).
+            With 'nb', MOS-LQO (P.862.1) returned by `pesq` package is mapped back to raw P.862 score, i.e. same scale as PESQ executable.
+            With 'wb', score is MOS-LQO of P.862.2, which is not comparable with PESQ executable.
+        stoi <bool>: If True, STOI is also computed by `pystoi` package.
+    """
+    def __init__(self, sample_rate, num_workers=DEFAULT_N_WORKERS, backend=None, pesq_path=None, mode='nb', stoi=False):
+        if backend is None:
+            backend = 'python' if _pesq is not None else 'binary'
+
+        assert backend in PESQ_BACKENDS, "backend is expected one of {}, but given {}.".format(PESQ_BACKENDS, backend)
+
+        if backend == 'python' and _pesq is None:
+            raise ImportError("pesq package is required for backend='python'.")
+        if stoi and _stoi is None:
+            raise ImportError("pystoi package is required for stoi=True.")
+
+        if pesq_path is None:
+            pesq_path = './PESQ'
+
+        if backend == 'binary' and not os.path.isfile(pesq_path):
+            raise FileNotFoundError("PESQ executable is not found at {}. Install pesq package or put PESQ executable.".format(pesq_path))
+
+        self.sample_rate = sample_rate
+        self.num_workers = num_workers
+        self.backend = backend
+        self.pesq_path = os.path.abspath(pesq_path)
+        self.mode = mode
+        self.stoi = stoi
+
+        self.executor = None
+        self.pending = deque()
+        self.n_pesq_error = 0
+
+    def submit(self, reference_sources, estimated_sources, info=None):
+        """
+        Args:
+            reference_sources <torch.Tensor>: (n_sources, T)
+            estimated_sources <torch.Tensor>: (n_sources, T), which is ordered same as `reference_sources`.
+            info: Returned with scores, e.g. utterance ID and other metrics.
+        """
+        reference_sources = _to_numpy(reference_sources)
+        estimated_sources = _to_numpy(estimated_sources)
+        kwargs = {
+            'sample_rate': self.sample_rate,
+            'backend': self.backend,
+            'pesq_path': self.pesq_path,
+            'mode': self.mode,
+            'stoi': self.stoi
+        }
+
+        if self.num_workers > 0:
+            if self.executor is None:
+                # Worker processes do not touch CUDA, but forking a process which uses CUDA is unsafe.
+                context = multiprocessing.get_context('spawn')
+                self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers, mp_context=context)
+
+            future = self.executor.submit(evaluate_utterance, reference_sources, estimated_sources, **kwargs)
+        else:
+            future = concurrent.futures.Future()
+            future.set_result(evaluate_utterance(reference_sources, estimated_sources, **kwargs))
+
+        self.pending.append((future, info))
+
+    def collect(self, block=False):
+        """
+        Args:
+            block <bool>: If True, waits for all submitted utterances. Otherwise, only finished ones at head are returned.
+        Yields:
+            info: Given at `submit`
+            pesq <float>: PESQ averaged over sources
+            stoi <float>: STOI averaged over sources. None if `stoi=False`.
+        """
+        while len(self.pending) > 0 and (block or self.pending[0][0].done()):
+            future, info = self.pending.popleft()
+            pesq_scores, stoi_scores = future.result()
+
+            pesq = 0
+
+            for score in pesq_scores:
+                if score is None:
+                    # If processing error occurs in PESQ, it is regarded as PESQ score is -0.5. (minimum of PESQ)
+                    self.n_pesq_error += 1
+                    pesq += MIN_PESQ
+                else:
+                    pesq += score
+
+            pesq /= len(pesq_scores)
+
+            if stoi_scores is None:
+                stoi = None
+            else:
+                stoi = sum(stoi_scores) / len(stoi_scores)
+
+            yield info, pesq, stoi
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+def evaluate_utterance(reference_sources, estimated_sources, sample_rate, backend='python', pesq_path=None, mode='nb', stoi=False):
+    """
+    Args:
+        reference_sources <np.ndarray>: (n_sources, T)
+        estimated_sources <np.ndarray>: (n_sources, T)
+    Returns:
+        pesq_scores <list<float>>: PESQ of each source. None if PESQ fails.
+        stoi_scores <list<float>>: STOI of each source. None if `stoi=False`.
+    """
+    pesq_scores = []
+    stoi_scores = [] if stoi else None
+
+    for reference, estimated in zip(reference_sources, estimated_sources):
+        # Same as 16-bit wav files given to PESQ executable
+        reference, estimated = _quantize(reference), _quantize(estimated)
+
+        if backend == 'python':
+            score = _evaluate_pesq(reference, estimated, sample_rate, mode=mode)
+        else:
+            score = _evaluate_pesq_binary(reference, estimated, sample_rate, pesq_path)
+
+        pesq_scores.append(score)
+
+        if stoi:
+            stoi_scores.append(float(_stoi(reference, estimated, sample_rate, extended=False)))
+
+    return pesq_scores, stoi_scores
+
+def _evaluate_pesq(reference, estimated, sample_rate, mode='nb'):
+    try:
+        score = float(_pesq(sample_rate, reference, estimated, mode))
+    except Exception:
+        return None
+
+    if mode == 'nb':
+        score = _mos_lqo_to_raw(score)
+
+    return score
+
+def _mos_lqo_to_raw(mos_lqo):
+    """
+    Inverse of P.862.1 mapping, mos_lqo = 0.999 + 4 / (1 + exp(-1.4945 * raw + 4.6607)).
+    Args:
+        mos_lqo <float>: MOS-LQO in (0.999, 4.999)
+    Returns:
+        raw <float>: Raw P.862 score in [MIN_PESQ, MAX_PESQ]
+    """
+    if mos_lqo <= 0.999:
+        return MIN_PESQ
+    if mos_lqo >= 4.999:
+        return MAX_PESQ
+
+    raw = (4.6607 - math.log(4 / (mos_lqo - 0.999) - 1)) / 1.4945
+
+    return min(max(raw, MIN_PESQ), MAX_PESQ)
+
+def _evaluate_pesq_binary(reference, estimated, sample_rate, pesq_path):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        reference_path, estimated_path = os.path.join(tmp_dir, "target.wav"), os.path.join(tmp_dir, "estimated.wav")
+        _write_wav(reference_path, reference, sample_rate)
+        _write_wav(estimated_path, estimated, sample_rate)
+
+        # PESQ executable writes its result file to current directory.
+        process = subprocess.run([pesq_path, "+{}".format(sample_rate), reference_path, estimated_path], cwd=tmp_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    for line in process.stdout.decode(errors='ignore').splitlines():
+        if 'Prediction' in line:
+            try:
+                return float(line.split()[4])
+            except (IndexError, ValueError):
+                return None
+
+    return None
+
+def _quantize(signal):
+    norm = np.abs(signal).max()
+
+    if norm > 0:
+        signal = signal / norm
+
+    signal = np.clip(np.round(signal * 32768), -32768, 32767)
+
+    return signal
+
+def _write_wav(path, signal, sample_rate):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(signal.astype('<i2').tobytes())
+
+def _to_numpy(signal):
+    if torch.is_tensor(signal):
+        signal = signal.detach().cpu().double().numpy()
+
+    return np.asarray(signal, dtype=np.float64)
+
+def _test_speech_quality_evaluator():
+    torch.manual_seed(111)
+
+    sample_rate, n_sources, T = 8000, 2, 24000
+    t = torch.arange(T) / sample_rate
+    reference_sources = torch.stack([torch.sin(2 * np.pi * 440 * t), torch.sin(2 * np.pi * 660 * t)], dim=0) * (torch.rand(n_sources, T) > 0.3)
+
+    evaluator = SpeechQualityEvaluator(sample_rate, num_workers=2)
+
+    for idx in range(4):
+        estimated_sources = reference_sources + 0.1 * (idx + 1) * torch.randn(n_sources, T)
+        evaluator.submit(reference_sources, estimated_sources, info="utterance-{}".format(idx))
+
+    for info, pesq, _ in evaluator.collect(block=True):
+        print("{}, {:.3f}".format(info, pesq))
+
+    evaluator.close()
+    print("Evaluation of PESQ returns error {} times.".format(evaluator.n_pesq_error))
+
+    # P.862.1 maps raw PESQ 2.0 to MOS-LQO about 1.63.
+    mos_lqo = 0.999 + 4 / (1 + math.exp(- 1.4945 * 2.0 + 4.6607))
+    print("MOS-LQO {:.3f} -> raw PESQ {:.3f}".format(mos_lqo, _mos_lqo_to_raw(mos_lqo)))
+
+if __name__ == '__main__':
+    _test_speech_quality_evaluator()
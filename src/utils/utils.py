@@ -3,7 +3,7 @@ import random
 import zipfile
 
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import torch
 
 def set_seed(seed):
@@ -12,25 +12,26 @@ def set_seed(seed):
     torch.manual_seed(seed)
 
 def draw_loss_curve(train_loss, valid_loss=None, save_path='./loss.png'):
-    plt.figure()
+    # Figure is not registered to pyplot, so that this function can be called on a background thread.
+    fig = Figure()
+    ax = fig.add_subplot()
 
     epochs = range(1, len(train_loss) + 1)
 
     if isinstance(train_loss, torch.Tensor):
         train_loss = train_loss.numpy()
 
-    plt.plot(epochs, train_loss, label='train')
+    ax.plot(epochs, train_loss, label='train')
 
     if valid_loss is not None:
         if isinstance(valid_loss, torch.Tensor):
             valid_loss = valid_loss.numpy()
-        plt.plot(epochs, valid_loss, label='valid')
+        ax.plot(epochs, valid_loss, label='valid')
 
-    plt.xlabel('Epochs')
-    plt.ylabel('Loss')
-    plt.legend()
-    plt.savefig(save_path, bbox_inches='tight')
-    plt.close()
+    ax.set_xlabel('Epochs')
+    ax.set_ylabel('Loss')
+    ax.legend()
+    fig.savefig(save_path, bbox_inches='tight')
 
 def download_pretrained_model_from_google_drive(model_id, path="./tmp", quiet=False, remove_zip=True):
     import gdown
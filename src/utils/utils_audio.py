@@ -4,6 +4,8 @@ import warnings
 import numpy as np
 import torch
 
+from utils.mixed_precision import float32
+
 def read_wav(path):
     from scipy.io import wavfile
     warnings.warn("Use torchaudio.load instead.", DeprecationWarning)
@@ -83,3 +85,39 @@ def build_optimal_window(window, hop_size=None):
     optimal_window = window / norm
     
     return optimal_window
+
+class BatchSTFT:
+    """
+    STFT of whole batch in one call, e.g. in `collate_fn` or on training device.
+    Args:
+        fft_size <int>: FFT length
+        hop_size <int>: Hop length. If None, `fft_size // 2` is used.
+        window <torch.Tensor>: Window with shape (fft_size,)
+        normalize <bool>: `normalized` of `torch.stft`
+    """
+    def __init__(self, fft_size, hop_size=None, window=None, normalize=False):
+        if hop_size is None:
+            hop_size = fft_size // 2
+
+        self.fft_size, self.hop_size = fft_size, hop_size
+        self.window = window
+        self.normalize = normalize
+
+    @float32
+    def __call__(self, input):
+        """
+        Args:
+            input <torch.Tensor>: (*, T)
+        Returns:
+            output <torch.Tensor>: Complex tensor with shape (*, n_bins, n_frames)
+        """
+        batch_shape = input.size()[:-1]
+        input = input.reshape(-1, input.size(-1))
+
+        if self.window is not None and self.window.device != input.device:
+            self.window = self.window.to(input.device)
+
+        output = torch.stft(input, n_fft=self.fft_size, hop_length=self.hop_size, window=self.window, normalized=self.normalize, return_complex=True)
+        output = output.reshape(*batch_shape, *output.size()[-2:])
+
+        return output